@@ -0,0 +1,194 @@
+"""
+Benchmark the requests and http2 download transports against a local HTTPS server
+- hypercorn (in its own process) serves generated JPEGs over HTTP/2 and HTTP/1.1
+  with a throwaway self-signed certificate
+- Every response waits --latency seconds, standing in for a remote CDN
+- The server closes each connection after --max-requests requests (a GOAWAY on
+  HTTP/2), so the http2 run exercises the resend path; every image must still arrive
+- Reports time, throughput, files written, server-side connections and HTTP versions
+
+Requires hypercorn and the openssl command line tool.
+
+Usage:
+    python benchmarks/bench_http2.py --images 2000 --latency 0.2 --max-requests 500
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import requests
+import urllib3
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scraper import ImageScraper
+
+
+def make_cert(directory):
+    """Write a self-signed certificate for 127.0.0.1; return (certfile, keyfile)"""
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-keyout', keyfile, '-out', certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def make_jpeg(size=256):
+    """A gradient JPEG of size x size pixels"""
+    img = Image.linear_gradient('L').resize((size, size)).convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def make_app(body, latency):
+    """
+    ASGI app serving body for every path after latency seconds
+    - /stats returns the requests per HTTP version and the client connections seen so far
+    """
+    headers = [(b'content-type', b'image/jpeg'), (b'content-length', str(len(body)).encode())]
+    versions = Counter()
+    connections = set()
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['path'] == '/stats':
+            stats = json.dumps({'versions': versions, 'connections': len(connections)}).encode()
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'application/json')]})
+            await send({'type': 'http.response.body', 'body': stats})
+            return
+        versions['HTTP/' + scope['http_version']] += 1
+        connections.add(tuple(scope['client']))
+        await asyncio.sleep(latency)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    return app
+
+
+def serve(port, certfile, keyfile, latency, max_requests):
+    """Run hypercorn until the process is terminated (its connection-close noise is discarded)"""
+    sys.stderr = open(os.devnull, 'w')
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.certfile = certfile
+    config.keyfile = keyfile
+    config.alpn_protocols = ['h2', 'http/1.1']
+    config.keep_alive_max_requests = max_requests
+    config.accesslog = None
+    config.errorlog = None
+    asyncio.run(hypercorn_serve(make_app(make_jpeg(), latency), config))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_stats(port):
+    return requests.get(f"https://127.0.0.1:{port}/stats", verify=False, timeout=10).json()
+
+
+def wait_for_server(port, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return server_stats(port)
+        except requests.exceptions.RequestException:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def bench_transport(transport, port, output_dir, args):
+    """Download --images URLs with one transport; return (seconds, files written)"""
+    if transport == 'http2':
+        options = dict(max_in_flight=args.in_flight, max_streams_per_host=args.streams_per_host)
+    else:
+        options = dict(max_workers=args.workers, max_per_host=args.workers)
+    urls = [f"https://127.0.0.1:{port}/{transport}/img{i}.jpg" for i in range(args.images)]
+
+    before = server_stats(port)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log), contextlib.redirect_stderr(io.StringIO()):
+        scraper = ImageScraper(output_dir=output_dir, transport=transport, **options)
+        start = time.perf_counter()
+        scraper.download_images({'bench': [{'url': url} for url in urls]})
+        seconds = time.perf_counter() - start
+    after = server_stats(port)
+
+    category_dir = os.path.join(output_dir, 'bench')
+    files = len([name for name in os.listdir(category_dir) if not name.endswith('.part')])
+    requests_sent = Counter(after['versions']) - Counter(before['versions'])
+    versions = ', '.join(f"{version} {count}" for version, count in sorted(requests_sent.items()))
+    print(f"\n{transport}:")
+    print(f"- Time: {seconds:.2f}s ({len(urls) / seconds:,.0f} images/s)")
+    print(f"- Files: {files}/{len(urls)}")
+    print(f"- Server: {after['connections'] - before['connections']} connections, {versions} requests")
+    if files != len(urls):
+        errors = Counter(line.split(': ', 1)[-1] for line in log.getvalue().splitlines()
+                         if line.startswith('Error downloading'))
+        print(f"- Errors: {dict(errors.most_common(5))}")
+    return seconds, files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--max-requests', type=int, default=500,
+                        help='requests per server connection before it is closed (GOAWAY on HTTP/2)')
+    parser.add_argument('--workers', type=int, default=16, help='worker threads for the requests transport')
+    parser.add_argument('--in-flight', type=int, default=256, help='max_in_flight for the http2 transport')
+    parser.add_argument('--streams-per-host', type=int, default=100,
+                        help='max_streams_per_host for the http2 transport')
+    args = parser.parse_args()
+    urllib3.disable_warnings()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile, keyfile = make_cert(tmp)
+        port = free_port()
+        server = multiprocessing.Process(target=serve, daemon=True,
+                                         args=(port, certfile, keyfile, args.latency, args.max_requests))
+        server.start()
+        try:
+            wait_for_server(port)
+            print(f"Serving {args.images} images with {args.latency:.2f}s latency, "
+                  f"{args.max_requests} requests per connection")
+            results = {}
+            for transport in ('requests', 'http2'):
+                results[transport] = bench_transport(transport, port, os.path.join(tmp, transport), args)
+        finally:
+            server.terminate()
+            server.join()
+
+    print(f"\nhttp2 speedup: {results['requests'][0] / results['http2'][0]:.1f}x")
+    for transport, (_, files) in results.items():
+        assert files == args.images, f"{transport}: {files} of {args.images} images downloaded"
+
+
+if __name__ == '__main__':
+    main()
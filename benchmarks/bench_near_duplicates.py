@@ -0,0 +1,96 @@
+"""
+Benchmark perceptual hashing and the Hamming-distance near-duplicate index
+- Batched hashing throughput for ahash/dhash/phash on prepared grayscale inputs
+- Insert and query throughput of HammingIndex, checked against a brute-force scan
+- Memory per stored hash
+
+Usage:
+    python benchmarks/bench_near_duplicates.py --hashes 1000000 --queries 2000 --radius 6
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scraper import HammingIndex, PHASH_INPUT_SIZES, perceptual_hashes, popcount64
+
+
+def random_hashes(rng, count):
+    """Uniformly random 64-bit hashes"""
+    return rng.integers(0, np.iinfo(np.uint64).max, size=count, dtype=np.uint64, endpoint=True)
+
+
+def flip_bits(rng, values, bits):
+    """Copy of values with `bits` random bit positions flipped in each hash"""
+    flipped = values.copy()
+    for i in range(len(values)):
+        mask = 0
+        for position in rng.choice(64, size=bits, replace=False):
+            mask |= 1 << int(position)
+        flipped[i] ^= np.uint64(mask)
+    return flipped
+
+
+def bench_hashing(rng, count):
+    """Time batched hashing of already downscaled grayscale inputs"""
+    print(f"\nHashing {count} inputs per method:")
+    for method, (height, width) in PHASH_INPUT_SIZES.items():
+        inputs = rng.uniform(0, 255, size=(count, height, width)).astype(np.float32)
+        start = time.perf_counter()
+        perceptual_hashes(inputs, method)
+        seconds = time.perf_counter() - start
+        print(f"- {method}: {count / seconds:,.0f} hashes/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hashes', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--radius', type=int, default=6)
+    parser.add_argument('--batch', type=int, default=1000, help="hashes per add_batch call")
+    parser.add_argument('--hash-inputs', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    bench_hashing(rng, args.hash_inputs)
+
+    values = random_hashes(rng, args.hashes)
+    index = HammingIndex()
+
+    print(f"\nInserting {args.hashes:,} hashes in batches of {args.batch}...")
+    start = time.perf_counter()
+    for offset in range(0, args.hashes, args.batch):
+        index.add_batch(values[offset:offset + args.batch])
+    seconds = time.perf_counter() - start
+    print(f"- Insert: {args.hashes / seconds:,.0f} hashes/s")
+    print(f"- Memory: {index.nbytes / args.hashes:.1f} bytes/hash ({index.nbytes / 2 ** 20:.1f} MiB)")
+
+    # Half the queries are near-duplicates of stored hashes, half are unrelated
+    near = flip_bits(rng, values[rng.integers(0, args.hashes, args.queries // 2)], max(1, args.radius // 2))
+    queries = np.concatenate([near, random_hashes(rng, args.queries - len(near))])
+
+    print(f"\nQuerying {len(queries):,} hashes at radius {args.radius}...")
+    start = time.perf_counter()
+    results = [index.query(q, args.radius)[0] for q in queries]
+    seconds = time.perf_counter() - start
+    hits = sum(1 for ids in results if len(ids))
+    print(f"- Query: {len(queries) / seconds:,.0f} queries/s ({seconds / len(queries) * 1e6:.0f} us/query)")
+    print(f"- Queries with a match: {hits:,}")
+
+    # Verify a sample against a brute-force scan
+    sample = min(50, len(queries))
+    stored = index.hashes
+    start = time.perf_counter()
+    for q, ids in zip(queries[:sample], results[:sample]):
+        expected = np.nonzero(popcount64(stored ^ q) <= args.radius)[0]
+        if set(expected.tolist()) != set(ids.tolist()):
+            raise AssertionError("index results differ from brute force")
+    seconds = time.perf_counter() - start
+    print(f"- Brute-force scan for comparison: {sample / seconds:,.1f} queries/s (results match)")
+
+
+if __name__ == '__main__':
+    main()
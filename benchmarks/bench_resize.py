@@ -0,0 +1,115 @@
+"""
+Benchmark the default resize path against the fast (draft/reduce) path
+- Generates synthetic multi-megapixel JPEGs in a temporary directory
+- Reports throughput for each mode and PSNR against a full-decode LANCZOS reference
+
+Usage:
+    python benchmarks/bench_resize.py --count 20 --source-size 4000x3000 --target-size 224x224
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scraper import resize_image_file, normalize_output_format
+
+
+def parse_size(text):
+    """Parse a WIDTHxHEIGHT string"""
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def make_source_images(directory, count, size):
+    """Write photo-like JPEGs (smooth gradients plus noise) and return their paths"""
+    rng = np.random.default_rng(0)
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    paths = []
+    for i in range(count):
+        phase = rng.uniform(0, 2 * np.pi, 3)
+        channels = [
+            127 + 100 * np.sin(x / (40 + 15 * c) + y / (70 + 10 * c) + phase[c])
+            for c in range(3)
+        ]
+        pixels = np.stack(channels, axis=-1) + rng.normal(0, 12, (height, width, 3))
+        path = os.path.join(directory, f"source_{i}.jpg")
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, quality=92)
+        paths.append(path)
+    return paths
+
+
+def psnr(a, b):
+    """Peak signal-to-noise ratio between two same-sized RGB images"""
+    diff = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    mse = np.mean(diff ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def run_mode(sources, workdir, target_size, fast, output_format, quality):
+    """Resize copies of the sources with one mode; return (seconds, output paths)"""
+    copies = []
+    for path in sources:
+        copy = os.path.join(workdir, os.path.basename(path))
+        shutil.copyfile(path, copy)
+        copies.append(copy)
+
+    start = time.perf_counter()
+    for path in copies:
+        error = resize_image_file(path, target_size, fast, output_format, quality)
+        if error:
+            raise RuntimeError(f"{path}: {error}")
+    return time.perf_counter() - start, copies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--source-size', type=parse_size, default=(4000, 3000))
+    parser.add_argument('--target-size', type=parse_size, default=(224, 224))
+    parser.add_argument('--output-format', default=None, help="JPEG, WEBP or PNG (default: source format)")
+    parser.add_argument('--quality', type=int, default=None)
+    args = parser.parse_args()
+
+    output_format = normalize_output_format(args.output_format)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source_dir = os.path.join(tmp, 'source')
+        os.makedirs(source_dir)
+        print(f"Generating {args.count} images of {args.source_size[0]}x{args.source_size[1]}...")
+        sources = make_source_images(source_dir, args.count, args.source_size)
+
+        # Reference: full decode and LANCZOS, kept in memory so encoding loss is excluded
+        references = []
+        for path in sources:
+            with Image.open(path) as img:
+                references.append(img.convert('RGB').resize(args.target_size, Image.Resampling.LANCZOS))
+
+        results = {}
+        for name, fast in (('default', False), ('fast', True)):
+            workdir = os.path.join(tmp, name)
+            os.makedirs(workdir)
+            seconds, outputs = run_mode(sources, workdir, args.target_size, fast, output_format, args.quality)
+            scores = []
+            sizes = []
+            for output, reference in zip(outputs, references):
+                with Image.open(output) as img:
+                    scores.append(psnr(img.convert('RGB'), reference))
+                sizes.append(os.path.getsize(output))
+            results[name] = seconds
+            print(f"\n{name}:")
+            print(f"- Throughput: {args.count / seconds:.1f} images/s ({seconds / args.count * 1000:.1f} ms/image)")
+            print(f"- PSNR vs reference: {np.mean(scores):.2f} dB (min {np.min(scores):.2f})")
+            print(f"- Mean output size: {np.mean(sizes) / 1024:.1f} KiB ({output_format or 'source format'})")
+
+        print(f"\nSpeedup: {results['default'] / results['fast']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark URL canonicalization and the seen-URL indexes
+- Canonicalization throughput on synthetic CDN URLs with tracking/size variants
+- Insert and lookup throughput of URLKeySet and BloomFilter
+- Memory per URL, compared with a Python set of the canonical strings
+- Observed Bloom filter false-positive rate against its target
+
+Usage:
+    python benchmarks/bench_url_index.py --urls 1000000 --lookups 200000 --error-rate 0.001
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scraper import BloomFilter, CDN_VARIANT_RULES, URLCanonicalizer, URLKeySet
+
+
+def make_urls(rng, count):
+    """
+    Image URLs spread over a few hosts, drawn from count // 2 images so many repeat
+    with a different scheme, tracking params or size suffix
+    """
+    hosts = [f"cdn{i}.example.com" for i in range(8)]
+    urls = []
+    for i in rng.integers(0, max(1, count // 2), count):
+        host = hosts[i % len(hosts)]
+        scheme = 'http' if rng.random() < 0.3 else 'https'
+        suffix = f"-{rng.integers(100, 2000)}x{rng.integers(100, 2000)}" if rng.random() < 0.3 else ''
+        query = f"?utm_source=feed{rng.integers(10)}&v=1" if rng.random() < 0.5 else ''
+        urls.append(f"{scheme}://{host}/images/{i // 1000}/{i}{suffix}.jpg{query}")
+    return urls
+
+
+def python_set_bytes(strings):
+    """Memory of a set of strings: the hash table plus every string object"""
+    values = set(strings)
+    return sys.getsizeof(values) + sum(sys.getsizeof(s) for s in values)
+
+
+def bench_index(name, index, keys, lookups):
+    """Time inserts of keys and membership checks of lookups; return the lookup hit count"""
+    start = time.perf_counter()
+    for key in keys:
+        index.add(key)
+    seconds = time.perf_counter() - start
+    print(f"\n{name}:")
+    print(f"- Insert: {len(keys) / seconds:,.0f} URLs/s")
+
+    start = time.perf_counter()
+    hits = sum(1 for key in lookups if key in index)
+    seconds = time.perf_counter() - start
+    print(f"- Lookup: {len(lookups) / seconds:,.0f} URLs/s")
+    print(f"- Memory: {index.nbytes / len(index):.1f} bytes/URL ({index.nbytes / 2 ** 20:.1f} MiB)")
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--urls', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--error-rate', type=float, default=0.001)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"Generating {args.urls:,} URLs...")
+    urls = make_urls(rng, args.urls)
+
+    canonicalize = URLCanonicalizer(variant_rules=CDN_VARIANT_RULES)
+    start = time.perf_counter()
+    keys = [canonicalize(url) for url in urls]
+    seconds = time.perf_counter() - start
+    print(f"\nCanonicalization: {len(urls) / seconds:,.0f} URLs/s, {len(set(keys)):,} distinct of {len(urls):,}")
+
+    # Half the lookups are stored URLs, half were never inserted
+    half = args.lookups // 2
+    present = [keys[i] for i in rng.integers(0, len(keys), half)]
+    absent = [f"https://other.example.net/missing/{i}.jpg" for i in range(args.lookups - half)]
+    lookups = present + absent
+
+    hits = bench_index("URLKeySet (64-bit keys)", URLKeySet(), keys, lookups)
+    if hits != len(present):
+        raise AssertionError(f"URLKeySet reported {hits} hits, expected {len(present)}")
+
+    bloom = BloomFilter(capacity=len(set(keys)), error_rate=args.error_rate)
+    hits = bench_index(f"BloomFilter (p={args.error_rate}, k={bloom.num_hashes})", bloom, keys, lookups)
+    false_positives = hits - len(present)
+    print(f"- False positives: {false_positives / len(absent):.5f} (target {args.error_rate})")
+
+    print(f"\nPython set of strings: {python_set_bytes(keys) / len(set(keys)):.1f} bytes/URL")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,9 @@
 import os
 import time
 import requests
-from PIL import Image
+from PIL import Image, ImageFile
 from tqdm import tqdm
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup, Tag, FeatureNotFound
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
@@ -12,6 +12,24 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as pa_dataset
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pa_dataset = pq = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import dns.resolver as dns_resolver
+except ImportError:
+    dns_resolver = None
+try:
+    import httpx
+except ImportError:
+    httpx = None
 from collections import Counter
 from urllib3.util.retry import Retry
 import json
@@ -20,35 +38,2692 @@ import traceback
 import re
 import platform
 import hashlib
+import shutil
 import socket
 import urllib.parse
+import threading
+import queue
+import sqlite3
+import bisect
+import functools
+import io
+import struct
+import tarfile
+import contextlib
+import collections
+import itertools
+import urllib.robotparser
+import ipaddress
+import fnmatch
+import math
+import heapq
+import asyncio
+import importlib.util
+import random
+from selenium.common.exceptions import WebDriverException
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+
+# Output codecs selectable with output_format, and the extension each is saved under
+OUTPUT_FORMATS = {
+    'JPEG': '.jpg',
+    'WEBP': '.webp',
+    'PNG': '.png'
+}
+
+def normalize_output_format(output_format):
+    """Map a user supplied codec name ('jpg', 'webp', ...) to its Pillow format name"""
+    if not output_format:
+        return None
+    output_format = output_format.upper()
+    if output_format == 'JPG':
+        output_format = 'JPEG'
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    return output_format
+
+class ImageStats:
+    """
+    Mergeable per-channel pixel statistics and image size histograms
+    - Channel means and variances use Chan et al.'s parallel update, so partial
+      results from threads or worker processes merge exactly and stay stable
+    - Source widths/heights are counted in power-of-two bins
+    """
+    SIZE_BINS = [0, 64, 128, 256, 512, 1024, 2048, 4096]
+    BLOCK_PIXELS = 1 << 16
+    
+    def __init__(self):
+        self.images = 0
+        self.pixels = 0
+        self.mean = np.zeros(3)
+        self.m2 = np.zeros(3)
+        self.width_hist = np.zeros(len(self.SIZE_BINS), dtype=np.int64)
+        self.height_hist = np.zeros(len(self.SIZE_BINS), dtype=np.int64)
+
+    @classmethod
+    def from_pixels(cls, pixels, source_size):
+        """
+        Statistics of one image given its (H, W, 3) uint8 pixels and original (width, height)
+        - Rows are converted to float64 a block at a time and merged, so large images
+          never need a float copy of every pixel
+        """
+        stats = cls()
+        pixels = np.asarray(pixels)
+        rows = max(1, cls.BLOCK_PIXELS // max(1, pixels.shape[1]))
+        for start in range(0, len(pixels), rows):
+            values = pixels[start:start + rows].reshape(-1, 3).astype(np.float64)
+            block = cls()
+            block.pixels = len(values)
+            block.mean = values.mean(axis=0)
+            block.m2 = ((values - block.mean) ** 2).sum(axis=0)
+            stats.merge(block)
+        stats.images = 1
+        stats.width_hist[np.searchsorted(cls.SIZE_BINS, source_size[0], side='right') - 1] += 1
+        stats.height_hist[np.searchsorted(cls.SIZE_BINS, source_size[1], side='right') - 1] += 1
+        return stats
+
+    def merge(self, other):
+        """Fold another ImageStats into this one"""
+        if not other.pixels:
+            return self
+        total = self.pixels + other.pixels
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.pixels / total)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * (self.pixels * other.pixels / total)
+        self.pixels = total
+        self.images += other.images
+        self.width_hist += other.width_hist
+        self.height_hist += other.height_hist
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.pixels) if self.pixels else np.zeros(3)
+
+    def to_dict(self):
+        """JSON-ready summary (means/stds on the 0-255 and 0-1 scales)"""
+        labels = [f"{low}-{high}" for low, high in zip(self.SIZE_BINS, self.SIZE_BINS[1:])]
+        labels.append(f"{self.SIZE_BINS[-1]}+")
+        return {
+            'images': self.images,
+            'pixels': self.pixels,
+            'mean': self.mean.tolist(),
+            'std': self.std.tolist(),
+            'mean_normalized': (self.mean / 255).tolist(),
+            'std_normalized': (self.std / 255).tolist(),
+            'm2': self.m2.tolist(),
+            'width_histogram': dict(zip(labels, self.width_hist.tolist())),
+            'height_histogram': dict(zip(labels, self.height_hist.tolist()))
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild statistics saved with to_dict, e.g. to keep accumulating across runs"""
+        stats = cls()
+        stats.images = data['images']
+        stats.pixels = data['pixels']
+        stats.mean = np.asarray(data['mean'], dtype=np.float64)
+        stats.m2 = np.asarray(data['m2'], dtype=np.float64)
+        stats.width_hist = np.asarray(list(data['width_histogram'].values()), dtype=np.int64)
+        stats.height_hist = np.asarray(list(data['height_histogram'].values()), dtype=np.int64)
+        return stats
+
+RESIZE_POLICIES = ('stretch', 'crop', 'letterbox')
+
+def fit_image(img, size, policy='stretch', fast=False):
+    """
+    Resize a PIL image to size
+    - stretch: scale each axis independently (ignores aspect ratio)
+    - crop: scale to cover size, then keep the centre
+    - letterbox: scale to fit inside size and pad the borders
+    - fast=True shrinks by integer factors before LANCZOS resampling
+    """
+    reducing_gap = 3.0 if fast else None
+    width, height = size
+    
+    if policy == 'stretch':
+        return img.resize(size, Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+    
+    if policy == 'crop':
+        scale = max(width / img.width, height / img.height)
+        crop_width, crop_height = width / scale, height / scale
+        left = (img.width - crop_width) / 2
+        top = (img.height - crop_height) / 2
+        box = (left, top, left + crop_width, top + crop_height)
+        return img.resize(size, Image.Resampling.LANCZOS, box=box, reducing_gap=reducing_gap)
+    
+    if policy == 'letterbox':
+        if img.mode in ('P', '1'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        scale = min(width / img.width, height / img.height)
+        inner = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        resized = img.resize(inner, Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+        canvas = Image.new(resized.mode, size)
+        canvas.paste(resized, ((width - inner[0]) // 2, (height - inner[1]) // 2))
+        return canvas
+    
+    raise ValueError(f"Unknown resize policy: {policy}")
+
+def process_image_file(filepath, target_size, fast=False, output_format=None, quality=None, collect_stats=False,
+                       policy='stretch', variants=(), output_path=None):
+    """
+    Resize and/or re-encode an image file in place
+    - Module-level so it can run inside a process pool worker
+    - output_path writes the result there instead (via a temp file, so readers never
+      see a partial image) and leaves filepath untouched; nothing is written when
+      the image is already what would be produced, or when neither target_size nor
+      output_format is set (only variants or statistics were asked for)
+    - fast=True decodes JPEGs at a reduced scale (draft mode), shrinks by integer
+      factors before resampling and skips re-encoding images already at target_size
+    - output_format saves as JPEG/WEBP/PNG instead of the source format
+    - collect_stats=True also returns ImageStats of the output pixels, computed
+      from the image already in memory
+    - variants is a list of (path, size, policy) written from the same decode
+    - Returns (error message or None, ImageStats or None)
+    """
+    try:
+        with Image.open(filepath) as img:
+            source_format = img.format
+            source_size = img.size
+            save_format = output_format or source_format
+            
+            # Nothing to do if the image is already what we would produce
+            unchanged = (not target_size or img.size == tuple(target_size)) and save_format == source_format
+            if unchanged and not variants and (fast or not (target_size or output_format)):
+                stats = ImageStats.from_pixels(np.asarray(img.convert('RGB')), source_size) if collect_stats else None
+                return None, stats
+            
+            sizes = [tuple(target_size)] if target_size else []
+            sizes += [tuple(size) for _, size, _ in variants]
+            if fast and sizes and source_format == 'JPEG' and (target_size or not collect_stats):
+                # Let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the largest output
+                # (statistics of an image kept as it is are taken at full size)
+                img.draft('RGB', (max(w for w, _ in sizes), max(h for _, h in sizes)))
+            
+            # JPEG cannot store alpha or palette modes
+            if save_format == 'JPEG' or (not output_format and os.path.splitext(filepath)[1].lower() in ('.jpg', '.jpeg')):
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+            
+            img.load()
+        
+        save_options = {}
+        if quality and save_format in ('JPEG', 'WEBP'):
+            save_options['quality'] = quality
+        
+        # Every output is produced from the single decoded source
+        for path, size, variant_policy in variants:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fit_image(img, size, variant_policy, fast).save(path, format=save_format, **save_options)
+        
+        if target_size:
+            img = fit_image(img, target_size, policy, fast)
+        
+        stats = ImageStats.from_pixels(np.asarray(img.convert('RGB')), source_size) if collect_stats else None
+        
+        # The source stays as downloaded unless it is resized or re-encoded
+        if not (target_size or output_format):
+            return None, stats
+        
+        if output_path:
+            root, ext = os.path.splitext(output_path)
+            temp_path = f"{root}.{os.getpid()}-{threading.get_ident()}.tmp{ext}"
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            try:
+                img.save(temp_path, format=output_format, **save_options)
+                os.replace(temp_path, output_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        else:
+            img.save(filepath, format=output_format, **save_options)
+        return None, stats
+    except Exception as e:
+        return str(e), None
+
+def resize_image_file(filepath, target_size, fast=False, output_format=None, quality=None):
+    """
+    Resize and/or re-encode an image file in place (see process_image_file)
+    - Returns None on success, otherwise the error message
+    """
+    return process_image_file(filepath, target_size, fast, output_format, quality)[0]
+
+# Input size (height, width) each perceptual hash is computed from
+PHASH_INPUT_SIZES = {
+    'ahash': (8, 8),
+    'dhash': (8, 9),
+    'phash': (32, 32)
+}
+
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis as an n x n matrix"""
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    basis = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    basis[0] /= np.sqrt(2.0)
+    return basis
+
+# Only the 8 lowest frequencies of the 32-point DCT feed the pHash
+_DCT_LOW = _dct_matrix(32)[:8].astype(np.float32)
+
+def popcount64(values):
+    """Number of set bits in each element of a uint64 array"""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return _POPCOUNT8[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1, dtype=np.int64)
+
+def perceptual_hash_input(img, method='dhash'):
+    """Downscale a PIL image to the grayscale array a perceptual hash is computed from"""
+    height, width = PHASH_INPUT_SIZES[method]
+    if img.format == 'JPEG':
+        img.draft('L', (width * 4, height * 4))
+    gray = img.convert('L').resize((width, height), Image.Resampling.LANCZOS)
+    return np.asarray(gray, dtype=np.float32)
+
+def perceptual_hashes(arrays, method='dhash'):
+    """
+    Compute 64-bit perceptual hashes for a batch of grayscale inputs
+    - arrays has shape (N, H, W) as produced by perceptual_hash_input
+    - ahash: pixels above the image mean; dhash: horizontal gradient signs;
+      phash: low-frequency DCT coefficients above their median
+    - Returns a uint64 array of N hashes
+    """
+    arrays = np.asarray(arrays, dtype=np.float32)
+    if arrays.ndim == 2:
+        arrays = arrays[None]
+    
+    if method == 'ahash':
+        bits = arrays > arrays.mean(axis=(1, 2), keepdims=True)
+    elif method == 'dhash':
+        bits = arrays[:, :, 1:] > arrays[:, :, :-1]
+    elif method == 'phash':
+        coefficients = _DCT_LOW @ arrays @ _DCT_LOW.T
+        bits = coefficients > np.median(coefficients, axis=(1, 2), keepdims=True)
+    else:
+        raise ValueError(f"Unknown perceptual hash method: {method}")
+    
+    packed = np.packbits(bits.reshape(len(arrays), 64), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+def image_perceptual_hash(filepath, method='dhash'):
+    """Perceptual hash of an image file as an int, or None if it cannot be decoded"""
+    try:
+        with Image.open(filepath) as img:
+            return int(perceptual_hashes(perceptual_hash_input(img, method), method)[0])
+    except Exception:
+        return None
+
+class HammingIndex:
+    """
+    Near-neighbour index for 64-bit hashes under Hamming distance (multi-index hashing)
+    - Each hash is split into four 16-bit chunks; two hashes within distance r must
+      agree to within r // 4 bits on at least one chunk, so only those chunk
+      neighbourhoods are probed
+    - Hashes and the per-chunk sorted tables are flat NumPy arrays (~32 bytes per hash)
+    - New hashes land in a small buffer that is brute-forced and merged in batches
+    """
+    CHUNKS = 4
+    
+    def __init__(self, merge_threshold=4096):
+        self.merge_threshold = merge_threshold
+        self._hashes = np.empty(1024, dtype=np.uint64)
+        self._size = 0
+        self._indexed = 0
+        self._keys = [np.empty(0, dtype=np.uint16) for _ in range(self.CHUNKS)]
+        self._ids = [np.empty(0, dtype=np.int32) for _ in range(self.CHUNKS)]
+        self._probe_masks = {}
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """Memory held by the hash array and chunk tables"""
+        return (self._hashes.nbytes + sum(k.nbytes for k in self._keys)
+                + sum(i.nbytes for i in self._ids))
+
+    @property
+    def hashes(self):
+        """View of all inserted hashes, in insertion (id) order"""
+        return self._hashes[:self._size]
+
+    def add(self, value):
+        """Insert one hash and return its id"""
+        return int(self.add_batch(np.array([value], dtype=np.uint64))[0])
+
+    def add_batch(self, values):
+        """Insert a batch of hashes and return their ids"""
+        values = np.asarray(values, dtype=np.uint64).ravel()
+        needed = self._size + len(values)
+        if needed > len(self._hashes):
+            grown = np.empty(max(needed, 2 * len(self._hashes)), dtype=np.uint64)
+            grown[:self._size] = self._hashes[:self._size]
+            self._hashes = grown
+        
+        ids = np.arange(self._size, needed, dtype=np.int32)
+        self._hashes[self._size:needed] = values
+        self._size = needed
+        
+        # Merge the buffer geometrically so total merge work stays O(N log N)
+        if self._size - self._indexed >= max(self.merge_threshold, self._indexed // 8):
+            self._merge()
+        return ids
+
+    def _chunk(self, values, j):
+        return ((values >> np.uint64(16 * j)) & np.uint64(0xFFFF)).astype(np.uint16)
+
+    def _merge(self):
+        """Move buffered hashes into the sorted chunk tables"""
+        new_ids = np.arange(self._indexed, self._size, dtype=np.int32)
+        new_hashes = self._hashes[self._indexed:self._size]
+        for j in range(self.CHUNKS):
+            new_keys = self._chunk(new_hashes, j)
+            order = np.argsort(new_keys, kind='stable')
+            new_keys = new_keys[order]
+            positions = np.searchsorted(self._keys[j], new_keys, side='right')
+            self._keys[j] = np.insert(self._keys[j], positions, new_keys)
+            self._ids[j] = np.insert(self._ids[j], positions, new_ids[order])
+        self._indexed = self._size
+
+    def _masks(self, radius):
+        """All 16-bit XOR masks with at most radius bits set"""
+        if radius not in self._probe_masks:
+            masks = np.arange(1 << 16, dtype=np.uint32)
+            counts = popcount64(masks.astype(np.uint64))
+            self._probe_masks[radius] = masks[counts <= radius].astype(np.uint16)
+        return self._probe_masks[radius]
+
+    def query(self, value, radius):
+        """
+        Find stored hashes within radius bits of value
+        - Returns (ids, distances) sorted by distance
+        """
+        value = np.uint64(value)
+        sub_radius = radius // self.CHUNKS
+        
+        # Keep the brute-forced buffer small on query-heavy workloads
+        if self._size - self._indexed > self.merge_threshold:
+            self._merge()
+        
+        if sub_radius > 3 or not self._indexed:
+            # Probing would touch most buckets; a vectorized scan is cheaper
+            candidates = np.arange(self._size, dtype=np.int32)
+        else:
+            parts = [np.arange(self._indexed, self._size, dtype=np.int32)]
+            masks = self._masks(sub_radius)
+            for j in range(self.CHUNKS):
+                probes = self._chunk(value, j) ^ masks
+                lo = np.searchsorted(self._keys[j], probes, side='left')
+                hi = np.searchsorted(self._keys[j], probes, side='right')
+                lengths = hi - lo
+                total = int(lengths.sum())
+                if total:
+                    offsets = np.cumsum(lengths) - lengths
+                    positions = np.arange(total) - np.repeat(offsets, lengths) + np.repeat(lo, lengths)
+                    parts.append(self._ids[j][positions])
+            candidates = np.unique(np.concatenate(parts))
+        
+        distances = popcount64(self._hashes[candidates] ^ value)
+        keep = distances <= radius
+        candidates, distances = candidates[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+# Query parameters that never change the resource: analytics and click tracking
+TRACKING_PARAMS = (
+    'utm_*', 'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'igshid', 'ref', 'ref_src', 'spm'
+)
+
+# Example CDN size-variant rules (regex, replacement) for URLCanonicalizer
+CDN_VARIANT_RULES = (
+    (r'-\d+x\d+(?=\.[A-Za-z0-9]+(?:\?|$))', ''),                 # WordPress: photo-300x200.jpg
+    (r'@\dx(?=\.[A-Za-z0-9]+(?:\?|$))', ''),                      # Retina: photo@2x.jpg
+)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+class URLCanonicalizer:
+    """
+    Map equivalent image URLs to one canonical string for deduplication
+    - Lowercases scheme and host (IPv6 literals keep their brackets), drops default
+      ports, userinfo and fragments
+    - Treats http and https as the same resource (merge_schemes)
+    - Removes query parameters matching strip_params (fnmatch patterns) and sorts the rest
+    - Applies variant_rules, (regex, replacement) pairs such as CDN_VARIANT_RULES,
+      so size variants of one image share a key
+    - Only used for keys; downloads keep the original URL
+    """
+    
+    def __init__(self, strip_params=TRACKING_PARAMS, variant_rules=(), merge_schemes=True):
+        patterns = [fnmatch.translate(pattern.lower()) for pattern in strip_params]
+        self._strip = re.compile('|'.join(patterns)) if patterns else None
+        self._rules = [(re.compile(pattern), replacement) for pattern, replacement in variant_rules]
+        self.merge_schemes = merge_schemes
+
+    def __call__(self, url):
+        parts = urllib.parse.urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower().rstrip('.')
+        if ':' in host:
+            host = f"[{host}]"
+        try:
+            port = parts.port
+        except ValueError:
+            port = None
+        netloc = host if not port or port == DEFAULT_PORTS.get(scheme) else f"{host}:{port}"
+        if self.merge_schemes and scheme == 'http':
+            scheme = 'https'
+        
+        query = parts.query
+        if query:
+            params = urllib.parse.parse_qsl(query, keep_blank_values=True)
+            if self._strip:
+                params = [(key, value) for key, value in params if not self._strip.match(key.lower())]
+            query = urllib.parse.urlencode(sorted(params))
+        
+        url = urllib.parse.urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+        for pattern, replacement in self._rules:
+            url = pattern.sub(replacement, url)
+        return url
+
+
+def url_key(url):
+    """64-bit BLAKE2b key of a (canonical) URL"""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class URLKeySet:
+    """
+    Compact exact-membership set of URLs stored as 64-bit keys
+    - Keys sit in a sorted uint64 array (8 bytes per URL); new keys go to a small
+      set that is merged in geometrically growing batches
+    - A false positive needs a 64-bit hash collision (about n^2 / 2^65)
+    - Persists to a .npy file with save()
+    """
+    
+    def __init__(self, path=None, merge_threshold=65536):
+        self.path = path
+        self.merge_threshold = merge_threshold
+        self._keys = np.empty(0, dtype=np.uint64)
+        self._recent = set()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._keys = np.unique(np.load(path).astype(np.uint64))
+
+    def __len__(self):
+        return len(self._keys) + len(self._recent)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held (the recent set is counted at CPython's per-entry cost)"""
+        return self._keys.nbytes + len(self._recent) * 64
+
+    def _has(self, key):
+        if key in self._recent:
+            return True
+        position = np.searchsorted(self._keys, np.uint64(key))
+        return position < len(self._keys) and int(self._keys[position]) == key
+
+    def __contains__(self, url):
+        key = url_key(url)
+        with self._lock:
+            return self._has(key)
+
+    def add(self, url):
+        """Insert a URL; returns False if it was already present"""
+        key = url_key(url)
+        with self._lock:
+            if self._has(key):
+                return False
+            self._recent.add(key)
+            if len(self._recent) >= max(self.merge_threshold, len(self._keys) // 16):
+                self._merge()
+            return True
+
+    def _merge(self):
+        """Fold the recent keys into the sorted array (lock held)"""
+        if not self._recent:
+            return
+        recent = np.fromiter(self._recent, dtype=np.uint64, count=len(self._recent))
+        recent.sort()
+        self._keys = np.insert(self._keys, np.searchsorted(self._keys, recent), recent)
+        self._recent.clear()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            self._merge()
+            np.save(self.path, self._keys)
+
+class BloomFilter:
+    """
+    Bloom filter over URLs with a tunable false-positive rate
+    - Sized for capacity URLs at error_rate: m = -n ln p / (ln 2)^2 bits, k = m/n ln 2 hashes
+    - The k bit positions come from one 128-bit BLAKE2b digest (double hashing)
+    - A false positive skips a URL that was never seen; there are no false negatives
+    - Persists bits and parameters to an .npz file with save()
+    """
+    
+    def __init__(self, capacity=10_000_000, error_rate=0.001, path=None):
+        self.path = path
+        if path and os.path.exists(path):
+            data = np.load(path)
+            self.bits = data['bits']
+            self.num_bits, self.num_hashes, self.count = (int(v) for v in data['params'])
+        else:
+            self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+            self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+            self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+            self.count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def _positions(self, url):
+        digest = hashlib.blake2b(url.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, url):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(url))
+
+    def add(self, url):
+        """Insert a URL; returns False if it was (probably) already present"""
+        positions = self._positions(url)
+        bits = self.bits
+        with self._lock:
+            if all(bits[p >> 3] & (1 << (p & 7)) for p in positions):
+                return False
+            for p in positions:
+                bits[p >> 3] |= 1 << (p & 7)
+            self.count += 1
+            return True
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            with open(self.path, 'wb') as f:
+                np.savez(f, bits=self.bits, params=np.array([self.num_bits, self.num_hashes, self.count], dtype=np.int64))
+
+class ContentStore:
+    """
+    Content-addressed store for downloaded images
+    - Objects live at <root>/objects/<aa>/<bb>/<sha256><ext>, so identical bytes are kept once
+    - Category directories hold hard links (or symlinks/copies) to the objects
+    - Objects are never modified: resized/re-encoded copies live under
+      <root>/derived/, named after the object they were made from
+    - index.jsonl maps every fetched URL to its object so re-runs skip known URLs
+    """
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.derived_dir = os.path.join(root, 'derived')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.index_file = os.path.join(root, 'index.jsonl')
+        self._lock = threading.Lock()
+        self._temp_ids = itertools.count()
+        self.objects = {}
+        self.urls = {}
+        
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        
+        # Rebuild the hash index from the objects already on disk
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for name in filenames:
+                self.objects[os.path.splitext(name)[0]] = os.path.join(dirpath, name)
+        
+        # Load the URL -> object mapping from previous runs
+        if os.path.exists(self.index_file):
+            with open(self.index_file, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.urls[entry['url']] = entry['sha256']
+                    except (ValueError, KeyError):
+                        continue
+
+    def object_path(self, digest, ext):
+        """Return the sharded path for an object"""
+        return os.path.join(self.objects_dir, digest[:2], digest[2:4], digest + ext)
+
+    def derived_path(self, digest, ext):
+        """Return the sharded path for the processed copy of an object"""
+        return os.path.join(self.derived_dir, digest[:2], digest[2:4], digest + ext)
+
+    def temp_path(self):
+        """Return a fresh path to stream a download into before its hash is known"""
+        return os.path.join(self.tmp_dir, f"{threading.get_ident()}-{time.time_ns()}-{next(self._temp_ids)}.part")
+
+    def lookup_url(self, url):
+        """Return (digest, object path) for a URL fetched before, or (None, None)"""
+        with self._lock:
+            digest = self.urls.get(url)
+            path = self.objects.get(digest) if digest else None
+        if path and os.path.exists(path):
+            return digest, path
+        return None, None
+
+    def add(self, temp_path, digest, ext, url):
+        """
+        Move a downloaded temp file into the store
+        - Returns (object path, is_new); duplicates are discarded and the existing object returned
+        """
+        with self._lock:
+            existing = self.objects.get(digest)
+            if existing and os.path.exists(existing):
+                os.remove(temp_path)
+                is_new = False
+                path = existing
+            else:
+                path = self.object_path(digest, ext)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+                self.objects[digest] = path
+                is_new = True
+            
+            if self.urls.get(url) != digest:
+                self.urls[url] = digest
+                with open(self.index_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'url': url, 'sha256': digest}) + '\n')
+        
+        return path, is_new
+
+    def discard(self, digest):
+        """Remove an object and its processed copy, e.g. after it failed post-processing"""
+        with self._lock:
+            path = self.objects.pop(digest, None)
+        if not path:
+            return
+        for stale in (path, self.derived_path(digest, os.path.splitext(path)[1])):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+    def link(self, object_path, dest_path):
+        """Expose an object inside a category directory"""
+        if os.path.lexists(dest_path):
+            return
+        try:
+            os.link(object_path, dest_path)
+        except OSError:
+            try:
+                os.symlink(os.path.relpath(object_path, os.path.dirname(dest_path)), dest_path)
+            except OSError:
+                shutil.copy2(object_path, dest_path)
+
+class CrawlJournal:
+    """
+    Durable crawl frontier and download journal backed by SQLite
+    - Every discovered image URL is recorded with its state
+      (pending, in_flight, done, skipped, failed) and attempt count
+    - Pages whose discovery finished are recorded so a restart skips re-parsing
+    - Writes are buffered and committed in batched transactions
+    """
+    def __init__(self, path, batch_size=500, flush_interval=2.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._ops = []
+        self._states = {}
+        self._last_flush = time.monotonic()
+        
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    url TEXT PRIMARY KEY,
+                    category TEXT,
+                    alt TEXT,
+                    title TEXT,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    record TEXT,
+                    updated_at REAL
+                )
+            """)
+            self.conn.execute('CREATE INDEX IF NOT EXISTS images_state ON images(state)')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    updated_at REAL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS frontier (
+                    url TEXT PRIMARY KEY,
+                    depth INTEGER NOT NULL,
+                    updated_at REAL
+                )
+            """)
+
+    def _queue(self, sql, params, url=None, state=None):
+        """Buffer a write and flush once the batch is full or stale"""
+        with self._lock:
+            self._ops.append((sql, params))
+            if url and state:
+                self._states[url] = state
+            due = (len(self._ops) >= self.batch_size or
+                   time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Commit all buffered writes in one transaction"""
+        with self._lock:
+            ops, self._ops = self._ops, []
+            self._last_flush = time.monotonic()
+            if not ops:
+                return
+            with self.conn:
+                for sql, params in ops:
+                    self.conn.execute(sql, params)
+            self._states.clear()
+
+    def add_image(self, image_data):
+        """Record a discovered image as pending (no-op if already known)"""
+        self._queue(
+            'INSERT OR IGNORE INTO images (url, category, alt, title, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (image_data['url'], image_data.get('category'), image_data.get('alt', ''),
+             image_data.get('title', ''), time.time())
+        )
+
+    def state(self, url):
+        """Current state of a URL, or None if it was never recorded"""
+        with self._lock:
+            if url in self._states:
+                return self._states[url]
+            row = self.conn.execute('SELECT state FROM images WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    def start(self, url):
+        """Mark a URL as in flight and count the attempt"""
+        self._queue(
+            "UPDATE images SET state = 'in_flight', attempts = attempts + 1, updated_at = ? WHERE url = ?",
+            (time.time(), url), url, 'in_flight'
+        )
+
+    def requeue(self, url):
+        """Put an in-flight URL back to pending without counting the attempt"""
+        self._queue(
+            "UPDATE images SET state = 'pending', attempts = attempts - 1, updated_at = ? WHERE url = ?",
+            (time.time(), url), url, 'pending'
+        )
+
+    def finish(self, url, state):
+        """Record the final state of an attempt"""
+        self._queue(
+            'UPDATE images SET state = ?, updated_at = ? WHERE url = ?',
+            (state, time.time(), url), url, state
+        )
+
+    def record(self, url, entry):
+        """Store the metadata entry written for a URL"""
+        self._queue(
+            'UPDATE images SET record = ? WHERE url = ?',
+            (json.dumps(entry, ensure_ascii=False), url)
+        )
+
+    def page_done(self, url):
+        """Mark a page's discovery as complete"""
+        self._queue(
+            'INSERT OR REPLACE INTO pages (url, state, updated_at) VALUES (?, ?, ?)',
+            (url, 'done', time.time())
+        )
+        self.flush()
+
+    def is_page_done(self, url):
+        """Whether discovery already completed for a page"""
+        self.flush()
+        with self._lock:
+            row = self.conn.execute('SELECT state FROM pages WHERE url = ?', (url,)).fetchone()
+        return bool(row) and row[0] == 'done'
+
+    def queue_page(self, url, depth):
+        """Record a page scheduled by the crawler (no-op if already known)"""
+        self._queue(
+            'INSERT OR IGNORE INTO frontier (url, depth, updated_at) VALUES (?, ?, ?)',
+            (url, depth, time.time())
+        )
+
+    def frontier(self):
+        """
+        Crawl state from earlier runs
+        - Returns (pending [(url, depth)] in scheduling order, every known page URL,
+          number of pages already done)
+        """
+        self.flush()
+        with self._lock:
+            rows = self.conn.execute(
+                """SELECT f.url, f.depth, p.state FROM frontier f
+                   LEFT JOIN pages p ON p.url = f.url ORDER BY f.rowid"""
+            ).fetchall()
+        pending = [(url, depth) for url, depth, state in rows if state != 'done']
+        done = sum(1 for _, _, state in rows if state == 'done')
+        return pending, {url for url, _, _ in rows}, done
+
+    def pending_images(self, max_attempts=3):
+        """
+        Image records that still need work
+        - pending and in_flight rows (interrupted by a crash)
+        - failed rows with fewer than max_attempts attempts
+        """
+        self.flush()
+        with self._lock:
+            rows = self.conn.execute(
+                """SELECT url, category, alt, title FROM images
+                   WHERE state IN ('pending', 'in_flight') OR (state = 'failed' AND attempts < ?)
+                   ORDER BY rowid""",
+                (max_attempts,)
+            ).fetchall()
+        return [
+            {'url': url, 'category': category, 'alt': alt or '', 'title': title or ''}
+            for url, category, alt, title in rows
+        ]
+
+    def completed_metadata(self):
+        """Metadata entries recorded by earlier runs"""
+        self.flush()
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT record FROM images WHERE record IS NOT NULL ORDER BY rowid'
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def counts(self):
+        """Number of images in each state"""
+        self.flush()
+        with self._lock:
+            return dict(self.conn.execute('SELECT state, COUNT(*) FROM images GROUP BY state').fetchall())
+
+    def close(self):
+        """Flush outstanding writes and close the database"""
+        self.flush()
+        with self._lock:
+            self.conn.close()
+
+class CachedResponse:
+    """
+    Minimal stand-in for requests.Response served from the HTTP cache
+    - Supports the parts the scraper uses: status, headers, text/content,
+      iter_content streaming and use as a context manager
+    """
+    def __init__(self, url, path, headers):
+        self.url = url
+        self.status_code = 200
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.encoding = requests.utils.get_encoding_from_headers(self.headers) or 'utf-8'
+        self.from_cache = True
+        self._path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    def iter_content(self, chunk_size=8192):
+        with open(self._path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    @property
+    def content(self):
+        with open(self._path, 'rb') as f:
+            return f.read()
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+class CachingResponse:
+    """
+    Streamed response from the origin whose body is copied into the HTTP cache as it is read
+    - Headers are the origin's, so checks on them see the real Content-Length
+    - The copy is only kept if the caller reads the whole body; transfers aborted
+      by a size or format rule (or cut off) leave nothing in the cache
+    """
+    def __init__(self, cache, url, response):
+        self.url = url
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.encoding = response.encoding
+        self.from_cache = False
+        self._cache = cache
+        self._response = response
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def raise_for_status(self):
+        self._response.raise_for_status()
+
+    def close(self):
+        self._response.close()
+
+    def iter_content(self, chunk_size=8192):
+        temp_path = self._cache._temp_path(self.url)
+        size = 0
+        complete = False
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in self._response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        size += len(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                self._cache._commit(self.url, temp_path, size, self.headers)
+            elif os.path.exists(temp_path):
+                os.remove(temp_path)
+
+class HTTPCache:
+    """
+    On-disk HTTP cache with conditional revalidation
+    - Responses carrying an ETag or Last-Modified validator are stored on disk
+    - Later requests send If-None-Match / If-Modified-Since; a 304 is served from disk
+    - Streamed (stream=True) responses are cached while the caller reads them, so its
+      checks can abort a transfer before anything is stored
+    - Total size is bounded with least-recently-used eviction
+    """
+    STORED_HEADERS = ('content-type', 'etag', 'last-modified', 'content-length')
+    
+    def __init__(self, root, max_bytes=1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        
+        self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite3'), check_same_thread=False)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    url TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    headers TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self.conn.execute('CREATE INDEX IF NOT EXISTS entries_access ON entries(last_access)')
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def _lookup(self, url):
+        """Return (path, headers) for a cached URL whose body is still on disk"""
+        with self._lock:
+            row = self.conn.execute('SELECT filename, headers FROM entries WHERE url = ?', (url,)).fetchone()
+        if not row:
+            return None, None
+        path = os.path.join(self.root, row[0])
+        if not os.path.exists(path):
+            return None, None
+        return path, json.loads(row[1])
+
+    def get(self, session, url, headers=None, **kwargs):
+        """Fetch url through session, revalidating against and updating the cache"""
+        path, cached_headers = self._lookup(url)
+        request_headers = dict(headers or {})
+        if cached_headers:
+            if cached_headers.get('etag'):
+                request_headers['If-None-Match'] = cached_headers['etag']
+            if cached_headers.get('last-modified'):
+                request_headers['If-Modified-Since'] = cached_headers['last-modified']
+        
+        response = session.get(url, headers=request_headers, **kwargs)
+        
+        if response.status_code == 304 and cached_headers:
+            response.close()
+            with self._lock:
+                self.hits += 1
+                with self.conn:
+                    self.conn.execute('UPDATE entries SET last_access = ? WHERE url = ?', (time.time(), url))
+            return CachedResponse(url, path, cached_headers)
+        
+        with self._lock:
+            self.misses += 1
+        
+        if response.status_code != 200 or not (response.headers.get('etag') or response.headers.get('last-modified')):
+            return response
+        
+        # Streamed bodies are stored as the caller reads them
+        if kwargs.get('stream'):
+            return CachingResponse(self, url, response)
+        
+        # Store the body, streaming it to disk, and serve this request from the stored copy
+        with response:
+            return self._store(url, response)
+
+    def _temp_path(self, url):
+        """Fresh temp path a body for url is written to before _commit"""
+        return os.path.join(self.root, f"{hashlib.sha256(url.encode()).hexdigest()}.{threading.get_ident()}.part")
+
+    def _store(self, url, response):
+        """Write a validated response body to the cache and return it as a CachedResponse"""
+        temp_path = self._temp_path(url)
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    if chunk:
+                        f.write(chunk)
+                        size += len(chunk)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        cached = self._commit(url, temp_path, size, response.headers)
+        if cached is None:
+            raise requests.exceptions.ChunkedEncodingError(f"Incomplete response body: {url}")
+        return cached
+
+    def _commit(self, url, temp_path, size, headers):
+        """
+        Move a written body into the cache and return it as a CachedResponse
+        - A body shorter than the origin's Content-Length (cut off) is not cached
+        - Content-Length is kept, as the size of the stored (decoded) body
+        """
+        expected = headers.get('content-length')
+        encoded = headers.get('content-encoding', 'identity') != 'identity'
+        if expected and expected.isdigit() and not encoded and int(expected) != size:
+            os.remove(temp_path)
+            return None
+        
+        filename = hashlib.sha256(url.encode()).hexdigest()
+        path = os.path.join(self.root, filename)
+        os.replace(temp_path, path)
+        
+        stored_headers = {name: headers[name] for name in self.STORED_HEADERS if name in headers}
+        stored_headers['content-length'] = str(size)
+        
+        with self._lock:
+            row = self.conn.execute('SELECT size FROM entries WHERE url = ?', (url,)).fetchone()
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO entries (url, filename, headers, size, last_access) VALUES (?, ?, ?, ?, ?)',
+                    (url, filename, json.dumps(stored_headers), size, time.time())
+                )
+            self.total_bytes += size - (row[0] if row else 0)
+            self._evict(keep=url)
+        
+        return CachedResponse(url, path, stored_headers)
+
+    def _evict(self, keep=None):
+        """Drop least recently used entries until the cache fits in max_bytes (lock held)"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        rows = self.conn.execute('SELECT url, filename, size FROM entries ORDER BY last_access').fetchall()
+        with self.conn:
+            for url, filename, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                if url == keep:
+                    continue
+                path = os.path.join(self.root, filename)
+                if os.path.exists(path):
+                    os.remove(path)
+                self.conn.execute('DELETE FROM entries WHERE url = ?', (url,))
+                self.total_bytes -= size
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+class PageIndex:
+    """
+    Single-pass index over a parsed page
+    - One traversal records document order, class membership, styled elements
+      and each element's first <img> descendant
+    - Answers element.find('img') and element.find(class_=...) lookups without
+      rescanning subtrees, returning the same elements BeautifulSoup would
+    """
+    def __init__(self, soup):
+        self.soup = soup
+        self.elements = soup.find_all(True)
+        self.elements_with_class = []
+        self.imgs = []
+        self.styled = []
+        self.by_class = {}
+        self._class_positions = {}
+        self._position = {}
+        self._first_img = {}
+        
+        for pos, element in enumerate(self.elements):
+            self._position[id(element)] = pos
+            if element.name == 'img':
+                self.imgs.append(element)
+            if element.get('style') is not None:
+                self.styled.append(element)
+            if element.get('class') is not None:
+                self.elements_with_class.append(element)
+                for class_name in dict.fromkeys(element.get('class')):
+                    self.by_class.setdefault(class_name, []).append(element)
+                    self._class_positions.setdefault(class_name, []).append(pos)
+        
+        # Last document position inside each element's subtree
+        self._end = list(range(len(self.elements)))
+        for pos in range(len(self.elements) - 1, -1, -1):
+            parent_pos = self._position.get(id(self.elements[pos].parent))
+            if parent_pos is not None and self._end[pos] > self._end[parent_pos]:
+                self._end[parent_pos] = self._end[pos]
+        
+        # The first image in document order is the first descendant image of every
+        # ancestor not already claimed by an earlier image
+        for img in self.imgs:
+            parent = img.parent
+            while parent is not None and id(parent) not in self._first_img:
+                self._first_img[id(parent)] = img
+                parent = parent.parent
+
+    def _span(self, element):
+        """Document positions (start, end) covered by an element's subtree"""
+        pos = self._position.get(id(element))
+        if pos is None:
+            # The document root spans every element
+            return -1, len(self.elements) - 1
+        return pos, self._end[pos]
+
+    def first_img(self, element):
+        """Equivalent of element.find('img')"""
+        return self._first_img.get(id(element))
+
+    def find_class(self, element, class_name):
+        """Equivalent of element.find(class_=class_name)"""
+        positions = self._class_positions.get(class_name)
+        if not positions:
+            return None
+        start, end = self._span(element)
+        i = bisect.bisect_right(positions, start)
+        if i < len(positions) and positions[i] <= end:
+            return self.by_class[class_name][i]
+        return None
+
+class ContextIndex:
+    """
+    Memoized per-node text and label lookups for image context
+    - Each node's stripped text and heading/link labels are computed once and
+      reused by every image sharing that ancestor (grid pages share containers)
+    - Entries pin their node, so a recycled id() can never return stale data
+    """
+    LABEL_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'a')
+    CATEGORY_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'a', 'p')
+    
+    def __init__(self):
+        self._text = {}
+        self._labels = {}
+        self._first_label = {}
+
+    def _get(self, cache, node, key=None):
+        entry = cache.get((id(node), key))
+        if entry is not None and entry[0] is node:
+            return True, entry[1]
+        return False, None
+
+    def text(self, node):
+        """Memoized node.get_text(strip=True)"""
+        found, value = self._get(self._text, node)
+        if not found:
+            value = node.get_text(strip=True)
+            self._text[(id(node), None)] = (node, value)
+        return value
+
+    def labels(self, node, names=LABEL_TAGS):
+        """Memoized non-empty texts of the node's descendants with the given tag names"""
+        found, value = self._get(self._labels, node, names)
+        if not found:
+            value = []
+            for elem in node.find_all(list(names)):
+                text = self.text(elem)
+                if text:
+                    value.append(text)
+            self._labels[(id(node), names)] = (node, value)
+        return value
+
+    def first_label(self, node, names=CATEGORY_TAGS, min_length=3):
+        """Memoized first descendant label of at least min_length characters"""
+        found, value = self._get(self._first_label, node, (names, min_length))
+        if not found:
+            value = None
+            for elem in node.find_all(list(names)):
+                text = self.text(elem)
+                if text and len(text) >= min_length:
+                    value = text
+                    break
+            self._first_label[(id(node), (names, min_length))] = (node, value)
+        return value
+
+@functools.lru_cache(maxsize=65536)
+def _clean_category_name(text):
+    """Cached implementation of ImageScraper.clean_category_name"""
+    if not text:
+        return "uncategorized"
+    
+    # Convert to lowercase and remove special characters
+    text = text.lower()
+    text = ''.join(c for c in text if c.isalnum() or c.isspace())
+    
+    # Split by spaces and take first few meaningful words
+    words = text.split()
+    if len(words) > 3:
+        words = words[:3]  # Take first 3 words for category name
+    
+    # Join words with underscores
+    category = '_'.join(words)
+    
+    # Handle empty or invalid cases
+    if not category or len(category) < 2:
+        return "uncategorized"
+    
+    return category
+
+class ParquetManifest:
+    """
+    Columnar dataset manifest written incrementally as Parquet
+    - Rows are buffered and written as one row group per part file, so memory
+      stays bounded and a crash only loses the unflushed batch
+    - The manifest directory is a Parquet dataset; read_manifest() pushes
+      filters (e.g. on category or resolution) down to the row groups
+    """
+    COLUMNS = [
+        ('url', 'string'),
+        ('category', 'string'),
+        ('filename', 'string'),
+        ('sha256', 'string'),
+        ('bytes', 'int64'),
+        ('width', 'int32'),
+        ('height', 'int32'),
+        ('download_ms', 'float64'),
+        ('process_ms', 'float64'),
+        ('title', 'string'),
+        ('alt', 'string'),
+        ('phash', 'string'),
+        ('near_duplicate_of', 'string')
+    ]
+    
+    def __init__(self, root, row_group_size=10000):
+        if pa is None:
+            raise ImportError("The parquet manifest requires pyarrow (pip install pyarrow)")
+        self.root = root
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in self.COLUMNS])
+        self.rows_written = 0
+        self._rows = []
+        self._lock = threading.Lock()
+        self._run = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self._parts = 0
+        os.makedirs(root, exist_ok=True)
+
+    def append(self, entry):
+        """Buffer one manifest row, writing a row group when the batch is full"""
+        with self._lock:
+            self._rows.append(entry)
+            full = len(self._rows) >= self.row_group_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows as a new part file"""
+        with self._lock:
+            rows, self._rows = self._rows, []
+            if not rows:
+                return
+            columns = {name: [row.get(name) for row in rows] for name, _ in self.COLUMNS}
+            table = pa.Table.from_pydict(columns, schema=self.schema)
+            name = f"part-{self._run}-{self._parts:05d}.parquet"
+            # Hidden temp name: dataset readers ignore files starting with '.'
+            temp_path = os.path.join(self.root, f".{name}.tmp")
+            pq.write_table(table, temp_path, row_group_size=self.row_group_size)
+            os.replace(temp_path, os.path.join(self.root, name))
+            self._parts += 1
+            self.rows_written += len(rows)
+
+def read_manifest(output_dir, filter=None, columns=None):
+    """
+    Load the Parquet manifest of a dataset as a pyarrow Table
+    - filter is a pyarrow.dataset expression, e.g.
+      (pa_dataset.field('category') == 'cats') & (pa_dataset.field('width') >= 512)
+    """
+    if pa is None:
+        raise ImportError("Reading the parquet manifest requires pyarrow (pip install pyarrow)")
+    dataset = pa_dataset.dataset(os.path.join(output_dir, 'manifest'), format='parquet')
+    return dataset.to_table(filter=filter, columns=columns)
+
+class TarShardWriter:
+    """
+    Writes processed images into size-bounded tar shards (WebDataset layout)
+    - Each sample is <key>.<ext> (image bytes), <key>.cls (integer label) and
+      <key>.json (metadata record), stored next to each other
+    - Shards are written as shard-NNNNNN.tar.part and renamed when complete
+    - keys.txt lists the samples of every completed shard, so re-runs skip them
+    """
+    def __init__(self, root, max_bytes=1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.samples_written = 0
+        self.keys_path = os.path.join(root, 'keys.txt')
+        self._lock = threading.Lock()
+        self._tar = None
+        self._path = None
+        self._size = 0
+        self._shard_keys = []
+        os.makedirs(root, exist_ok=True)
+        
+        # Continue numbering after shards from earlier runs
+        existing = [int(name[6:12]) for name in os.listdir(root)
+                    if name.startswith('shard-') and name[6:12].isdigit()]
+        self._next_shard = max(existing) + 1 if existing else 0
+        
+        self.keys = set()
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, encoding='utf-8') as f:
+                self.keys = {line.strip() for line in f if line.strip()}
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.keys
+
+    def _add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+        # Member header plus data padded to 512-byte blocks
+        self._size += 512 + (len(data) + 511) // 512 * 512
+
+    def write(self, key, image_path, label, entry):
+        """
+        Append one sample, starting a new shard when the current one is full
+        - Returns False (and writes nothing) if the key is already packed
+        """
+        with open(image_path, 'rb') as f:
+            data = f.read()
+        ext = os.path.splitext(image_path)[1].lstrip('.').lower() or 'jpg'
+        
+        with self._lock:
+            if key in self.keys:
+                return False
+            if self._tar and self._size + len(data) > self.max_bytes:
+                self._finish_shard()
+            if not self._tar:
+                self._path = os.path.join(self.root, f"shard-{self._next_shard:06d}.tar")
+                self._tar = tarfile.open(self._path + '.part', 'w')
+                self._size = 0
+                self._next_shard += 1
+            
+            self._add(f"{key}.{ext}", data)
+            self._add(f"{key}.cls", str(label).encode())
+            self._add(f"{key}.json", json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+            self.keys.add(key)
+            self._shard_keys.append(key)
+            self.samples_written += 1
+        return True
+
+    def _finish_shard(self):
+        """Close the current shard, give it its final name and record its keys (lock held)"""
+        self._tar.close()
+        os.replace(self._path + '.part', self._path)
+        self._tar = None
+        with open(self.keys_path, 'a', encoding='utf-8') as f:
+            f.writelines(key + '\n' for key in self._shard_keys)
+        self._shard_keys = []
+
+    def close(self):
+        """Finish the shard being written"""
+        with self._lock:
+            if self._tar:
+                self._finish_shard()
+
+class ArrayWriter:
+    """
+    Appends fixed-size RGB images to a memory-mappable uint8 tensor
+    - images.npy has shape (N, height, width, 3) and labels.npy holds int32 class ids
+    - The .npy header has a fixed size and is rewritten in place as N grows, so
+      the file stays loadable with np.load(path, mmap_mode='r') for zero-copy slicing
+    - keys.txt names the sample in each row, so re-runs skip images already packed
+    """
+    HEADER_SIZE = 256
+    
+    def __init__(self, root, target_size, flush_every=1000):
+        self.root = root
+        self.width, self.height = target_size
+        self.flush_every = flush_every
+        self.images_path = os.path.join(root, 'images.npy')
+        self.labels_path = os.path.join(root, 'labels.npy')
+        self.keys_path = os.path.join(root, 'keys.txt')
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        
+        self.count = 0
+        self.labels = []
+        self.keys = []
+        if os.path.exists(self.images_path):
+            shape = np.load(self.images_path, mmap_mode='r').shape
+            if shape[1:] != (self.height, self.width, 3):
+                raise ValueError(f"{self.images_path} holds {shape[1:]} images, not {(self.height, self.width, 3)}")
+            self.count = shape[0]
+            if os.path.exists(self.labels_path):
+                self.labels = np.load(self.labels_path).tolist()[:self.count]
+            if os.path.exists(self.keys_path):
+                with open(self.keys_path, encoding='utf-8') as f:
+                    self.keys = f.read().split()[:self.count]
+            self._file = open(self.images_path, 'r+b')
+        else:
+            self._file = open(self.images_path, 'w+b')
+        self._key_set = set(self.keys)
+        self._write_header()
+        self._file.seek(self.HEADER_SIZE + self.count * self.height * self.width * 3)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._key_set
+
+    def _write_header(self):
+        """Write a .npy v1.0 header padded to HEADER_SIZE bytes (lock held)"""
+        header = "{'descr': '|u1', 'fortran_order': False, 'shape': (%d, %d, %d, 3), }" % (
+            self.count, self.height, self.width)
+        header = header.ljust(self.HEADER_SIZE - 10 - 1) + '\n'
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+        self._file.seek(position)
+
+    def append(self, key, image_path, label):
+        """Append one image (unless its key is already packed); returns False if it does not match the tensor shape"""
+        with Image.open(image_path) as img:
+            if img.size != (self.width, self.height):
+                return False
+            pixels = np.asarray(img.convert('RGB'), dtype=np.uint8)
+        
+        with self._lock:
+            if key in self._key_set:
+                return True
+            self._file.write(pixels.tobytes())
+            self.labels.append(label)
+            self.keys.append(key)
+            self._key_set.add(key)
+            self.count += 1
+            if self.count % self.flush_every == 0:
+                self._flush()
+        return True
+
+    def _flush(self):
+        """
+        Persist labels, keys and the header count (lock held)
+        - The header is written last, so an interrupted flush never leaves images.npy
+          counting rows that labels.npy and keys.txt do not cover
+        """
+        with open(self.labels_path + '.tmp', 'wb') as f:
+            np.save(f, np.asarray(self.labels, dtype=np.int32))
+        os.replace(self.labels_path + '.tmp', self.labels_path)
+        with open(self.keys_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.writelines(key + '\n' for key in self.keys)
+        os.replace(self.keys_path + '.tmp', self.keys_path)
+        self._file.flush()
+        self._write_header()
+        self._file.flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+class HostScheduler:
+    """
+    Per-host request pacing that follows robots.txt and adapts to the server
+    - robots.txt is fetched once per host; its Crawl-delay / Request-rate cap the rate
+    - The fetch is a single short request without retries; unreachable or failing
+      robots.txt files count as "allow" (5xx as "disallow") and are fetched again
+      after robots_retry seconds
+    - Requests to a host are spaced 1/rate seconds apart (reserved under a lock,
+      slept outside it, or handed back to the download queue until due)
+    - AIMD: the rate grows by increase req/s after fast responses and is halved on
+      429/503 or responses slower than latency_target; Retry-After pauses the host
+    """
+    
+    def __init__(self, headers, agent='*', rate=2.0, min_rate=0.1, max_rate=20.0,
+                 latency_target=1.0, increase=0.5, respect_robots=True, robots_timeout=5, robots_retry=300):
+        # A session of its own: robots.txt must not go through the scraper's retry adapter
+        self.session = requests.Session()
+        self.headers = headers
+        self.agent = agent
+        self.initial_rate = min(rate, max_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.latency_target = latency_target
+        self.increase = increase
+        self.respect_robots = respect_robots
+        self.robots_timeout = robots_timeout
+        self.robots_retry = robots_retry
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        """State for the URL's host, fetching robots.txt on first use"""
+        parsed = urllib.parse.urlsplit(url)
+        key = f"{parsed.scheme}://{parsed.netloc.lower()}"
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None:
+                host = {
+                    'rate': self.initial_rate, 'max_rate': self.max_rate, 'crawl_delay': None,
+                    'next': 0.0, 'latency': None, 'requests': 0, 'throttled': 0,
+                    'robots': None, 'robots_expires': 0.0, 'lock': threading.Lock()
+                }
+                self._hosts[key] = host
+        
+        if self.respect_robots and host['robots_expires'] <= time.monotonic():
+            with host['lock']:
+                if host['robots_expires'] <= time.monotonic():
+                    host['robots'] = self._fetch_robots(key, host)
+        return host
+
+    def _fetch_robots(self, origin, host):
+        """
+        Fetch and parse robots.txt, following urllib.robotparser's status rules
+        - Sets host['robots_expires']: never for a fetched file, robots_retry seconds
+          ahead for failed fetches and 5xx responses
+        """
+        parser = urllib.robotparser.RobotFileParser(origin + '/robots.txt')
+        host['robots_expires'] = float('inf')
+        try:
+            response = self.session.get(origin + '/robots.txt', headers=self.headers, timeout=self.robots_timeout)
+            if response.status_code in (401, 403):
+                parser.disallow_all = True
+            elif response.status_code >= 400 and response.status_code < 500:
+                parser.allow_all = True
+            elif response.status_code >= 500:
+                parser.disallow_all = True
+                host['robots_expires'] = time.monotonic() + self.robots_retry
+            else:
+                parser.parse(response.text.splitlines())
+        except requests.exceptions.RequestException as e:
+            print(f"Could not fetch robots.txt for {origin}: {str(e)}")
+            parser.allow_all = True
+            host['robots_expires'] = time.monotonic() + self.robots_retry
+        
+        # Published limits cap the adaptive rate
+        delay = parser.crawl_delay(self.agent)
+        request_rate = parser.request_rate(self.agent)
+        if request_rate and request_rate.requests:
+            delay = max(delay or 0, request_rate.seconds / request_rate.requests)
+        if delay:
+            host['crawl_delay'] = float(delay)
+            host['max_rate'] = min(self.max_rate, 1.0 / float(delay))
+            host['rate'] = min(host['rate'], host['max_rate'])
+            print(f"robots.txt for {origin}: crawl delay {float(delay):.2f}s")
+        return parser
+
+    def allowed(self, url):
+        """Whether robots.txt lets us fetch url"""
+        if not self.respect_robots:
+            return True
+        return self._host(url)['robots'].can_fetch(self.agent, url)
+
+    def wait(self, url):
+        """Block until the host's next request slot"""
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self, url):
+        """Reserve the host's next request slot; returns the seconds until it starts"""
+        host = self._host(url)
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, host['next'])
+            host['next'] = start + 1.0 / host['rate']
+            host['requests'] += 1
+        return start - now
+
+    def record(self, url, status_code, latency, retry_after=None):
+        """Adapt the host's rate to a response (latency in seconds, to headers)"""
+        host = self._host(url)
+        with self._lock:
+            if latency is not None:
+                host['latency'] = latency if host['latency'] is None else 0.8 * host['latency'] + 0.2 * latency
+            
+            if status_code in (429, 503):
+                host['throttled'] += 1
+                host['rate'] = max(self.min_rate, host['rate'] / 2)
+                if retry_after:
+                    host['next'] = max(host['next'], time.monotonic() + retry_after)
+            elif latency is not None and latency > self.latency_target:
+                host['rate'] = max(self.min_rate, host['rate'] / 2)
+            elif status_code is not None and status_code < 400:
+                host['rate'] = min(host['max_rate'], host['rate'] + self.increase)
+
+    def rates(self):
+        """Current per-host pacing: rate (req/s), crawl delay, smoothed latency and counters"""
+        with self._lock:
+            return {
+                origin: {
+                    'rate': round(host['rate'], 3),
+                    'max_rate': round(host['max_rate'], 3),
+                    'crawl_delay': host['crawl_delay'],
+                    'latency_ms': None if host['latency'] is None else round(host['latency'] * 1000, 1),
+                    'requests': host['requests'],
+                    'throttled': host['throttled']
+                }
+                for origin, host in self._hosts.items()
+            }
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Statuses worth another attempt later (the host is overloaded or briefly broken)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class HostPaused(Exception):
+    """
+    Raised instead of sleeping when a queued download's host has no polite request slot yet
+    - delay is the seconds until the slot reserved for the URL
+    - throttled is set when the host answered 429/503, so the retry counts as an attempt
+    """
+    def __init__(self, url, delay, throttled=False):
+        super().__init__(f"{url}: host paused for {delay:.2f}s")
+        self.url = url
+        self.delay = delay
+        self.throttled = throttled
+
+def is_retryable(error):
+    """Whether a requests exception is a transient failure (connection, timeout, 429/5xx)"""
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+def requests_exception(error):
+    """The requests exception matching an httpx error, so both transports fail alike"""
+    message = str(error) or type(error).__name__
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.Timeout(message)
+    if isinstance(error, httpx.TransportError):
+        return requests.exceptions.ConnectionError(message)
+    return requests.exceptions.RequestException(message)
+
+def goaway_last_stream(error):
+    """last_stream_id of the graceful HTTP/2 GOAWAY (NO_ERROR) behind an httpx error, else None"""
+    cause = error.__cause__
+    event = cause.args[0] if cause is not None and cause.args else None
+    if hasattr(event, 'last_stream_id') and getattr(event, 'error_code', None) == 0:
+        return event.last_stream_id
+    return None
+
+def is_goaway(error):
+    """Whether an httpx error was caused by a graceful HTTP/2 GOAWAY (NO_ERROR) from the server"""
+    return goaway_last_stream(error) is not None
+
+def resend_kind(error, stream_id=None):
+    """
+    How a request cut off by an httpx connection error (before its response was
+    complete) may be sent again
+    - 'unanswered': the server never answered it (a stream above a GOAWAY's
+      last_stream_id, or a write to a connection that was already closed)
+    - 'resend': the connection closed or refused the stream; counted against a cap
+    - None: a protocol error that a resend would not fix
+    """
+    last_stream_id = goaway_last_stream(error)
+    if isinstance(error, httpx.WriteError) or (last_stream_id is not None and (stream_id or 0) > last_stream_id):
+        return 'unanswered'
+    if last_stream_id is not None or not isinstance(error, httpx.RemoteProtocolError):
+        return 'resend'
+    return None
+
+def update_digest(digest, path, chunk_size=1 << 20):
+    """Feed the contents of the file at path to a hashlib digest"""
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+def raise_for_httpx_status(url, response):
+    """Raise the requests HTTPError that response.raise_for_status() would for an httpx response"""
+    error_response = requests.Response()
+    error_response.status_code = response.status_code
+    error_response.reason = response.reason_phrase
+    error_response.url = url
+    error_response.headers = requests.structures.CaseInsensitiveDict(response.headers)
+    error_response.raise_for_status()
+
+class RetryQueue:
+    """
+    Thread-safe work queue whose items can be scheduled for a later time
+    - put() adds a new item, blocking while maxsize new items are waiting
+    - defer() re-queues an item after delay seconds and never blocks, so workers
+      cannot deadlock on their own retries
+    - park() holds an item under a key (e.g. a busy host) until unpark(key) releases it
+    - get() blocks until an item is due; after close() it returns None once every
+      item has been marked done()
+    """
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self._heap = []
+        self._parked = collections.defaultdict(collections.deque)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._waiting = 0
+        self._unfinished = 0
+        self._closed = False
+
+    def put(self, item):
+        with self._cond:
+            while self.maxsize and self._waiting >= self.maxsize:
+                self._cond.wait()
+            self._waiting += 1
+            self._unfinished += 1
+            heapq.heappush(self._heap, (time.monotonic(), next(self._seq), True, item))
+            self._cond.notify_all()
+
+    def defer(self, item, delay):
+        with self._cond:
+            self._unfinished += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), False, item))
+            self._cond.notify_all()
+
+    def park(self, key, item):
+        with self._cond:
+            self._unfinished += 1
+            self._parked[key].append(item)
+
+    def unpark(self, key):
+        """Make the oldest item parked under key due now"""
+        with self._cond:
+            parked = self._parked.get(key)
+            if not parked:
+                return
+            heapq.heappush(self._heap, (time.monotonic(), next(self._seq), False, parked.popleft()))
+            if not parked:
+                del self._parked[key]
+            self._cond.notify_all()
+
+    def get(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    _, _, new, item = heapq.heappop(self._heap)
+                    if new:
+                        self._waiting -= 1
+                        self._cond.notify_all()
+                    return item
+                if self._closed and not self._unfinished:
+                    return None
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def done(self):
+        """Mark an item returned by get() as finished (after deferring it, if needed)"""
+        with self._cond:
+            self._unfinished -= 1
+            if not self._unfinished:
+                self._cond.notify_all()
+
+    def close(self):
+        """No new items will be put; workers stop once the queue drains"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker for downloads
+    - threshold consecutive failures open a host's circuit for cooldown seconds
+    - After the cooldown one probe request is let through: success closes the
+      circuit, failure reopens it for twice as long; a probe that ends without a
+      response (skipped, unresolvable) is handed back with release_probe()
+    - A host whose circuit opened more than max_trips times in a row is given up
+    - Retry-After pauses a host without counting as a failure streak
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0, max_trips=3):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self.opened = 0
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {'failures': 0, 'trips': 0, 'until': 0.0, 'probing': False}
+        return state
+
+    def check(self, host):
+        """
+        Whether a request to host may start now, as (state, wait)
+        - 'closed' or 'probe': go ahead (a probe's outcome decides the circuit)
+        - 'open': try again in wait seconds
+        - 'down': the host kept failing, give up
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                return 'closed', 0
+            if state['trips'] > self.max_trips:
+                return 'down', 0
+            now = time.monotonic()
+            if now < state['until']:
+                return 'open', state['until'] - now
+            if state['failures'] < self.threshold:
+                return 'closed', 0
+            if state['probing']:
+                return 'open', min(1.0, self.cooldown)
+            state['probing'] = True
+            return 'probe', 0
+
+    def success(self, host):
+        with self._lock:
+            if host in self._hosts:
+                self._hosts[host] = {'failures': 0, 'trips': 0, 'until': 0.0, 'probing': False}
+
+    def failure(self, host, retry_after=None):
+        with self._lock:
+            state = self._host(host)
+            now = time.monotonic()
+            state['failures'] += 1
+            if state['probing'] or state['failures'] == self.threshold:
+                state['trips'] += 1
+                cooldown = self.cooldown * 2 ** (state['trips'] - 1)
+                state['until'] = max(state['until'], now + cooldown)
+                self.opened += 1
+                if state['trips'] > self.max_trips:
+                    print(f"Giving up on host {host} after {state['failures']} failures")
+                else:
+                    print(f"Circuit open for host {host} ({state['failures']} failures, retry in {cooldown:.0f}s)")
+            state['probing'] = False
+            if retry_after:
+                state['until'] = max(state['until'], now + retry_after)
+
+    def release_probe(self, host):
+        """Let another request probe the host when this probe recorded no outcome"""
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is not None:
+                state['probing'] = False
+
+    def record(self, host, status_code, retry_after=None):
+        """Count a response: 429/5xx are failures, anything else proves the host is up"""
+        if status_code in RETRY_STATUSES:
+            self.failure(host, retry_after)
+        else:
+            self.success(host)
+
+    def open_hosts(self):
+        """Hosts whose circuit is currently open or given up"""
+        with self._lock:
+            now = time.monotonic()
+            return sorted(host for host, state in self._hosts.items()
+                          if state['until'] > now or state['trips'] > self.max_trips)
+
+class HTTP2Clients:
+    """
+    httpx clients for the http2 transport, on one event loop
+    - Hosts share one client until a connection to them is closed under a request;
+      such a host then gets clients of its own, each retired after a budget of
+      requests, so the server's per-connection request limit is never reached while
+      streams are in flight
+    - The budget is the requests the closed connection took before the failed stream
+      (kept 10% below the limit a GOAWAY states, when one is seen) and grows by 10%
+      for every client retired without losing its connection
+    - Every request takes its client with acquire() and hands it back with release()
+      once the response is closed; a retired client is closed after its last request
+    """
+
+    def __init__(self, make_client):
+        self._make_client = make_client
+        self.shared = make_client()
+        self._budgets = {}
+        self._ceilings = {}
+        self._current = {}
+        self._active = Counter()
+        self._retired = set()
+        self._lost = set()
+
+    def note_closed(self, host, client, error, stream_id=None):
+        """Lower host's request budget after client's connection closed under stream stream_id"""
+        last_stream_id = goaway_last_stream(error)
+        if last_stream_id is not None:
+            # Client streams have odd ids, so the connection took last_stream_id // 2 + 1 requests
+            served = last_stream_id // 2 + 1
+            ceiling = max(1, (served - 1) * 9 // 10)
+            if ceiling < self._ceilings.get(host, float('inf')):
+                self._ceilings[host] = ceiling
+                print(f"Host {host} closes connections after {served} requests; sending at most {ceiling} over each")
+        elif client in self._lost or not stream_id:
+            return
+        else:
+            ceiling = max(1, stream_id // 2)
+        
+        # Only the first loss of each client counts: its other streams died with the same connection
+        self._lost.add(client)
+        self._budgets[host] = min(self._budgets.get(host, float('inf')), ceiling)
+
+    def acquire(self, host):
+        """The client for a request to host"""
+        budget = self._budgets.get(host)
+        if budget is None:
+            client = self.shared
+        else:
+            current = self._current.get(host)
+            if current is None or current[1] >= budget:
+                if current is not None:
+                    self._retire(host, current[0])
+                    budget = self._budgets[host]
+                current = self._current[host] = [self._make_client(), 0]
+            current[1] += 1
+            client = current[0]
+        self._active[client] += 1
+        return client
+
+    def _retire(self, host, client):
+        self._retired.add(client)
+        if client not in self._lost:
+            budget = self._budgets[host]
+            self._budgets[host] = min(budget + max(1, budget // 10), self._ceilings.get(host, float('inf')))
+
+    async def release(self, client):
+        self._active[client] -= 1
+        if client in self._retired and not self._active[client]:
+            self._retired.discard(client)
+            self._lost.discard(client)
+            del self._active[client]
+            await client.aclose()
+
+    async def aclose(self):
+        clients = {self.shared} | self._retired | {current[0] for current in self._current.values()}
+        for client in clients:
+            await client.aclose()
+
+class DNSCache:
+    """
+    Thread-safe hostname resolution cache
+    - Answers are kept for their record TTL (with dnspython installed) or ttl seconds
+    - Failed lookups are cached for negative_ttl so dead hosts fail fast
+    - prefetch() resolves hosts on background threads; resolve() joins a lookup
+      already in flight for up to wait seconds instead of repeating it
+    - Hosts that were not prefetched, or whose prefetch is still queued, are looked up
+      on the calling thread rather than behind the other prefetches
+    """
+    
+    def __init__(self, ttl=300, negative_ttl=60, workers=4, wait=2.0):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.wait = wait
+        self.hits = 0
+        self.lookups = 0
+        self._entries = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dns')
+
+    def _lookup(self, host):
+        """Resolve host to a list of addresses (None on failure) and cache the answer"""
+        addresses, ttl = None, self.negative_ttl
+        if dns_resolver:
+            try:
+                answer = dns_resolver.resolve(host, 'A')
+                addresses, ttl = [record.address for record in answer], answer.rrset.ttl
+            except Exception:
+                pass
+        if addresses is None:
+            # System resolver: covers /etc/hosts and IPv6-only names, without TTLs
+            try:
+                infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+                addresses, ttl = sorted({info[4][0] for info in infos}), self.ttl
+            except (socket.gaierror, UnicodeError):
+                pass
+        
+        with self._lock:
+            self._entries[host] = (addresses, time.monotonic() + ttl)
+            self._pending.pop(host, None)
+            self.lookups += 1
+        return addresses
+
+    def _cached(self, host):
+        """(found, addresses) for a fresh cache entry (lock held)"""
+        entry = self._entries.get(host)
+        if entry and entry[1] > time.monotonic():
+            return True, entry[0]
+        return False, None
+
+    def _submit(self, host):
+        """Start a background lookup unless one is running (lock held)"""
+        future = self._pending.get(host)
+        if future is None:
+            future = self._executor.submit(self._lookup, host)
+            self._pending[host] = future
+        return future
+
+    @staticmethod
+    def _literal(host):
+        """The address itself if host is an IP literal"""
+        try:
+            return str(ipaddress.ip_address(host))
+        except ValueError:
+            return None
+
+    def prefetch(self, host):
+        """Resolve host in the background if it is not cached"""
+        if not host or self._literal(host):
+            return
+        with self._lock:
+            if not self._cached(host)[0]:
+                self._submit(host)
+
+    def resolve(self, host):
+        """Addresses for host, or None if it does not resolve"""
+        if not host:
+            return None
+        if self._literal(host):
+            return [self._literal(host)]
+        
+        with self._lock:
+            found, addresses = self._cached(host)
+            if found:
+                self.hits += 1
+                return addresses
+            future = self._pending.get(host)
+        
+        if future is not None and not future.cancel():
+            try:
+                return future.result(timeout=self.wait)
+            except FutureTimeoutError:
+                pass
+        return self._lookup(host)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+# Pillow format names for image content types, for format rules checked before the body
+CONTENT_TYPE_FORMATS = {
+    'image/jpeg': 'JPEG', 'image/jpg': 'JPEG', 'image/pjpeg': 'JPEG', 'image/png': 'PNG',
+    'image/gif': 'GIF', 'image/webp': 'WEBP', 'image/bmp': 'BMP', 'image/tiff': 'TIFF',
+    'image/avif': 'AVIF', 'image/svg+xml': 'SVG', 'image/x-icon': 'ICO',
+    'image/vnd.microsoft.icon': 'ICO'
+}
+
+# Bytes fed to the header parser before giving up on reading dimensions early
+SNIFF_LIMIT = 256 * 1024
+
+# Trailer each format must end with; Image.verify() does not notice a cut-off JPEG
+IMAGE_TRAILERS = {
+    'JPEG': b'\xff\xd9',
+    'PNG': b'IEND',
+    'GIF': b'\x3b'
+}
+
+class BodyCheck:
+    """
+    Download rules applied to an image body as it streams in
+    - feed(chunk) returns why the transfer must stop, or None: over max_bytes, or
+      rejected by check_image(format, size) once the header has been parsed from
+      the first SNIFF_LIMIT bytes
+    - written counts the bytes fed so far
+    """
+    
+    def __init__(self, max_bytes=None, check_image=None):
+        self.max_bytes = max_bytes
+        self.check_image = check_image
+        self.parser = ImageFile.Parser() if check_image else None
+        self.written = 0
+
+    def feed(self, chunk):
+        self.written += len(chunk)
+        if self.max_bytes and self.written > self.max_bytes:
+            return f"larger than {self.max_bytes} bytes"
+        
+        if self.parser is not None:
+            try:
+                self.parser.feed(chunk)
+            except Exception:
+                self.parser = None
+            if self.parser is not None and self.parser.image is not None:
+                image, self.parser = self.parser.image, None
+                return self.check_image(image.format, image.size)
+            if self.written >= SNIFF_LIMIT:
+                self.parser = None
+        return None
+
+def verify_image_file(path):
+    """Raise if the image file is unreadable or its data stops before the format's end marker"""
+    with Image.open(path) as img:
+        image_format = img.format
+        img.verify()
+    
+    trailer = IMAGE_TRAILERS.get(image_format)
+    if trailer:
+        with open(path, 'rb') as f:
+            f.seek(max(0, os.path.getsize(path) - 64))
+            if trailer not in f.read():
+                raise ValueError(f"truncated {image_format} data")
+
+def parse_srcset(value):
+    """
+    Parse a srcset attribute into [(url, width, density)]
+    - Follows the HTML tokenizing rules: URLs are whitespace-delimited runs and
+      may contain commas; descriptors run to the next comma
+    - width comes from "640w" descriptors and density from "2x"; a candidate
+      without descriptors is 1x
+    """
+    value = value or ''
+    length = len(value)
+    position = 0
+    candidates = []
+    while position < length:
+        # Skip whitespace and separating commas
+        while position < length and (value[position].isspace() or value[position] == ','):
+            position += 1
+        if position >= length:
+            break
+        
+        end = position
+        while end < length and not value[end].isspace():
+            end += 1
+        url = value[position:end]
+        position = end
+        
+        descriptor = ''
+        if url.endswith(','):
+            url = url.rstrip(',')
+        else:
+            end = value.find(',', position)
+            end = length if end == -1 else end
+            descriptor = value[position:end]
+            position = end + 1
+        
+        width = density = None
+        for part in descriptor.split():
+            try:
+                if part.endswith('w'):
+                    width = int(float(part[:-1]))
+                elif part.endswith('x'):
+                    density = float(part[:-1])
+            except ValueError:
+                continue
+        if width is None and density is None:
+            density = 1.0
+        if url:
+            candidates.append((url, width, density))
+    return candidates
+
+def sizes_slot_width(sizes):
+    """Pixel width of the default (last) slot of a sizes attribute, e.g. "(max-width: 600px) 100vw, 300px" -> 300"""
+    if not sizes:
+        return None
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)px\s*', sizes.split(',')[-1])
+    return int(float(match.group(1))) if match else None
+
+def choose_srcset_candidate(srcsets, target_size=None, base_width=None):
+    """
+    Pick the URL to download from srcset strings
+    - Candidate widths come from w descriptors, or density x base_width (the img
+      width attribute or a fixed sizes slot) for x descriptors
+    - With a target_size, the narrowest candidate at least max(target_size) wide;
+      otherwise (or if none is wide enough) the widest
+    - Returns None when there are no candidates
+    """
+    candidates = []
+    for srcset in srcsets:
+        for url, width, density in parse_srcset(srcset):
+            if width is None and base_width:
+                width = int(base_width * density)
+            # Unknown widths rank by density so the sharpest is "widest"
+            candidates.append((width if width is not None else 0, density or 0, url))
+    if not candidates:
+        return None
+    
+    if target_size:
+        needed = max(target_size)
+        wide_enough = [c for c in candidates if c[0] >= needed]
+        if wide_enough:
+            return min(wide_enough, key=lambda c: (c[0], c[1]))[2]
+    return max(candidates, key=lambda c: (c[0], c[1]))[2]
+
+_decodable_types = None
+
+def pillow_can_decode(mime_type):
+    """Whether Pillow has a decoder for a <source type=...> content type"""
+    global _decodable_types
+    if not mime_type:
+        return True
+    if _decodable_types is None:
+        Image.init()
+        _decodable_types = set(Image.MIME.values())
+    return mime_type.split(';')[0].strip().lower() in _decodable_types
+
+# Class/id fragments of pagination containers and anchor texts of "next page" links
+PAGER_PATTERN = re.compile(r'pag(?:e|er|ing|ination)|nav-links|next', re.IGNORECASE)
+NEXT_LINK_TEXTS = {'next', 'next page', 'next »', 'next ›', 'older', 'older posts', 'more', 'load more', '»', '›', '>', '>>'}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.svg', '.ico', '.avif')
+
+def classify_links(candidates, page_url, follow_pattern=None):
+    """
+    Split link candidates into (pagination, gallery) absolute URLs
+    - candidates are dicts with href, rel, text, pager (inside a pagination
+      container) and has_img (wraps an image)
+    - Pagination: rel="next", "next"-style texts, or page numbers inside a pager
+    - Gallery: links matching follow_pattern, or image-wrapping links without one
+    """
+    pagination, gallery = {}, {}
+    for link in candidates:
+        href = (link.get('href') or '').strip()
+        if not href or href.startswith(('#', 'javascript:', 'mailto:', 'tel:')):
+            continue
+        url = urllib.parse.urldefrag(urljoin(page_url, href))[0]
+        if not url.startswith('http') or urllib.parse.urlsplit(url).path.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        
+        text = (link.get('text') or '').strip().lower()
+        if 'next' in (link.get('rel') or '').lower().split() or text in NEXT_LINK_TEXTS or (link.get('pager') and text.isdigit()):
+            pagination[url] = True
+        elif follow_pattern.search(url) if follow_pattern else link.get('has_img'):
+            gallery[url] = True
+    return list(pagination), [url for url in gallery if url not in pagination]
+
+# Link candidates of a rendered page, with the fields classify_links reads
+EXTRACT_LINKS_SCRIPT = """
+const pager = /pag(?:e|er|ing|ination)|nav-links|next/i;
+const found = [];
+for (const elem of document.querySelectorAll('a[href], link[rel~="next"][href]')) {
+    let inPager = false;
+    let node = elem;
+    for (let level = 0; level < 4 && node; level++) {
+        if (pager.test((node.getAttribute('class') || '') + ' ' + (node.id || ''))) {
+            inPager = true;
+            break;
+        }
+        node = node.parentElement;
+    }
+    found.push({
+        href: elem.getAttribute('href'),
+        rel: elem.getAttribute('rel') || '',
+        text: (elem.textContent || '').trim(),
+        pager: inPager,
+        has_img: elem.getElementsByTagName('img').length > 0
+    });
+}
+return found;
+"""
+
+# Markup left by client-side frameworks that render the page in the browser
+SPA_MARKERS = re.compile(
+    r'<div[^>]+id=["\'](?:root|app|__next|__nuxt)["\']|data-reactroot|ng-app|ng-version|'
+    r'window\.__NUXT__|window\.__INITIAL_STATE__|__NEXT_DATA__',
+    re.IGNORECASE
+)
+
+def url_pattern(url):
+    """Host and path with id-like segments wildcarded, e.g. example.com/gallery/*/page/*"""
+    parsed = urllib.parse.urlsplit(url)
+    segments = ['*' if re.search(r'\d', segment) else segment for segment in parsed.path.split('/')]
+    return parsed.netloc.lower() + ('/'.join(segments) or '/')
+
+# Resolves once the page has had no DOM mutations and no finished resource loads for
+# idle_ms (or timeout_ms passes); arguments: idle_ms, timeout_ms, callback. The resource
+# timing buffer (250 entries by default) is enlarged so loads keep counting on long pages
+QUIESCENCE_SCRIPT = """
+const [idleMs, timeoutMs, done] = arguments;
+const state = window.__scraperState || (window.__scraperState = {
+    last: performance.now(), resources: 0, seen: new WeakMap()
+});
+if (!state.observer) {
+    performance.setResourceTimingBufferSize(1000000);
+    state.observer = new MutationObserver(() => { state.last = performance.now(); });
+    state.observer.observe(document, {
+        childList: true, subtree: true, attributes: true,
+        attributeFilter: ['src', 'srcset', 'data-src', 'data-srcset', 'data-lazy-src', 'style']
+    });
+}
+const start = performance.now();
+(function check() {
+    const now = performance.now();
+    const resources = performance.getEntriesByType('resource').length;
+    if (resources !== state.resources) {
+        state.resources = resources;
+        state.last = now;
+    }
+    const quiet = document.readyState === 'complete' && now - state.last >= idleMs;
+    if (quiet || now - start >= timeoutMs) {
+        done(quiet);
+    } else {
+        setTimeout(check, 50);
+    }
+})();
+"""
+
+# Returns the images added (or whose src/srcset changed, e.g. a lazy placeholder swapped
+# for the real image) since the previous call with the same fields the parsed-page
+# path reads: raw URL attribute, alt/title and the first heading/link/paragraph label
+# of the nearest of three ancestors (background images get no label)
+EXTRACT_IMAGES_SCRIPT = """
+const state = window.__scraperState || (window.__scraperState = {seen: new WeakMap()});
+const labelCache = new Map();
+const textOf = (node) => {
+    const parts = [];
+    const walker = document.createTreeWalker(node, NodeFilter.SHOW_TEXT, {
+        acceptNode: (text) => /^(SCRIPT|STYLE)$/.test(text.parentNode.nodeName)
+            ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT
+    });
+    while (walker.nextNode()) {
+        const part = walker.currentNode.nodeValue.trim();
+        if (part) parts.push(part);
+    }
+    return parts.join('');
+};
+const firstLabel = (node) => {
+    if (labelCache.has(node)) return labelCache.get(node);
+    let label = null;
+    for (const elem of node.querySelectorAll('h1, h2, h3, h4, h5, a, p')) {
+        const text = textOf(elem);
+        if (text && text.length >= 3) { label = text; break; }
+    }
+    labelCache.set(node, label);
+    return label;
+};
+const found = [];
+for (const img of document.getElementsByTagName('img')) {
+    const src = img.getAttribute('data-src') || img.getAttribute('data-lazy-src') || img.getAttribute('src');
+    if (!src || !(img.getAttribute('src') || img.classList.contains('lazy'))) continue;
+    const key = [src, img.getAttribute('src'), img.getAttribute('data-srcset'), img.getAttribute('srcset')].join(' ');
+    if (state.seen.get(img) === key) continue;
+    state.seen.set(img, key);
+    let label = null;
+    let parent = img.parentNode;
+    for (let level = 0; level < 3 && parent && parent.querySelectorAll; level++) {
+        label = firstLabel(parent);
+        if (label) break;
+        parent = parent.parentNode;
+    }
+    const srcsets = ['data-srcset', 'srcset'].map((name) => img.getAttribute(name)).filter(Boolean);
+    const sources = [];
+    if (img.parentNode && img.parentNode.nodeName === 'PICTURE') {
+        for (const source of img.parentNode.children) {
+            if (source.nodeName !== 'SOURCE') continue;
+            const srcset = source.getAttribute('data-srcset') || source.getAttribute('srcset');
+            if (srcset) sources.push({srcset: srcset, type: source.getAttribute('type') || ''});
+        }
+    }
+    found.push({
+        src: src, alt: img.getAttribute('alt') || '', title: img.getAttribute('title') || '', label: label,
+        srcsets: srcsets, sources: sources, width: img.getAttribute('width'), sizes: img.getAttribute('sizes')
+    });
+}
+for (const elem of document.querySelectorAll('[style]')) {
+    const style = elem.getAttribute('style') || '';
+    if (!style.includes('background-image')) continue;
+    const match = style.match(/url\\(["']?([^"']+)["']?\\)/);
+    if (!match || state.seen.get(elem) === match[1]) continue;
+    state.seen.set(elem, match[1]);
+    found.push({src: match[1], alt: '', title: '', label: null});
+}
+return found;
+"""
+
+class DriverPool:
+    """
+    Pool of long-lived WebDriver instances shared by page renders
+    - Drivers are started lazily by factory(), at most size at a time
+    - A driver is recycled after max_pages renders or when a render crashes it
+    - max_memory caps the resident memory (bytes) of all pooled browsers; over the
+      cap no new browser is started and released ones are recycled (needs psutil)
+    """
+    
+    def __init__(self, factory, size=1, max_pages=50, max_memory=None):
+        self.factory = factory
+        self.size = max(1, size)
+        self.max_pages = max_pages
+        self.max_memory = max_memory
+        self.launched = 0
+        self.recycled = 0
+        self._idle = []
+        self._pages = {}
+        self._cond = threading.Condition()
+        if max_memory and psutil is None:
+            print("Warning: psutil is not installed, browser memory cap is disabled")
+
+    def memory_usage(self):
+        """Resident bytes of every pooled driver process and its browser children"""
+        if psutil is None:
+            return 0
+        total = 0
+        for driver in list(self._pages):
+            try:
+                process = psutil.Process(driver.service.process.pid)
+                for proc in [process] + process.children(recursive=True):
+                    total += proc.memory_info().rss
+            except Exception:
+                continue
+        return total
+
+    def _over_memory(self):
+        return bool(self.max_memory) and self.memory_usage() > self.max_memory
+
+    def acquire(self):
+        """Take an idle driver, starting a new one if the pool has room"""
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if len(self._pages) < self.size and (not self._pages or not self._over_memory()):
+                    break
+                self._cond.wait()
+            # Reserve the slot while the browser starts outside the lock
+            placeholder = object()
+            self._pages[placeholder] = 0
+        
+        try:
+            driver = self.factory()
+        except Exception:
+            with self._cond:
+                del self._pages[placeholder]
+                self._cond.notify()
+            raise
+        
+        with self._cond:
+            del self._pages[placeholder]
+            self._pages[driver] = 0
+            self.launched += 1
+        return driver
+
+    def release(self, driver, crashed=False):
+        """Return a driver after one render, recycling it if it is worn out"""
+        with self._cond:
+            self._pages[driver] += 1
+            worn_out = self.max_pages and self._pages[driver] >= self.max_pages
+        
+        if crashed or worn_out or self._over_memory():
+            self._quit(driver)
+            with self._cond:
+                self.recycled += 1
+                self._cond.notify()
+            return
+        
+        with self._cond:
+            self._idle.append(driver)
+            self._cond.notify()
+
+    def _quit(self, driver):
+        with self._cond:
+            self._pages.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @contextlib.contextmanager
+    def driver(self):
+        """Borrow a driver for one page; WebDriver errors retire it"""
+        driver = self.acquire()
+        crashed = False
+        try:
+            yield driver
+        except WebDriverException:
+            crashed = True
+            raise
+        finally:
+            self.release(driver, crashed)
+
+    def close(self):
+        """Quit idle drivers; the pool starts new ones if it is used again"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for driver in idle:
+            self._quit(driver)
+
 
 class ImageScraper:
-    def __init__(self, output_dir="dataset", target_size=None):
+    def __init__(self, output_dir="dataset", target_size=None, max_workers=1, max_per_host=4,
+                 streaming=False, queue_size=64, process_workers=None, process_pool=False,
+                 fast_resize=False, output_format=None, output_quality=None, content_store=False,
+                 near_dup_threshold=None, near_dup_method='dhash', near_dup_action='drop',
+                 journal=False, max_attempts=3, http_cache=False, http_cache_size=1024 ** 3,
+                 html_parser='html.parser', manifest='json', manifest_row_group_size=10000,
+                 shards=False, shard_size=1024 ** 3, array_output=False, keep_files=True,
+                 collect_stats=False, resize_policy='stretch', variants=None,
+                 browser_pool_size=1, browser_max_pages=50, browser_max_memory=None,
+                 adaptive_scroll=False, scroll_idle=0.5, scroll_timeout=10, max_scrolls=20,
+                 discovery='browser', js_min_images=5, crawl=False, seed_urls=None,
+                 max_depth=1, max_pages=100, crawl_scope='domain', follow_pattern=None,
+                 polite=False, respect_robots=True, robots_agent='*', host_rate=2.0, max_host_rate=20.0,
+                 latency_target=1.0, dns_ttl=300, dns_negative_ttl=60, min_image_size=None,
+                 max_image_size=None, min_bytes=None, max_bytes=None, allowed_formats=None,
+                 verify_downloads=False, head_requests=False, responsive_images=False,
+                 url_index='keys', persist_url_index=False, bloom_capacity=10_000_000,
+                 bloom_error_rate=0.001, strip_params=TRACKING_PARAMS, url_variant_rules=(),
+                 retry_queue=False, retry_attempts=4, retry_backoff=1.0, breaker_threshold=5,
+                 breaker_cooldown=30.0, breaker_max_trips=3, transport='requests', max_in_flight=256,
+                 max_streams_per_host=100, max_connections=10):
         """Initialize the scraper with output directory and optional target size"""
         self.base_url = "https://www5.javmost.com/pornstar/all/"
         self.output_dir = output_dir
         self.target_size = target_size
         self.categories = set()
         
-        # Configure retry strategy with longer delays
+        # BeautifulSoup tree builder ('lxml' is much faster when installed)
+        self.html_parser = html_parser
+        
+        # Download concurrency (max_workers=1 keeps the sequential behaviour)
+        self.max_workers = max(1, max_workers)
+        self.max_per_host = max(1, max_per_host)
+        self._host_slots = {}
+        self._claimed_paths = set()
+        self._lock = threading.Lock()
+        
+        # Streaming pipeline: discovery feeds downloads through bounded queues
+        self.streaming = streaming
+        self.queue_size = max(1, queue_size)
+        
+        # Optional process pool so resizing uses every core instead of the download threads
+        self.process_pool = process_pool
+        if process_workers is None:
+            process_workers = (os.cpu_count() or 1) if process_pool else 1
+        self.process_workers = max(1, process_workers)
+        self._process_executor = None
+        
+        # Resize/encode options: reduced-scale decoding and an explicit output codec
+        if resize_policy not in RESIZE_POLICIES:
+            raise ValueError(f"Unknown resize policy: {resize_policy}")
+        self.resize_policy = resize_policy
+        self.variants = self._parse_variants(variants or [])
+        self.fast_resize = fast_resize
+        self.output_format = normalize_output_format(output_format)
+        self.output_quality = output_quality
+        
+        # Configure retry strategy with longer delays (the polite scheduler handles 429/503 itself)
         retry_strategy = Retry(
             total=5,
             backoff_factor=2,
-            status_forcelist=[429, 500, 502, 503, 504],
+            status_forcelist=[500, 502, 504] if polite else [429, 500, 502, 503, 504],
+            respect_retry_after_header=not polite,
             allowed_methods=["HEAD", "GET", "OPTIONS"]
         )
         
-        # Create session with retry strategy
+        # Create session with retry strategy, sized so every worker can hold a connection
         self.session = requests.Session()
         adapter = requests.adapters.HTTPAdapter(
             max_retries=retry_strategy,
             pool_connections=10,
-            pool_maxsize=10
+            pool_maxsize=max(10, self.max_workers)
         )
         self.session.mount("https://", adapter)
         self.session.mount("http://", adapter)
         
+        # Optional non-blocking retries: downloads use a session that never sleeps in a
+        # retry, failed images are re-queued with backoff and failing hosts are paused
+        self.retry_queue = retry_queue
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_backoff = retry_backoff
+        self.retry_counts = Counter()
+        self._slot_grants = {}
+        self._head_passed = set()
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown, breaker_max_trips) if retry_queue else None
+        self._host_active = Counter()
+        self.download_session = self.session
+        if retry_queue:
+            self.download_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                max_retries=0,
+                pool_connections=10,
+                pool_maxsize=max(10, self.max_workers)
+            )
+            self.download_session.mount("https://", adapter)
+            self.download_session.mount("http://", adapter)
+        
+        # Image download transport: 'requests' (a thread per download) or 'http2' (asyncio
+        # on one thread, many requests multiplexed over each HTTP/2 connection)
+        if transport not in ('requests', 'http2'):
+            raise ValueError(f"Unknown transport: {transport}")
+        if transport == 'http2' and (httpx is None or importlib.util.find_spec('h2') is None):
+            raise ImportError("The http2 transport requires httpx with HTTP/2 support (pip install 'httpx[http2]')")
+        self.transport = transport
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_streams_per_host = max(1, max_streams_per_host)
+        self.max_connections = max(1, max_connections)
+        if transport == 'http2' and http_cache:
+            print("Warning: image downloads bypass the HTTP cache on the http2 transport")
+        
         # Enhanced browser-like headers
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -69,44 +2744,228 @@ class ImageScraper:
             'Referer': 'https://www.google.com/'
         }
         
+        # Optional per-host politeness: robots.txt rules and AIMD-adapted request rates
+        self.scheduler = HostScheduler(
+            self.headers, robots_agent, host_rate, max_rate=max_host_rate,
+            latency_target=latency_target, respect_robots=respect_robots
+        ) if polite else None
+        
+        # Download rules checked while streaming: dimensions and format come from the
+        # first chunks, so junk transfers are aborted early
+        self.min_image_size = tuple(min_image_size) if min_image_size else None
+        self.max_image_size = tuple(max_image_size) if max_image_size else None
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.allowed_formats = {'JPEG' if f.upper() == 'JPG' else f.upper() for f in allowed_formats} if allowed_formats else None
+        self.verify_downloads = verify_downloads
+        self.head_requests = head_requests
+        
+        # Choose among srcset / <picture> candidates instead of the plain src
+        self.responsive_images = responsive_images
+        
+        # Discovered URLs are deduplicated on canonical keys across pages; seen_urls only
+        # holds images that were downloaded (or were content duplicates), so it can be
+        # persisted without hiding failed or unattempted images from later runs
+        if url_index not in ('keys', 'bloom'):
+            raise ValueError(f"Unknown URL index: {url_index}")
+        self.canonical_url = URLCanonicalizer(strip_params, url_variant_rules)
+        if url_index == 'bloom':
+            index_path = os.path.join(output_dir, 'seen_urls.bloom.npz') if persist_url_index else None
+            self.seen_urls = BloomFilter(bloom_capacity, bloom_error_rate, index_path)
+            self._run_urls = BloomFilter(bloom_capacity, bloom_error_rate)
+        else:
+            index_path = os.path.join(output_dir, 'seen_urls.npy') if persist_url_index else None
+            self.seen_urls = URLKeySet(index_path)
+            self._run_urls = URLKeySet()
+        
+        # Cached, prefetched DNS so host checks never stall download workers
+        self.dns = DNSCache(dns_ttl, dns_negative_ttl)
+        
         # Create output directory
         os.makedirs(output_dir, exist_ok=True)
         
-        # Initialize metadata storage
-        self.metadata = []
+        # Optional content-addressed storage with byte-level deduplication
+        self.store = ContentStore(os.path.join(output_dir, '_store')) if content_store else None
+        
+        # Optional near-duplicate filter on perceptual hashes ('drop' or 'group' matches)
+        if near_dup_method not in PHASH_INPUT_SIZES:
+            raise ValueError(f"Unknown perceptual hash method: {near_dup_method}")
+        if near_dup_action not in ('drop', 'group'):
+            raise ValueError(f"Unknown near-duplicate action: {near_dup_action}")
+        self.near_dup_threshold = near_dup_threshold
+        self.near_dup_method = near_dup_method
+        self.near_dup_action = near_dup_action
+        self.near_dup_index = HammingIndex() if near_dup_threshold is not None else None
+        self._near_dup_refs = []
+        
+        # Optional durable journal so interrupted runs resume where they stopped
+        self.max_attempts = max_attempts
+        self.journal = CrawlJournal(os.path.join(output_dir, 'journal.sqlite3')) if journal else None
+        
+        # Optional on-disk HTTP cache revalidated with ETag / Last-Modified
+        self.http_cache = HTTPCache(os.path.join(output_dir, '_http_cache'), http_cache_size) if http_cache else None
+        
+        # Memoized ancestor text/labels, reset for every parsed page
+        self.context = ContextIndex()
+        
+        # Long-lived headless browsers, reused across rendered pages; with more than one
+        # driver, crawls render the next pages in the frontier while the current one is parsed
+        self.driver_pool = DriverPool(self._new_driver, browser_pool_size, browser_max_pages, browser_max_memory)
+        self._renders = {}
+        self._render_executor = None
+        
+        # Adaptive scrolling waits for DOM/network quiescence and extracts new images in the browser
+        self.adaptive_scroll = adaptive_scroll
+        self.scroll_idle = scroll_idle
+        self.scroll_timeout = scroll_timeout
+        self.max_scrolls = max_scrolls
+        
+        # Discovery strategy: 'browser' (Selenium first), 'static' (requests only) or
+        # 'tiered' (requests first, browser only for pages that need JavaScript)
+        if discovery not in ('browser', 'static', 'tiered'):
+            raise ValueError(f"Unknown discovery strategy: {discovery}")
+        self.discovery = discovery
+        self.js_min_images = js_min_images
+        
+        # Crawl mode: breadth-first over seed URLs, their pagination and gallery links
+        if crawl_scope not in ('host', 'domain', 'prefix'):
+            raise ValueError(f"Unknown crawl scope: {crawl_scope}")
+        self.crawl = crawl
+        self.seed_urls = list(seed_urls or [self.base_url])
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.crawl_scope = crawl_scope
+        self.follow_pattern = re.compile(follow_pattern) if isinstance(follow_pattern, str) else follow_pattern
+        self._page_links = {}
+        self.render_decisions_file = os.path.join(output_dir, 'render_decisions.json')
+        self.render_decisions = {}
+        if os.path.exists(self.render_decisions_file):
+            with open(self.render_decisions_file, encoding='utf-8') as f:
+                self.render_decisions = json.load(f)
+        
+        # Training-ready outputs: tar shards and, for a fixed target_size, a uint8 tensor
+        if array_output and not target_size:
+            raise ValueError("array_output requires a fixed target_size")
+        self.shard_writer = TarShardWriter(os.path.join(output_dir, 'shards'), shard_size) if shards else None
+        self.variant_shard_writers = {
+            variant['name']: TarShardWriter(os.path.join(output_dir, 'shards', variant['name']), shard_size)
+            for variant in self.variants
+        } if shards else {}
+        self.array_writer = ArrayWriter(os.path.join(output_dir, 'arrays'), target_size) if array_output else None
+        self.keep_files = keep_files
+        self.classes_file = os.path.join(output_dir, 'classes.json')
+        self.class_labels = {}
+        if os.path.exists(self.classes_file):
+            with open(self.classes_file, encoding='utf-8') as f:
+                self.class_labels = json.load(f)
+        
+        # Streaming dataset statistics, accumulated on top of earlier runs
+        self.stats_file = os.path.join(output_dir, 'stats.json')
+        self.stats = None
+        if collect_stats:
+            self.stats = ImageStats()
+            if os.path.exists(self.stats_file):
+                with open(self.stats_file, encoding='utf-8') as f:
+                    self.stats = ImageStats.from_dict(json.load(f))
+        
+        # Per-image records go to metadata.json ('json') or an incremental Parquet dataset ('parquet')
+        if manifest not in ('json', 'parquet'):
+            raise ValueError(f"Unknown manifest format: {manifest}")
+        self.manifest = (ParquetManifest(os.path.join(output_dir, 'manifest'), manifest_row_group_size)
+                         if manifest == 'parquet' else None)
+        
+        # Initialize metadata storage (restored from the journal when resuming;
+        # the Parquet manifest keeps earlier rows on disk instead)
+        self.metadata = self.journal.completed_metadata() if self.journal and not self.manifest else []
         
         print(f"Initialized scraper with output directory: {output_dir}")
         if target_size:
             print(f"Target image size: {target_size}")
+        if self.max_workers > 1:
+            print(f"Concurrent downloads: {self.max_workers} workers, {self.max_per_host} per host")
+        if self.process_pool:
+            print(f"Image processing pool: {self.process_workers} processes")
+        if self.output_format:
+            print(f"Output format: {self.output_format}")
+        if self.variants:
+            print(f"Variants: {', '.join(variant['name'] for variant in self.variants)}")
+        if self.store:
+            print(f"Content store: {self.store.root} ({len(self.store.objects)} objects)")
+        if self.journal:
+            print(f"Journal: {self.journal.path} ({self.journal.counts()})")
+        if self.http_cache:
+            print(f"HTTP cache: {self.http_cache.root} ({self.http_cache.total_bytes / 2 ** 20:.1f} MiB)")
+        if self.manifest:
+            print(f"Manifest: {self.manifest.root} (Parquet)")
+        if self.shard_writer:
+            print(f"Tar shards: {self.shard_writer.root} (max {self.shard_writer.max_bytes / 2 ** 20:.0f} MiB each)")
+        if self.array_writer:
+            print(f"Array output: {self.array_writer.images_path}")
+        if self.scheduler:
+            print(f"Polite scheduling: {self.scheduler.initial_rate} req/s per host to start, max {max_host_rate}"
+                  f"{', robots.txt respected' if respect_robots else ''}")
+        if self.transport == 'http2':
+            print(f"Transport: HTTP/2 (asyncio), up to {self.max_in_flight} downloads in flight, "
+                  f"{self.max_streams_per_host} per host")
+        if self.retry_queue:
+            print(f"Retry queue: {self.retry_attempts} attempts per image, circuit opens after "
+                  f"{self.breaker.threshold} failures for {self.breaker.cooldown:.0f}s")
+        if len(self.seen_urls):
+            print(f"Seen URLs: {len(self.seen_urls)} from earlier runs ({url_index})")
+        if self.crawl:
+            print(f"Crawl: {len(self.seed_urls)} seeds, depth {self.max_depth}, up to {self.max_pages} pages ({self.crawl_scope} scope)")
+        if self.discovery != 'browser':
+            print(f"Discovery: {self.discovery} ({len(self.render_decisions)} remembered page patterns)")
+        if self.driver_pool.size > 1:
+            print(f"Browser pool: {self.driver_pool.size} drivers, recycled every {browser_max_pages} pages")
+        if self.near_dup_index is not None:
+            print(f"Near-duplicate filter: {self.near_dup_method} <= {self.near_dup_threshold} bits ({self.near_dup_action})")
+
+    def _parse_variants(self, variants):
+        """
+        Normalize variant specs: (width, height), ((width, height), policy)
+        or {'size': (width, height), 'policy': ...}
+        """
+        parsed = []
+        for spec in variants:
+            if isinstance(spec, dict):
+                size, policy = spec['size'], spec.get('policy', self.resize_policy)
+            elif len(spec) == 2 and isinstance(spec[0], (tuple, list)):
+                size, policy = spec
+            else:
+                size, policy = spec, self.resize_policy
+            if policy not in RESIZE_POLICIES:
+                raise ValueError(f"Unknown resize policy: {policy}")
+            size = (int(size[0]), int(size[1]))
+            name = f"{size[0]}x{size[1]}" + ('' if policy == 'stretch' else f"_{policy}")
+            parsed.append({'name': name, 'size': size, 'policy': policy})
+        return parsed
+
+    def variant_path(self, variant, job):
+        """Where a variant of a downloaded image is written: variants/<name>/<category>/<filename>"""
+        return os.path.join(self.output_dir, 'variants', variant['name'], job['category'], job['filename'])
 
     def clean_category_name(self, text):
         """Clean and normalize category name from alt text"""
-        if not text:
-            return "uncategorized"
-        
-        # Convert to lowercase and remove special characters
-        text = text.lower()
-        text = ''.join(c for c in text if c.isalnum() or c.isspace())
-        
-        # Split by spaces and take first few meaningful words
-        words = text.split()
-        if len(words) > 3:
-            words = words[:3]  # Take first 3 words for category name
-        
-        # Join words with underscores
-        category = '_'.join(words)
-        
-        # Handle empty or invalid cases
-        if not category or len(category) < 2:
-            return "uncategorized"
-        
-        return category
+        return _clean_category_name(text)
 
-    def analyze_page_structure(self, soup):
+    def make_soup(self, markup):
+        """Parse HTML with the configured parser, falling back to html.parser"""
+        try:
+            return BeautifulSoup(markup, self.html_parser)
+        except FeatureNotFound:
+            print(f"HTML parser '{self.html_parser}' is not installed, using html.parser")
+            self.html_parser = 'html.parser'
+            return BeautifulSoup(markup, 'html.parser')
+
+    def analyze_page_structure(self, soup, index=None):
         """Analyze the page structure and return relevant selectors"""
         try:
             print("\nAnalyzing page structure...")
             
+            if index is None:
+                index = PageIndex(soup)
+            
             # Store all found patterns
             patterns = {
                 'image_containers': set(),
@@ -115,7 +2974,7 @@ class ImageScraper:
             }
             
             # Find all elements with class attributes
-            elements_with_class = soup.find_all(class_=True)
+            elements_with_class = index.elements_with_class
             print(f"\nFound {len(elements_with_class)} elements with classes")
             
             # Analyze class patterns
@@ -132,7 +2991,7 @@ class ImageScraper:
                     patterns['title_classes'].update(classes)
                 
                 # Look for potential container classes
-                if element.find('img'):
+                if index.first_img(element):
                     patterns['image_containers'].update(classes)
             
             # Print found patterns
@@ -151,6 +3010,7 @@ class ImageScraper:
 
     def extract_image_info(self, element):
         """Extract image information from an element and its context"""
+        context = self.context
         info = {
             'url': None,
             'alt': None,
@@ -164,7 +3024,7 @@ class ImageScraper:
             return None
             
         # Get image URL
-        info['url'] = img.get('data-src') or img.get('src')
+        info['url'] = self.image_source(img)
         if not info['url']:
             return None
             
@@ -185,7 +3045,7 @@ class ImageScraper:
                 break
                 
             # Check text content
-            text = parent.get_text(strip=True)
+            text = context.text(parent)
             if text and text not in info['labels']:
                 info['labels'].append(text)
             
@@ -195,195 +3055,257 @@ class ImageScraper:
                     info['labels'].append(parent.get(attr))
             
             # Check header or link elements
-            for elem in parent.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'a']):
-                text = elem.get_text(strip=True)
-                if text and text not in info['labels']:
+            for text in context.labels(parent):
+                if text not in info['labels']:
                     info['labels'].append(text)
             
             parent = parent.parent
         
         return info
 
-    def scrape_with_bs4(self):
-        """Scrape images using BeautifulSoup"""
-        try:
-            print("Scraping images with BeautifulSoup...")
-            print(f"Accessing URL: {self.base_url}")
-            
-            response = self.session.get(
-                self.base_url,
-                headers=self.headers,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            print(f"Response status: {response.status_code}")
-            print(f"Content type: {response.headers.get('content-type', 'unknown')}")
-            
-            # Parse the HTML content
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Analyze page structure
-            patterns = self.analyze_page_structure(soup)
-            if not patterns:
-                print("Could not analyze page structure")
-                return {}
-            
-            # Find images using discovered patterns
-            images = []
-            
-            # Method 1: Find images directly
-            for img in soup.find_all('img'):
-                if img.get('src'):
+    def image_source(self, img, attrs=('data-src', 'src')):
+        """
+        URL to download for an <img> tag
+        - The first of attrs that is set, as discovery has always done
+        - With responsive_images, srcset/data-srcset and <picture><source> candidates
+          (of types Pillow decodes) are considered and the best fit for target_size wins
+        """
+        fallback = next((img.get(attr) for attr in attrs if img.get(attr)), None)
+        if not self.responsive_images:
+            return fallback
+        
+        srcsets = [img.get(attr) for attr in ('data-srcset', 'srcset') if img.get(attr)]
+        picture = img.parent
+        if isinstance(picture, Tag) and picture.name == 'picture':
+            for source in picture.find_all('source', recursive=False):
+                srcset = source.get('data-srcset') or source.get('srcset')
+                if srcset and pillow_can_decode(source.get('type')):
+                    srcsets.append(srcset)
+        return self.choose_source(fallback, srcsets, img.get('width'), img.get('sizes'))
+
+    def choose_source(self, fallback, srcsets, width=None, sizes=None):
+        """Best of the srcset candidates and the plain src for target_size"""
+        if fallback and not fallback.startswith('data:'):
+            # The plain src is a candidate too (1x, or its width attribute)
+            srcsets = srcsets + [fallback]
+        
+        base_width = int(width) if width and str(width).isdigit() else sizes_slot_width(sizes)
+        return choose_srcset_candidate(srcsets, self.target_size, base_width) or fallback
+
+    def _image_record(self, img, img_src, category):
+        """Normalize the category for a discovered image and build its record"""
+        # Clean category name
+        if category:
+            category = self.clean_category_name(category)
+        
+        if not category or len(category) < 3:
+            category = 'uncategorized'
+        
+        # Create category directory
+        category_dir = os.path.join(self.output_dir, category)
+        os.makedirs(category_dir, exist_ok=True)
+        
+        # Add to categories set
+        self.categories.add(category)
+        
+        return {
+            'url': img_src,
+            'alt': img.get('alt', ''),
+            'title': img.get('title', ''),
+            'category': category
+        }
+
+    def _collect_images(self, records):
+        """Group streamed image records by category and print a summary"""
+        categorized_images = {}
+        for image_data in records:
+            categorized_images.setdefault(image_data['category'], []).append(image_data)
+        
+        # Print summary
+        if categorized_images:
+            print("\nFound categories:")
+            for category in sorted(self.categories):
+                count = len(categorized_images.get(category, []))
+                print(f"- {category}: {count} images")
+        else:
+            print("No images found")
+        
+        return categorized_images
+
+    def fetch_page(self, url):
+        """Fetch a page without a browser and return its HTML"""
+        print(f"Accessing URL: {url}")
+        
+        response = self.http_get(
+            url,
+            headers=self.headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        
+        print(f"Response status: {response.status_code}")
+        print(f"Content type: {response.headers.get('content-type', 'unknown')}")
+        return response.text
+
+    def iter_images_bs4(self, url=None):
+        """Yield image records from the static page as they are discovered"""
+        print("Scraping images with BeautifulSoup...")
+        url = url or self.base_url
+        
+        # Parse the HTML content and index it in a single traversal
+        soup = self.make_soup(self.fetch_page(url))
+        yield from self._iter_static_images(soup, url)
+
+    def _iter_static_images(self, soup, page_url, index=None):
+        """Yield image records from a statically fetched page"""
+        index = index or PageIndex(soup)
+        self.context = ContextIndex()
+        if self.crawl:
+            self._record_links(page_url, self._link_candidates(index))
+        
+        # Analyze page structure
+        patterns = self.analyze_page_structure(soup, index)
+        if not patterns:
+            print("Could not analyze page structure")
+            return
+        
+        # Find images using discovered patterns
+        images = []
+        
+        # Method 1: Find images directly
+        for img in index.imgs:
+            if img.get('src'):
+                images.append(img)
+        
+        # Method 2: Find images in containers
+        for container_class in patterns['image_containers']:
+            for container in index.by_class.get(container_class, []):
+                img = index.first_img(container)
+                if img and img.get('src'):
                     images.append(img)
-            
-            # Method 2: Find images in containers
-            for container_class in patterns['image_containers']:
-                containers = soup.find_all(class_=container_class)
-                for container in containers:
-                    img = container.find('img')
-                    if img and img.get('src'):
-                        images.append(img)
-            
-            # Method 3: Find images by image classes
-            for img_class in patterns['image_classes']:
-                imgs = soup.find_all('img', class_=img_class)
-                for img in imgs:
-                    if img.get('src'):
-                        images.append(img)
-            
-            print(f"\nFound {len(images)} total images")
-            
-            # Process images
-            categorized_images = {}
-            processed_urls = set()
-            
-            for img in images:
-                try:
-                    # Get image URL
-                    img_src = img.get('data-src') or img.get('src')
-                    if not img_src or img_src in processed_urls:
-                        continue
-                    
-                    # Clean up URL
-                    if img_src.startswith('//'):
-                        img_src = 'https:' + img_src
-                    elif not img_src.startswith('http'):
-                        img_src = urljoin(self.base_url, img_src)
-                    
-                    # Skip small images and icons
-                    if any(x in img_src.lower() for x in ['icon', 'logo', 'banner', '.svg', '.ico']):
-                        continue
-                    
-                    processed_urls.add(img_src)
-                    
-                    # Try to get title/name
-                    category = None
-                    
-                    # Method 1: Check img attributes
-                    category = img.get('alt') or img.get('title')
-                    
-                    # Method 2: Check parent elements for title classes
-                    if not category:
-                        parent = img.parent
-                        for _ in range(3):  # Look up to 3 levels
-                            if not parent or not isinstance(parent, Tag):
-                                break
-                            
-                            # Check for elements with title classes
-                            for class_name in patterns['title_classes']:
-                                title_elem = parent.find(class_=class_name)
-                                if title_elem:
-                                    category = title_elem.get_text(strip=True)
-                                    break
+        
+        # Method 3: Find images by image classes
+        for img_class in patterns['image_classes']:
+            for img in index.by_class.get(img_class, []):
+                if img.name == 'img' and img.get('src'):
+                    images.append(img)
+        
+        print(f"\nFound {len(images)} total images")
+        
+        # Process images
+        processed_urls = set()
+        
+        for img in images:
+            try:
+                # Get image URL
+                img_src = self.image_source(img)
+                if not img_src:
+                    continue
+                
+                # Clean up URL
+                if img_src.startswith('//'):
+                    img_src = 'https:' + img_src
+                elif not img_src.startswith('http'):
+                    img_src = urljoin(page_url, img_src)
+                
+                # Skip small images and icons
+                if any(x in img_src.lower() for x in ['icon', 'logo', 'banner', '.svg', '.ico']):
+                    continue
+                
+                # Skip repeats on this page, compared after normalization
+                canonical = self.canonical_url(img_src)
+                if canonical in processed_urls:
+                    continue
+                processed_urls.add(canonical)
+                
+                # Try to get title/name
+                category = None
+                
+                # Method 1: Check img attributes
+                category = img.get('alt') or img.get('title')
+                
+                # Method 2: Check parent elements for title classes
+                if not category:
+                    parent = img.parent
+                    for _ in range(3):  # Look up to 3 levels
+                        if not parent or not isinstance(parent, Tag):
+                            break
                         
-                            if category:
+                        # Check for elements with title classes
+                        for class_name in patterns['title_classes']:
+                            title_elem = index.find_class(parent, class_name)
+                            if title_elem:
+                                category = self.context.text(title_elem)
                                 break
-                            parent = parent.parent
-                    
-                    # Fallback to filename
-                    if not category:
-                        category = os.path.splitext(os.path.basename(img_src))[0]
-                    
-                    # Clean category name
-                    category = self.clean_category_name(category)
-                    if not category or len(category) < 3:
-                        category = 'uncategorized'
                     
-                    # Create category directory
-                    category_dir = os.path.join(self.output_dir, category)
-                    os.makedirs(category_dir, exist_ok=True)
-                    
-                    # Add to categories set
-                    self.categories.add(category)
-                    
-                    # Store image info
-                    if category not in categorized_images:
-                        categorized_images[category] = []
-                    
-                    image_data = {
-                        'url': img_src,
-                        'alt': img.get('alt', ''),
-                        'title': img.get('title', ''),
-                        'category': category
-                    }
-                    
-                    categorized_images[category].append(image_data)
-                    print(f"Found image: {img_src} -> {category}")
-                    
-                except Exception as e:
-                    print(f"Error processing image: {str(e)}")
-                    continue
-            
-            # Print summary
-            if categorized_images:
-                print("\nFound categories:")
-                for category in sorted(self.categories):
-                    count = len(categorized_images.get(category, []))
-                    print(f"- {category}: {count} images")
-            else:
-                print("No images found")
+                        if category:
+                            break
+                        parent = parent.parent
+                
+                # Fallback to filename
+                if not category:
+                    category = os.path.splitext(os.path.basename(img_src))[0]
+                
+                image_data = self._image_record(img, img_src, category)
+                
+            except Exception as e:
+                print(f"Error processing image: {str(e)}")
+                continue
             
-            return categorized_images
+            print(f"Found image: {img_src} -> {image_data['category']}")
+            yield image_data
+
+    def scrape_with_bs4(self):
+        """Scrape images using BeautifulSoup"""
+        try:
+            return self._collect_images(self.iter_images_bs4())
             
         except Exception as e:
             print(f"Error in scraping: {str(e)}")
             traceback.print_exc()
             return {}
 
-    def scrape_with_selenium(self):
-        """Scrape images using Selenium for dynamic content"""
+    def _new_driver(self):
+        """Start a headless Chrome configured with the scraper's headers"""
+        print("\nSetting up Selenium...")
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless=new')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        options.add_argument('--window-size=1920,1080')
+        options.add_argument('--disable-blink-features=AutomationControlled')
+        options.add_argument('--disable-notifications')
+        
+        # Add more browser-like behavior
+        options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        options.add_experimental_option('useAutomationExtension', False)
+        
+        # Add custom headers
+        for key, value in self.headers.items():
+            options.add_argument(f'--header={key}:{value}')
+        
+        # Set up ChromeDriver
+        service = Service()
+        driver = webdriver.Chrome(service=service, options=options)
+        
         try:
-            print("\nSetting up Selenium...")
-            options = webdriver.ChromeOptions()
-            options.add_argument('--headless=new')
-            options.add_argument('--no-sandbox')
-            options.add_argument('--disable-dev-shm-usage')
-            options.add_argument('--window-size=1920,1080')
-            options.add_argument('--disable-blink-features=AutomationControlled')
-            options.add_argument('--disable-notifications')
-            
-            # Add more browser-like behavior
-            options.add_experimental_option("excludeSwitches", ["enable-automation"])
-            options.add_experimental_option('useAutomationExtension', False)
-            
-            # Add custom headers
-            for key, value in self.headers.items():
-                options.add_argument(f'--header={key}:{value}')
-            
-            # Set up ChromeDriver
-            service = Service()
-            driver = webdriver.Chrome(service=service, options=options)
-            
             # Set window size
             driver.set_window_size(1920, 1080)
             
             # Set cookies and local storage to appear more like a real browser
             driver.execute_cdp_cmd('Network.enable', {})
             driver.execute_cdp_cmd('Network.setExtraHTTPHeaders', {'headers': self.headers})
-            
-            print(f"\nAccessing URL: {self.base_url}")
-            driver.get(self.base_url)
+        except Exception:
+            driver.quit()
+            raise
+        return driver
+
+    def render_page(self, url=None):
+        """Load a page in a pooled browser, scroll through it and return the HTML"""
+        url = url or self.base_url
+        with self.driver_pool.driver() as driver:
+            print(f"\nAccessing URL: {url}")
+            driver.get(url)
             
             # Wait for content to load
             time.sleep(5)
@@ -396,9 +3318,7 @@ class ImageScraper:
             print("\nStarting infinite scroll...")
             last_height = driver.execute_script("return document.body.scrollHeight")
             scroll_count = 0
-            max_scrolls = 20  # Adjust this value to control how many times to scroll
-            
-            while scroll_count < max_scrolls:
+            while scroll_count < self.max_scrolls:
                 # Scroll down to bottom
                 driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
                 
@@ -417,207 +3337,1485 @@ class ImageScraper:
                 scroll_count += 1
                 print(f"Scrolled {scroll_count} times, loading more content...")
             
-            # Save page source for analysis
+            page_source = driver.page_source
+        
+        # Save page source for analysis
+        if url == self.base_url:
             with open("page_source.html", "w", encoding="utf-8") as f:
-                f.write(driver.page_source)
+                f.write(page_source)
             print("\nSaved page source to page_source.html for analysis")
+        
+        return page_source
+
+    def prefetch_renders(self, urls):
+        """
+        Start rendering pages on the browser pool ahead of their discovery
+        - iter_images_selenium picks up a page's finished render instead of loading it again
+        - Does nothing with a single-driver pool
+        """
+        if self.driver_pool.size < 2:
+            return
+        with self._lock:
+            if self._render_executor is None:
+                self._render_executor = ThreadPoolExecutor(max_workers=self.driver_pool.size)
+            for url in urls:
+                if url in self._renders:
+                    continue
+                if self.adaptive_scroll:
+                    render = self._render_executor.submit(lambda url: list(self.iter_images_adaptive(url)), url)
+                else:
+                    render = self._render_executor.submit(self.render_page, url)
+                self._renders[url] = render
+
+    def _needs_browser(self, url):
+        """Whether discovery of url starts in the browser (so its render can be prefetched)"""
+        if self.discovery == 'static':
+            return False
+        if self.discovery == 'tiered' and self.render_decisions.get(url_pattern(url)) != 'browser':
+            return False
+        return not self.scheduler or self.scheduler.allowed(url)
+
+    def close_browsers(self):
+        """Shut down the pooled browsers"""
+        with self._lock:
+            executor, self._render_executor = self._render_executor, None
+            self._renders.clear()
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        self.driver_pool.close()
+        if self.driver_pool.launched:
+            print(f"Browsers: {self.driver_pool.launched} started, {self.driver_pool.recycled} recycled")
+
+    def iter_images_selenium(self, url=None):
+        """Yield image records from the rendered page as they are discovered (or from its prefetched render)"""
+        url = url or self.base_url
+        with self._lock:
+            render = self._renders.pop(url, None)
+        if render is not None:
+            if self.adaptive_scroll:
+                yield from render.result()
+            else:
+                yield from self._iter_rendered_images(render.result(), url)
+        elif self.adaptive_scroll:
+            yield from self.iter_images_adaptive(url)
+        else:
+            yield from self._iter_rendered_images(self.render_page(url), url)
+
+    def iter_images_selenium_pages(self, urls):
+        """Yield image records from many pages rendered concurrently by the browser pool"""
+        urls = list(urls)
+        self.prefetch_renders(urls)
+        for url in urls:
+            try:
+                yield from self.iter_images_selenium(url)
+            except Exception as e:
+                print(f"Error rendering {url}: {str(e)}")
+
+    def _wait_for_quiescence(self, driver):
+        """Block until the page stops changing; returns False if scroll_timeout passed first"""
+        return driver.execute_async_script(QUIESCENCE_SCRIPT, self.scroll_idle * 1000, self.scroll_timeout * 1000)
+
+    def iter_images_adaptive(self, url=None):
+        """
+        Yield image records while scrolling a page in a pooled browser
+        - Waits for DOM/network quiescence instead of fixed sleeps
+        - Only images added since the previous scroll are sent back from the browser,
+          so the page is never serialized and re-parsed
+        """
+        url = url or self.base_url
+        processed_urls = set()
+        
+        with self.driver_pool.driver() as driver:
+            driver.set_script_timeout(self.scroll_timeout + 5)
+            print(f"\nAccessing URL: {url}")
+            driver.get(url)
+            self._wait_for_quiescence(driver)
+            print(f"Page Title: {driver.title}")
             
-            # Parse with BeautifulSoup
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
-            
-            # Find all elements with class attributes
-            elements_with_class = soup.find_all(class_=True)
-            print(f"\nFound {len(elements_with_class)} elements with classes")
-            
-            # Find all images using multiple methods
-            images = []
+            last_height = driver.execute_script("return document.body.scrollHeight")
+            scroll_count = 0
+            settled = False
+            while True:
+                for item in driver.execute_script(EXTRACT_IMAGES_SCRIPT):
+                    try:
+                        img_src = item['src']
+                        if self.responsive_images and item.get('srcsets') is not None:
+                            srcsets = item['srcsets'] + [
+                                source['srcset'] for source in item['sources'] if pillow_can_decode(source['type'])
+                            ]
+                            img_src = self.choose_source(img_src, srcsets, item['width'], item['sizes'])
+                        
+                        # Clean up URL
+                        if img_src.startswith('//'):
+                            img_src = 'https:' + img_src
+                        elif not img_src.startswith('http'):
+                            img_src = urljoin(url, img_src)
+                        
+                        # Skip small images and icons
+                        if any(x in img_src.lower() for x in ['icon', 'logo', 'banner', '.svg', '.ico']):
+                            continue
+                        
+                        canonical = self.canonical_url(img_src)
+                        if canonical in processed_urls:
+                            continue
+                        processed_urls.add(canonical)
+                        
+                        category = item['label'] or item['alt'] or item['title']
+                        image_data = self._image_record(item, img_src, category)
+                        
+                    except Exception as e:
+                        print(f"Error processing image: {str(e)}")
+                        continue
+                    
+                    print(f"Found image: {img_src} -> {image_data['category']}")
+                    yield image_data
+                
+                if settled or scroll_count >= self.max_scrolls:
+                    break
+                
+                # Scroll down and wait until the new content has settled
+                driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                self._wait_for_quiescence(driver)
+                
+                # Stop once the height no longer grows, after collecting what the last scroll loaded
+                new_height = driver.execute_script("return document.body.scrollHeight")
+                if new_height == last_height:
+                    print("No more content to load")
+                    settled = True
+                    continue
+                
+                last_height = new_height
+                scroll_count += 1
+                print(f"Scrolled {scroll_count} times, {len(processed_urls)} images so far...")
             
-            # Method 1: Direct img tags
-            print("\nLooking for direct img tags...")
-            for img in soup.find_all('img'):
+            if self.crawl:
+                self._record_links(url, driver.execute_script(EXTRACT_LINKS_SCRIPT))
+
+    def _iter_rendered_images(self, page_source, page_url):
+        """Yield image records from the HTML of a rendered page"""
+        # Parse with BeautifulSoup
+        soup = self.make_soup(page_source)
+        
+        # Index the page in a single traversal
+        index = PageIndex(soup)
+        self.context = ContextIndex()
+        if self.crawl:
+            self._record_links(page_url, self._link_candidates(index))
+        
+        # Find all elements with class attributes
+        elements_with_class = index.elements_with_class
+        print(f"\nFound {len(elements_with_class)} elements with classes")
+        
+        # Find all images using multiple methods
+        images = []
+        
+        # Method 1: Direct img tags
+        print("\nLooking for direct img tags...")
+        for img in index.imgs:
+            if img.get('src'):
+                print(f"Found image: {img.get('src')}")
+                images.append(img)
+        
+        # Method 2: Look for images in article content
+        print("\nLooking for images in article content...")
+        article_content = next((el for el in index.by_class.get('box-body', []) if el.name == 'div'), None)
+        if article_content:
+            for img in article_content.find_all('img'):
                 if img.get('src'):
-                    print(f"Found image: {img.get('src')}")
+                    print(f"Found article image: {img.get('src')}")
                     images.append(img)
+        
+        # Method 3: Look for lazy-loaded images
+        print("\nLooking for lazy-loaded images...")
+        for img in (el for el in index.by_class.get('lazy', []) if el.name == 'img'):
+            src = img.get('data-src') or img.get('data-lazy-src') or img.get('src')
+            if src:
+                print(f"Found lazy image: {src}")
+                images.append(img)
+        
+        # Method 4: Background images
+        print("\nLooking for background images...")
+        for elem in index.styled:
+            style = elem.get('style', '')
+            if 'background-image' in style:
+                url_match = re.search(r'url\(["\']?([^"\']+)["\']?\)', style)
+                if url_match:
+                    url = url_match.group(1)
+                    print(f"Found background image: {url}")
+                    img_tag = soup.new_tag('img', src=url)
+                    images.append(img_tag)
+        
+        print(f"\nFound {len(images)} total images")
+        
+        # Process images
+        processed_urls = set()
+        
+        for img in images:
+            try:
+                # Get image URL
+                img_src = self.image_source(img, ('data-src', 'data-lazy-src', 'src'))
+                if not img_src:
+                    continue
+                
+                # Clean up URL
+                if img_src.startswith('//'):
+                    img_src = 'https:' + img_src
+                elif not img_src.startswith('http'):
+                    img_src = urljoin(page_url, img_src)
+                
+                # Skip small images and icons
+                if any(x in img_src.lower() for x in ['icon', 'logo', 'banner', '.svg', '.ico']):
+                    continue
+                
+                # Skip repeats on this page, compared after normalization
+                canonical = self.canonical_url(img_src)
+                if canonical in processed_urls:
+                    continue
+                processed_urls.add(canonical)
+                
+                # Get category from context
+                category = None
+                parent = img.parent if isinstance(img, Tag) else None
+                
+                # Try to find category in parent elements
+                for _ in range(3):
+                    if not parent or not isinstance(parent, Tag):
+                        break
+                    
+                    # Look for text in headers and links
+                    category = self.context.first_label(parent)
+                    
+                    if category:
+                        break
+                    parent = parent.parent
+                
+                # Fallback to image attributes
+                if not category:
+                    category = img.get('alt') or img.get('title')
+                
+                image_data = self._image_record(img, img_src, category)
+                
+            except Exception as e:
+                print(f"Error processing image: {str(e)}")
+                continue
             
-            # Method 2: Look for images in article content
-            print("\nLooking for images in article content...")
-            article_content = soup.find('div', class_='box-body')
-            if article_content:
-                for img in article_content.find_all('img'):
-                    if img.get('src'):
-                        print(f"Found article image: {img.get('src')}")
-                        images.append(img)
-            
-            # Method 3: Look for lazy-loaded images
-            print("\nLooking for lazy-loaded images...")
-            for img in soup.find_all('img', class_='lazy'):
-                src = img.get('data-src') or img.get('data-lazy-src') or img.get('src')
-                if src:
-                    print(f"Found lazy image: {src}")
-                    images.append(img)
+            print(f"Found image: {img_src} -> {image_data['category']}")
+            yield image_data
+
+    def scrape_with_selenium(self):
+        """Scrape images using Selenium for dynamic content"""
+        try:
+            return self._collect_images(self.iter_images_selenium())
+            
+        except Exception as e:
+            print(f"Error in Selenium scraping: {str(e)}")
+            traceback.print_exc()
+            return {}
+
+    def process_image(self, image_path):
+        """
+        Process the downloaded image
+        - Optionally resize to target size if specified
+        - Convert to RGB if needed
+        - Return the processed image
+        """
+        try:
+            img = Image.open(image_path)
+            
+            # Decode large JPEGs at a reduced scale when only a small target is needed
+            if self.fast_resize and self.target_size and img.format == 'JPEG':
+                img.draft('RGB', tuple(self.target_size))
+            
+            # Convert to RGB if needed
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            
+            # Only resize if target_size is specified
+            if self.target_size:
+                img = fit_image(img, self.target_size, self.resize_policy, self.fast_resize)
+            
+            return img
+                
+        except Exception as e:
+            print(f"Error processing image {image_path}: {str(e)}")
+            return None
+
+    def needs_javascript(self, html, index, records):
+        """Why a statically fetched page looks incomplete without a browser, or None"""
+        if len(records) < self.js_min_images:
+            return f"only {len(records)} images found"
+        
+        # Lazy-load placeholders: no real src until a script swaps it in
+        placeholders = sum(
+            1 for img in index.imgs
+            if not img.get('src') or img.get('src').startswith('data:')
+        )
+        if index.imgs and placeholders * 2 > len(index.imgs):
+            return f"{placeholders} of {len(index.imgs)} images are lazy-load placeholders"
+        
+        body = index.soup.body
+        if SPA_MARKERS.search(html) and len(body.get_text(strip=True) if body else '') < 500:
+            return "client-side rendered page"
+        
+        return None
+
+    def _remember_render(self, url, decision):
+        """Record whether pages like url need the browser"""
+        pattern = url_pattern(url)
+        with self._lock:
+            if self.render_decisions.get(pattern) == decision:
+                return
+            self.render_decisions[pattern] = decision
+            with open(self.render_decisions_file, 'w', encoding='utf-8') as f:
+                json.dump(self.render_decisions, f, indent=2)
+
+    def iter_images_tiered(self, url=None):
+        """
+        Yield image records fetching with requests first
+        - The browser is used only when the static page looks like it needs
+          JavaScript (few images, lazy placeholders, SPA markup) or fails to load
+        - The decision is remembered per host/path pattern in render_decisions.json
+        """
+        url = url or self.base_url
+        decision = self.render_decisions.get(url_pattern(url))
+        
+        if decision == 'browser':
+            print(f"Rendering {url} in the browser (remembered for {url_pattern(url)})")
+            yield from self.iter_images_selenium(url)
+            return
+        
+        try:
+            print("Scraping images with BeautifulSoup...")
+            html = self.fetch_page(url)
+        except Exception as e:
+            print(f"Static fetch failed, escalating to the browser: {str(e)}")
+            yield from self.iter_images_selenium(url)
+            return
+        
+        soup = self.make_soup(html)
+        index = PageIndex(soup)
+        if decision == 'static':
+            yield from self._iter_static_images(soup, url, index)
+            return
+        
+        records = list(self._iter_static_images(soup, url, index))
+        reason = self.needs_javascript(html, index, records)
+        if not reason:
+            self._remember_render(url, 'static')
+            yield from records
+            return
+        
+        print(f"Escalating {url} to the browser: {reason}")
+        found = False
+        try:
+            for image_data in self.iter_images_selenium(url):
+                found = True
+                yield image_data
+        except Exception as e:
+            print(f"Error in Selenium scraping: {str(e)}")
+            traceback.print_exc()
+        
+        if found:
+            self._remember_render(url, 'browser')
+        else:
+            # The browser found nothing more; keep what the static page had
+            yield from records
+
+    def discover_images(self, url=None):
+        """
+        Yield image records not seen before (by canonical URL) using the configured discovery strategy
+        - Skips images found earlier in this run and images already downloaded (seen_urls)
+        """
+        for image_data in self._discover_images(url):
+            canonical = self.canonical_url(image_data['url'])
+            if canonical not in self.seen_urls and self._run_urls.add(canonical):
+                yield image_data
+
+    def _discover_images(self, url=None):
+        """Yield image records using the configured discovery strategy"""
+        if self.scheduler and not self.scheduler.allowed(url or self.base_url):
+            print(f"Skipping page disallowed by robots.txt: {url or self.base_url}")
+            return
+        
+        if self.discovery != 'browser':
+            try:
+                if self.discovery == 'tiered':
+                    yield from self.iter_images_tiered(url)
+                else:
+                    yield from self.iter_images_bs4(url)
+            except Exception as e:
+                print(f"Error in scraping: {str(e)}")
+                traceback.print_exc()
+            return
+        
+        # Try Selenium first and fall back to BeautifulSoup
+        found = False
+        
+        try:
+            print("Attempting to scrape with Selenium...")
+            for image_data in self.iter_images_selenium(url):
+                found = True
+                yield image_data
+        except Exception as e:
+            print(f"Error in Selenium scraping: {str(e)}")
+            traceback.print_exc()
+        
+        if found:
+            return
+        
+        try:
+            print("\nFalling back to BeautifulSoup...")
+            yield from self.iter_images_bs4(url)
+        except Exception as e:
+            print(f"Error in scraping: {str(e)}")
+            traceback.print_exc()
+
+    def _link_candidates(self, index):
+        """Anchor and <link rel="next"> candidates of a parsed page for classify_links"""
+        candidates = []
+        for elem in index.elements:
+            if elem.name not in ('a', 'link') or not elem.get('href'):
+                continue
+            if elem.name == 'link' and 'next' not in elem.get('rel', []):
+                continue
+            
+            # Inside a pagination container?
+            pager = False
+            node = elem
+            for _ in range(4):
+                if not isinstance(node, Tag):
+                    break
+                if PAGER_PATTERN.search(' '.join(node.get('class', [])) + ' ' + (node.get('id') or '')):
+                    pager = True
+                    break
+                node = node.parent
+            
+            candidates.append({
+                'href': elem.get('href'),
+                'rel': ' '.join(elem.get('rel', [])),
+                'text': self.context.text(elem),
+                'pager': pager,
+                'has_img': index.first_img(elem) is not None
+            })
+        return candidates
+
+    def _record_links(self, page_url, candidates):
+        """Keep a page's pagination and gallery links for the crawler"""
+        with self._lock:
+            self._page_links[page_url] = classify_links(candidates, page_url, self.follow_pattern)
+
+    def in_scope(self, url):
+        """Whether the crawler may follow url from the seeds"""
+        parsed = urllib.parse.urlsplit(url)
+        host = (parsed.hostname or '').lower()
+        for seed in self.seed_urls:
+            seed_parsed = urllib.parse.urlsplit(seed)
+            seed_host = (seed_parsed.hostname or '').lower()
+            if self.crawl_scope == 'host' and host == seed_host:
+                return True
+            if self.crawl_scope == 'domain':
+                domain = seed_host[4:] if seed_host.startswith('www.') else seed_host
+                if host == domain or host.endswith('.' + domain):
+                    return True
+            if self.crawl_scope == 'prefix':
+                # Same scheme and host, under the seed's directory ('/' for a bare host)
+                directory = seed_parsed.path.rsplit('/', 1)[0] + '/'
+                if (parsed.scheme.lower() == seed_parsed.scheme.lower()
+                        and parsed.netloc.lower() == seed_parsed.netloc.lower()
+                        and (parsed.path or '/').startswith(directory)):
+                    return True
+        return False
+
+    def iter_crawl(self):
+        """
+        Yield image records from every page reached breadth-first from the seeds
+        - Pagination links stay at their page's depth; gallery links go one level
+          deeper, up to max_depth
+        - Pages are deduplicated by URL (fragment removed) and limited to max_pages
+          and the crawl scope; the journal keeps the frontier across runs
+        """
+        frontier = collections.deque()
+        seen = set()
+        done = 0
+        if self.journal:
+            pending, seen, done = self.journal.frontier()
+            frontier.extend(pending)
+            if pending:
+                print(f"Resuming crawl: {len(pending)} pages queued, {done} done")
+        
+        def schedule(url, depth):
+            url = urllib.parse.urldefrag(url)[0]
+            if url in seen or not self.in_scope(url):
+                return
+            seen.add(url)
+            frontier.append((url, depth))
+            if self.journal:
+                self.journal.queue_page(url, depth)
+        
+        if not seen:
+            for url in self.seed_urls:
+                schedule(url, 0)
+        
+        while frontier and done < self.max_pages:
+            # The next pages render on the other pooled browsers while this one is processed
+            upcoming = itertools.islice(frontier, min(self.driver_pool.size, self.max_pages - done))
+            self.prefetch_renders([page for page, _ in upcoming if self._needs_browser(page)])
+            
+            url, depth = frontier.popleft()
+            done += 1
+            print(f"\nCrawling page {done}/{self.max_pages} (depth {depth}): {url}")
+            
+            yield from self.discover_images(url)
+            
+            with self._lock:
+                pagination, gallery = self._page_links.pop(url, ([], []))
+            for link in pagination:
+                schedule(link, depth)
+            if depth < self.max_depth:
+                for link in gallery:
+                    schedule(link, depth + 1)
+            
+            if self.journal:
+                self.journal.page_done(url)
+        
+        print(f"\nCrawl finished: {done} pages, {len(frontier)} left in the frontier")
+
+    def scrape(self):
+        """Main scraping function"""
+        print("Starting image scraping...")
+        
+        try:
+            if self.crawl:
+                # Earlier runs' unfinished downloads first, then the rest of the crawl
+                records = self._journal_records(self.iter_crawl())
+                if self.journal:
+                    records = itertools.chain(self.journal.pending_images(self.max_attempts), records)
+                if self.streaming:
+                    self.stream_images(records)
+                else:
+                    self.download_images(self._collect_images(records))
+                return
+            
+            if self.journal and self.journal.is_page_done(self.base_url):
+                # Discovery finished on an earlier run; only unfinished downloads remain
+                pending = self.journal.pending_images(self.max_attempts)
+                print(f"Resuming from journal: {len(pending)} images left")
+                if self.streaming:
+                    self.stream_images(iter(pending))
+                else:
+                    self.download_images(self._collect_images(pending))
+                return
+            
+            if self.streaming:
+                # Download while discovery is still running
+                self.stream_images(self._journal_records(self.discover_images()))
+                return
+            
+            images = self._collect_images(self.discover_images())
+            
+            if not images:
+                print("No images found. Exiting...")
+                return
+            
+            if self.journal:
+                for category_images in images.values():
+                    for image_data in category_images:
+                        self.journal.add_image(image_data)
+                self.journal.page_done(self.base_url)
+            
+            # Download images
+            self.download_images(images)
+            
+        except Exception as e:
+            print(f"Error during scraping: {str(e)}")
+            traceback.print_exc()
+        
+        finally:
+            self.close_browsers()
+            if self.journal:
+                self.journal.flush()
+
+    def _journal_records(self, records):
+        """Record streamed image records in the journal as they are discovered"""
+        found = False
+        for image_data in records:
+            found = True
+            if self.journal:
+                self.journal.add_image(image_data)
+            yield image_data
+        
+        if self.journal and found:
+            self.journal.page_done(self.base_url)
+
+    def http_get(self, url, session=None, attempts=3, wait=True, **kwargs):
+        """
+        GET through the session (self.session by default), using the HTTP cache when enabled
+        - With polite scheduling each request waits for its host's slot, and
+          429/503 responses slow the host down and are retried after the pause,
+          up to attempts requests in total
+        - wait=False raises HostPaused instead of sleeping (see _claim_slot)
+        """
+        return self._paced_request(url, lambda: self._session_get(url, session, **kwargs), attempts, wait)
+
+    def http_head(self, url, session=None, attempts=3, wait=True, **kwargs):
+        """HEAD through the session (never cached), paced and counted by the polite scheduler like http_get"""
+        return self._paced_request(url, lambda: (session or self.session).head(url, **kwargs), attempts, wait)
+
+    def _paced_request(self, url, send, attempts, wait=True):
+        """Call send() for a response, in the host's polite slots when scheduling is on; see http_get"""
+        if not self.scheduler:
+            return send()
+        
+        for attempt in range(attempts):
+            if wait:
+                self.scheduler.wait(url)
+            else:
+                self._claim_slot(url)
+            started = time.monotonic()
+            response = send()
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self.scheduler.record(url, response.status_code, time.monotonic() - started, retry_after)
+            if response.status_code not in (429, 503) or attempt == attempts - 1:
+                return response
+            response.close()
+            if not wait:
+                self._pause_throttled(url)
+        return response
+
+    def _claim_slot(self, url):
+        """
+        Take the host's polite request slot for url without sleeping
+        - When the slot is in the future it stays reserved for url and HostPaused is
+          raised with its delay; the deferred download then uses that slot
+        """
+        with self._lock:
+            start = self._slot_grants.pop(url, None)
+        if start is None:
+            start = time.monotonic() + self.scheduler.reserve(url)
+        delay = start - time.monotonic()
+        if delay > 0:
+            with self._lock:
+                self._slot_grants[url] = start
+            raise HostPaused(url, delay)
+
+    def _pause_throttled(self, url):
+        """Reserve the slot after a 429/503 pause for url and raise HostPaused(throttled=True)"""
+        delay = max(0.0, self.scheduler.reserve(url))
+        with self._lock:
+            self._slot_grants[url] = time.monotonic() + delay
+        raise HostPaused(url, delay, throttled=True)
+
+    def _session_get(self, url, session=None, **kwargs):
+        session = session or self.session
+        if self.http_cache:
+            return self.http_cache.get(session, url, **kwargs)
+        return session.get(url, **kwargs)
+
+    def host_rates(self):
+        """Current per-host request rates of the polite scheduler"""
+        return self.scheduler.rates() if self.scheduler else {}
+
+    def _host_slot(self, url):
+        """Return the semaphore limiting concurrent requests to the URL's host"""
+        host = urllib.parse.urlparse(url).hostname or ''
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_per_host)
+                self._host_slots[host] = slot
+            return slot
+
+    def _claim_path(self, filepath):
+        """Reserve a target path so two workers never write the same file"""
+        with self._lock:
+            if filepath in self._claimed_paths or os.path.exists(filepath):
+                return False
+            self._claimed_paths.add(filepath)
+            return True
+
+    def fetch_image(self, image_data, category, wait=True):
+        """
+        Download a single image to disk (network stage)
+        - Journaled URLs that already finished are skipped; attempts are recorded
+        - Returns (status, job) where status is 'downloaded', 'duplicate', 'failed' or 'skipped'
+          (or 'retry' for transient failures when the retry queue is on)
+        - The job is handed to finish_image for post-processing
+        - With a content store the bytes are hashed while streaming and duplicates are linked, not kept
+        - wait=False raises HostPaused instead of sleeping for a polite request slot
+        - Safe to call from several worker threads at once
+        """
+        steps = self._fetch_steps(image_data, category)
+        try:
+            request = next(steps)
+            while True:
+                try:
+                    status = self._download_to(*request, wait=wait)
+                except Exception as e:
+                    request = steps.throw(e)
+                else:
+                    request = steps.send(status)
+        except StopIteration as done:
+            return done.value
+
+    async def fetch_image_async(self, clients, image_data, category):
+        """fetch_image on the http2 transport: the same steps, with the download awaited on HTTP2Clients"""
+        url = image_data.get('url') or ''
+        if self.scheduler and url.startswith('http'):
+            # robots.txt is fetched (once per host) off the event loop
+            await asyncio.to_thread(self.scheduler.allowed, url)
+        
+        steps = self._fetch_steps(image_data, category)
+        try:
+            request = next(steps)
+            while True:
+                try:
+                    status = await self._download_to_async(clients, *request)
+                except Exception as e:
+                    request = steps.throw(e)
+                else:
+                    request = steps.send(status)
+        except StopIteration as done:
+            return done.value
+
+    def _fetch_steps(self, image_data, category):
+        """
+        fetch_image as a generator shared by the sync and async transports
+        - Yields (url, path, digest) downloads and receives each one's status (or
+          its exception); returns (status, job)
+        """
+        url = image_data.get('url')
+        journal = self.journal if url else None
+        if journal and journal.state(url) in ('done', 'skipped'):
+            return 'skipped', None
+        
+        if journal:
+            journal.start(url)
+        try:
+            status, job = yield from self._fetch_image(image_data, category)
+        except HostPaused:
+            if journal:
+                journal.requeue(url)
+            raise
+        if journal and status != 'downloaded':
+            journal.finish(url, self._journal_state(status))
+        if status == 'duplicate':
+            self._mark_seen(url)
+        return status, job
+
+    def _mark_seen(self, url):
+        """Add a URL whose image was kept (or was a content duplicate) to seen_urls"""
+        self.seen_urls.add(self.canonical_url(url))
+
+    def _failure_status(self, error):
+        """'retry' for transient errors when the retry queue is on, else 'failed'"""
+        return 'retry' if self.retry_queue and is_retryable(error) else 'failed'
+
+    def _journal_state(self, status):
+        """Map a download status to the journal state it leaves the URL in"""
+        return {'success': 'done', 'duplicate': 'done', 'skipped': 'skipped'}.get(status, 'failed')
+
+    def _fetch_image(self, image_data, category):
+        """Download a single image to disk; see fetch_image and _fetch_steps"""
+        url = image_data.get('url')
+        filepath = None
+        try:
+            # Skip if URL is invalid
+            if not url or not url.startswith('http'):
+                print(f"Skipping invalid URL: {url}")
+                return 'skipped', None
+            
+            category_dir = os.path.join(self.output_dir, category)
+            
+            # Generate filename from URL
+            filename = os.path.basename(url).split('?')[0]
+            if not filename:
+                filename = hashlib.md5(url.encode()).hexdigest()[:10] + '.jpg'
+            
+            # Ensure filename has an extension
+            if not os.path.splitext(filename)[1]:
+                filename += '.jpg'
+            
+            # Files are stored under the extension of the chosen output codec
+            if self.output_format:
+                filename = os.path.splitext(filename)[0] + OUTPUT_FORMATS[self.output_format]
+            
+            if self.scheduler and not self.scheduler.allowed(url):
+                print(f"Skipping URL disallowed by robots.txt: {url}")
+                return 'skipped', None
+            
+            # Packed samples stay skipped when their loose files were not kept
+            if self._is_packed(url):
+                print(f"Skipping packed image: {url}")
+                return 'skipped', None
+            
+            if self.store:
+                return (yield from self._fetch_to_store(url, image_data, category, os.path.splitext(filename)[1]))
+            
+            # Create full path
+            filepath = os.path.join(category_dir, filename)
+            
+            # Skip if file already exists (or another worker is fetching it)
+            if not self._claim_path(filepath):
+                print(f"Skipping existing file: {filepath}")
+                filepath = None
+                return 'skipped', None
+            
+            # Download image with timeout and retries
+            try:
+                started = time.perf_counter()
+                sha256 = hashlib.sha256()
+                status = yield url, filepath, sha256
+                if status:
+                    return status, None
+                
+                return 'downloaded', {
+                    'url': url,
+                    'category': category,
+                    'filename': filename,
+                    'filepath': filepath,
+                    'sha256': sha256.hexdigest(),
+                    'download_ms': (time.perf_counter() - started) * 1000,
+                    'title': image_data.get('title', ''),
+                    'alt': image_data.get('alt', '')
+                }
+                
+            except requests.exceptions.RequestException as e:
+                print(f"Error downloading {url}: {str(e)}")
+                return self._failure_status(e), None
             
-            # Method 4: Background images
-            print("\nLooking for background images...")
-            for elem in soup.find_all(style=True):
-                style = elem.get('style', '')
-                if 'background-image' in style:
-                    url_match = re.search(r'url\(["\']?([^"\']+)["\']?\)', style)
-                    if url_match:
-                        url = url_match.group(1)
-                        print(f"Found background image: {url}")
-                        img_tag = soup.new_tag('img', src=url)
-                        images.append(img_tag)
-            
-            print(f"\nFound {len(images)} total images")
-            
-            # Process images
-            categorized_images = {}
-            processed_urls = set()
-            
-            for img in images:
-                try:
-                    # Get image URL
-                    img_src = img.get('data-src') or img.get('data-lazy-src') or img.get('src')
-                    if not img_src or img_src in processed_urls:
-                        continue
-                    
-                    # Clean up URL
-                    if img_src.startswith('//'):
-                        img_src = 'https:' + img_src
-                    elif not img_src.startswith('http'):
-                        img_src = urljoin(self.base_url, img_src)
-                    
-                    # Skip small images and icons
-                    if any(x in img_src.lower() for x in ['icon', 'logo', 'banner', '.svg', '.ico']):
-                        continue
-                    
-                    processed_urls.add(img_src)
-                    
-                    # Get category from context
-                    category = None
-                    parent = img.parent if isinstance(img, Tag) else None
+        except HostPaused:
+            raise
+        except Exception as e:
+            print(f"Error processing {url}: {str(e)}")
+            return 'failed', None
+        
+        finally:
+            if filepath:
+                with self._lock:
+                    self._claimed_paths.discard(filepath)
+
+    def _download_to(self, url, filepath, digest=None, wait=True):
+        """
+        Stream an image URL into filepath, feeding the bytes to digest if given
+        - Byte-size and format rules are checked against the headers (and an optional
+          HEAD request) before the body is read
+        - Dimensions and format are parsed from the first chunks; transfers breaking
+          the rules are aborted
+        - The body goes to a .part file that is only renamed into place once complete
+          (and verified when verify_downloads is set)
+        - Returns None on success, otherwise the 'failed'/'skipped' status ('retry'
+          for cut-off transfers with the retry queue)
+        - Raises requests exceptions for HTTP and connection errors, and HostPaused
+          (with wait=False) when the host's polite slot is not due
+        """
+        # Check the hostname resolves (cached and usually prefetched during discovery)
+        if not self.dns.resolve(urllib.parse.urlparse(url).hostname):
+            print(f"Could not resolve hostname for: {url}")
+            return 'failed'
+        
+        if self._needs_head(url):
+            with self._host_slot(url):
+                head = self.http_head(url, session=self.download_session, attempts=1 if self.retry_queue else 3,
+                                      wait=wait, headers=self.headers, timeout=10, allow_redirects=True, verify=False)
+            if head.ok:
+                reason = self._check_headers(head.headers)
+                if reason:
+                    print(f"Skipping {url}: {reason}")
+                    return 'skipped'
+            self._head_passed.add(url)
+        
+        partial_path = filepath + '.part'
+        host = urllib.parse.urlparse(url).hostname
+        try:
+            with self._host_slot(url):
+                with self.http_get(
+                    url,
+                    session=self.download_session,
+                    attempts=1 if self.retry_queue else 3,
+                    wait=wait,
+                    headers=self.headers,
+                    timeout=30,
+                    stream=True,
+                    verify=False  # Skip SSL verification
+                ) as response:
+                    self._head_passed.discard(url)
+                    if self.breaker:
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        self.breaker.record(host, response.status_code, retry_after)
+                    response.raise_for_status()
+                    status = self._check_response(url, response.headers)
+                    if status:
+                        return status
                     
-                    # Try to find category in parent elements
-                    for _ in range(3):
-                        if not parent or not isinstance(parent, Tag):
-                            break
-                        
-                        # Look for text in headers and links
-                        for elem in parent.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'a', 'p']):
-                            text = elem.get_text(strip=True)
-                            if text and len(text) > 2:
-                                category = text
+                    # Save image, reading its header from the first chunks
+                    check = self._body_check()
+                    reason = None
+                    with open(partial_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=8192):
+                            if not chunk:
+                                continue
+                            reason = check.feed(chunk)
+                            if reason:
                                 break
-                        
-                        if category:
-                            break
-                        parent = parent.parent
-                    
-                    # Fallback to image attributes
-                    if not category:
-                        category = img.get('alt') or img.get('title')
-                    
-                    # Clean category name
-                    if category:
-                        category = self.clean_category_name(category)
+                            f.write(chunk)
+                            if digest:
+                                digest.update(chunk)
                     
-                    if not category or len(category) < 3:
-                        category = 'uncategorized'
-                    
-                    # Create category directory
-                    category_dir = os.path.join(self.output_dir, category)
-                    os.makedirs(category_dir, exist_ok=True)
-                    
-                    # Add to categories set
-                    self.categories.add(category)
-                    
-                    # Store image info
-                    if category not in categorized_images:
-                        categorized_images[category] = []
+                    status = self._body_status(url, check, reason, response.headers)
+                    if status:
+                        return status
+            
+            return self._commit_download(url, partial_path, filepath)
+        except requests.exceptions.RequestException as e:
+            # Connection errors and timeouts count against the host (statuses were counted above)
+            if self.breaker and is_retryable(e) and not isinstance(e, requests.exceptions.HTTPError):
+                self.breaker.failure(host)
+            raise
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    async def _download_to_async(self, clients, url, filepath, digest=None):
+        """
+        _download_to on httpx clients: the same rules, .part handling and statuses
+        - httpx errors are raised as the matching requests exceptions so both
+          transports are handled alike
+        """
+        host = urllib.parse.urlparse(url).hostname
+        if not await asyncio.to_thread(self.dns.resolve, host):
+            print(f"Could not resolve hostname for: {url}")
+            return 'failed'
+        
+        partial_path = filepath + '.part'
+        try:
+            if self._needs_head(url):
+                head, client = await self._request_async(clients, 'HEAD', url, timeout=httpx.Timeout(10, pool=None))
+                await head.aclose()
+                await clients.release(client)
+                if head.is_success:
+                    reason = self._check_headers(head.headers)
+                    if reason:
+                        print(f"Skipping {url}: {reason}")
+                        return 'skipped'
+                self._head_passed.add(url)
+            
+            resends = refused = 0
+            while True:
+                response, client = await self._request_async(clients, 'GET', url)
+                self._head_passed.discard(url)
+                try:
+                    if self.breaker:
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        self.breaker.record(host, response.status_code, retry_after)
+                    if response.status_code >= 400:
+                        raise_for_httpx_status(url, response)
+                    status = self._check_response(url, response.headers)
+                    if status:
+                        return status
                     
-                    image_data = {
-                        'url': img_src,
-                        'alt': img.get('alt', ''),
-                        'title': img.get('title', ''),
-                        'category': category
-                    }
+                    # Save image, reading its header from the first chunks
+                    check = self._body_check()
+                    reason = None
+                    try:
+                        with open(partial_path, 'wb') as f:
+                            async for chunk in response.aiter_bytes(chunk_size=8192):
+                                reason = check.feed(chunk)
+                                if reason:
+                                    break
+                                f.write(chunk)
+                    except (httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError) as e:
+                        # A server closing the connection after its request limit can cut
+                        # off bodies still in flight; the GET is resent like in _request_async
+                        stream_id = response.extensions.get('stream_id')
+                        clients.note_closed(host, client, e, stream_id)
+                        kind = resend_kind(e, stream_id)
+                        if kind == 'unanswered' and refused < 10:
+                            refused += 1
+                            continue
+                        if kind and resends < 3:
+                            resends += 1
+                            continue
+                        raise
                     
-                    categorized_images[category].append(image_data)
-                    print(f"Found image: {img_src} -> {category}")
+                    status = self._body_status(url, check, reason, response.headers)
+                    if status:
+                        return status
                     
-                except Exception as e:
-                    print(f"Error processing image: {str(e)}")
-                    continue
-            
-            # Close the browser
-            driver.quit()
+                    # Hashed once the body is complete (off the loop), so a resent body is not counted twice
+                    if digest:
+                        await asyncio.to_thread(update_digest, digest, partial_path)
+                finally:
+                    await response.aclose()
+                    await clients.release(client)
+                
+                return self._commit_download(url, partial_path, filepath)
+        except httpx.HTTPError as e:
+            # Connection errors and timeouts count against the host (statuses were counted above)
+            if self.breaker:
+                self.breaker.failure(host)
+            raise requests_exception(e) from e
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    async def _request_async(self, clients, method, url, **kwargs):
+        """
+        Streamed request on HTTP2Clients; with polite scheduling it takes the
+        host's slot and handles 429/503 like http_get with wait=False (raising
+        HostPaused rather than holding the task)
+        - Returns (response, client); release the client once the response is closed
+        """
+        host = urllib.parse.urlparse(url).hostname or ''
+        attempts = 1 if self.retry_queue or not self.scheduler else 3
+        attempt = resends = refused = 0
+        while True:
+            if self.scheduler and not (resends or refused):
+                self._claim_slot(url)
+            started = time.monotonic()
+            sent = {}
             
-            # Print summary
-            if categorized_images:
-                print("\nFound categories:")
-                for category in sorted(self.categories):
-                    count = len(categorized_images.get(category, []))
-                    print(f"- {category}: {count} images")
-            else:
-                print("No images found")
+            async def trace(event, info):
+                if event == 'http2.send_request_headers.started':
+                    sent['stream_id'] = info.get('stream_id')
             
-            return categorized_images
+            client = clients.acquire(host)
+            try:
+                request = client.build_request(method, url, extensions={'trace': trace}, **kwargs)
+                response = await client.send(request, stream=True)
+            except Exception as e:
+                closed = isinstance(e, (httpx.ProtocolError, httpx.ReadError, httpx.WriteError))
+                if closed:
+                    clients.note_closed(host, client, e, sent.get('stream_id'))
+                await clients.release(client)
+                if not closed:
+                    raise
+                # A closed HTTP/2 connection (GOAWAY after the server's request limit, or
+                # dropped) fails every stream on it at once, and streams opened before the
+                # server's concurrency limit is known are refused locally; with no response
+                # yet the GET is resent instead of counting against the host. Requests the
+                # server never answered do not use up the resends
+                kind = resend_kind(e, sent.get('stream_id'))
+                if kind == 'unanswered' and refused < 10:
+                    refused += 1
+                    continue
+                if kind and resends < 3:
+                    resends += 1
+                    await asyncio.sleep(0.1 * resends)
+                    continue
+                raise
             
-        except Exception as e:
-            print(f"Error in Selenium scraping: {str(e)}")
-            traceback.print_exc()
-            if 'driver' in locals():
-                driver.quit()
-            return {}
+            if self.scheduler:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                self.scheduler.record(url, response.status_code, time.monotonic() - started, retry_after)
+            attempt += 1
+            if response.status_code not in (429, 503) or attempt == attempts:
+                return response, client
+            await response.aclose()
+            await clients.release(client)
+            self._pause_throttled(url)
 
-    def process_image(self, image_path):
+    def _needs_head(self, url):
+        """Whether to send a HEAD before the GET (not again after a polite pause between them)"""
+        return (self.head_requests and bool(self.min_bytes or self.max_bytes or self.allowed_formats)
+                and url not in self._head_passed)
+
+    def _check_response(self, url, headers):
+        """'skipped' when the response headers rule the body out (not an image, or a size/format rule)"""
+        content_type = headers.get('content-type', '')
+        if not content_type.startswith('image/'):
+            print(f"Skipping non-image content: {url} ({content_type})")
+            return 'skipped'
+        
+        reason = self._check_headers(headers)
+        if reason:
+            print(f"Skipping {url}: {reason}")
+            return 'skipped'
+        return None
+
+    def _body_check(self):
+        """BodyCheck applying this scraper's byte-size and image rules"""
+        return BodyCheck(self.max_bytes, self._check_image if self._sniff_images() else None)
+
+    def _body_status(self, url, check, reason, headers):
         """
-        Process the downloaded image
-        - Optionally resize to target size if specified
-        - Convert to RGB if needed
-        - Return the processed image
+        Status of a streamed body: 'skipped' when it broke a rule (reason, or below
+        min_bytes), 'failed' ('retry' with the retry queue) when cut off, else None
         """
+        if not reason and self.min_bytes and check.written < self.min_bytes:
+            reason = f"smaller than {self.min_bytes} bytes"
+        if reason:
+            print(f"Skipping {url}: {reason}")
+            return 'skipped'
+        
+        # A short body means the transfer was cut off
+        expected = headers.get('content-length')
+        encoded = headers.get('content-encoding', 'identity') != 'identity'
+        if expected and expected.isdigit() and not encoded and check.written != int(expected):
+            print(f"Incomplete download: {url} ({check.written} of {expected} bytes)")
+            return 'retry' if self.retry_queue else 'failed'
+        return None
+
+    def _commit_download(self, url, partial_path, filepath):
+        """Verify a complete .part file (when verify_downloads is set) and move it into place"""
+        if self.verify_downloads:
+            try:
+                verify_image_file(partial_path)
+            except Exception as e:
+                print(f"Corrupt image: {url} ({str(e)})")
+                return 'failed'
+        
+        os.replace(partial_path, filepath)
+        return None
+
+    def _sniff_images(self):
+        """Whether downloads must be parsed for dimensions/format while streaming"""
+        return bool(self.min_image_size or self.max_image_size or self.allowed_formats)
+
+    def _check_headers(self, headers):
+        """Why response headers alone rule an image out, or None"""
+        length = headers.get('content-length')
+        encoded = headers.get('content-encoding', 'identity') != 'identity'
+        if length and length.isdigit() and not encoded:
+            if self.max_bytes and int(length) > self.max_bytes:
+                return f"{length} bytes, larger than {self.max_bytes}"
+            if self.min_bytes and int(length) < self.min_bytes:
+                return f"{length} bytes, smaller than {self.min_bytes}"
+        
+        content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+        image_format = CONTENT_TYPE_FORMATS.get(content_type)
+        if self.allowed_formats and image_format and image_format not in self.allowed_formats:
+            return f"format {image_format} not allowed"
+        return None
+
+    def _check_image(self, image_format, size):
+        """Why an image's format or dimensions break the download rules, or None"""
+        if self.allowed_formats and image_format not in self.allowed_formats:
+            return f"format {image_format} not allowed"
+        width, height = size
+        if self.min_image_size and (width < self.min_image_size[0] or height < self.min_image_size[1]):
+            return f"{width}x{height} is below the minimum {self.min_image_size[0]}x{self.min_image_size[1]}"
+        if self.max_image_size and (width > self.max_image_size[0] or height > self.max_image_size[1]):
+            return f"{width}x{height} is above the maximum {self.max_image_size[0]}x{self.max_image_size[1]}"
+        return None
+
+    def _fetch_to_store(self, url, image_data, category, ext):
+        """Download an image into the content store; see fetch_image and _fetch_steps"""
+        category_dir = os.path.join(self.output_dir, category)
+        
+        # URLs fetched on an earlier run only need their category link
+        digest, object_path = self.store.lookup_url(url)
+        if digest:
+            output_path = self._store_output(digest, object_path)
+            if os.path.exists(output_path):
+                self.store.link(output_path, os.path.join(category_dir, digest[:16] + ext))
+                print(f"Skipping stored URL: {url}")
+                return 'skipped', None
+        
+        temp_path = self.store.temp_path()
+        started = time.perf_counter()
         try:
-            img = Image.open(image_path)
-            
-            # Convert to RGB if needed
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Only resize if target_size is specified
-            if self.target_size:
-                img = img.resize(self.target_size, Image.Resampling.LANCZOS)
+            sha256 = hashlib.sha256()
+            status = yield url, temp_path, sha256
+            if status:
+                return status, None
             
-            return img
-                
-        except Exception as e:
-            print(f"Error processing image {image_path}: {str(e)}")
-            return None
+            digest = sha256.hexdigest()
+            object_path, is_new = self.store.add(temp_path, digest, ext, url)
+        except requests.exceptions.RequestException as e:
+            print(f"Error downloading {url}: {str(e)}")
+            return self._failure_status(e), None
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        
+        job = {
+            'url': url,
+            'category': category,
+            'filename': digest[:16] + ext,
+            'filepath': object_path,
+            'output_path': self._store_output(digest, object_path),
+            'link_path': os.path.join(category_dir, digest[:16] + ext),
+            'sha256': digest,
+            'download_ms': (time.perf_counter() - started) * 1000,
+            'title': image_data.get('title', ''),
+            'alt': image_data.get('alt', '')
+        }
+        
+        if not is_new:
+            # Same bytes already stored (other URL or category): link, don't reprocess.
+            # A copy still being processed is produced again by finish_image
+            job['duplicate'] = True
+            if not os.path.exists(job['output_path']):
+                return 'downloaded', job
+            self.store.link(job['output_path'], job['link_path'])
+            job['filepath'] = job['output_path']
+            self._record_metadata(job)
+            return 'duplicate', None
+        
+        return 'downloaded', job
 
-    def scrape(self):
-        """Main scraping function"""
-        print("Starting image scraping...")
+    def _store_output(self, digest, object_path):
+        """
+        Where the kept version of a stored object lives: the object itself, or its
+        processed copy when images are resized or re-encoded
+        """
+        if not (self.target_size or self.output_format):
+            return object_path
+        return self.store.derived_path(digest, os.path.splitext(object_path)[1])
+
+    def _record_metadata(self, job):
+        """Append the metadata record for a stored image"""
+        entry = {
+            'url': job['url'],
+            'category': job['category'],
+            'filename': job['filename'],
+            'title': job['title'],
+            'alt': job['alt']
+        }
+        for key in ('sha256', 'phash', 'near_duplicate_of'):
+            if job.get(key):
+                entry[key] = job[key]
         
+        # Per-image stats: stored size, resolution (header read only) and timings
         try:
-            # Try Selenium first
-            print("Attempting to scrape with Selenium...")
-            images = self.scrape_with_selenium()
-            
-            if not images:
-                # Fall back to BeautifulSoup if Selenium fails
-                print("\nFalling back to BeautifulSoup...")
-                images = self.scrape_with_bs4()
-            
-            if not images:
-                print("No images found. Exiting...")
-                return
+            entry['bytes'] = os.path.getsize(job['filepath'])
+            with Image.open(job['filepath']) as img:
+                entry['width'], entry['height'] = img.size
+        except Exception:
+            pass
+        for key in ('download_ms', 'process_ms'):
+            if job.get(key) is not None:
+                entry[key] = round(job[key], 3)
+        
+        if self.manifest:
+            self.manifest.append(entry)
+        else:
+            with self._lock:
+                self.metadata.append(entry)
+        
+        if self.journal:
+            self.journal.record(job['url'], entry)
+        
+        return entry
+
+    def _class_label(self, category):
+        """Integer label for a category, assigned in order of first appearance"""
+        with self._lock:
+            if category not in self.class_labels:
+                self.class_labels[category] = len(self.class_labels)
+            return self.class_labels[category]
+
+    def _sample_key(self, url):
+        """Key of an image's sample in the tar shards and the tensor"""
+        return hashlib.md5(url.encode()).hexdigest()[:20]
+
+    def _is_packed(self, url):
+        """Whether an image is already in every training output (its loose file may be gone)"""
+        if not (self.shard_writer or self.array_writer):
+            return False
+        key = self._sample_key(url)
+        return ((not self.shard_writer or key in self.shard_writer)
+                and (not self.array_writer or key in self.array_writer))
+
+    def _write_training_outputs(self, job, entry):
+        """
+        Add a processed image to the tar shards and/or the uint8 tensor
+        - Samples packed on an earlier run (by key) are not written again
+        """
+        filepath = job['filepath']
+        label = self._class_label(job['category'])
+        key = self._sample_key(job['url'])
+        
+        if self.shard_writer:
+            self.shard_writer.write(key, filepath, label, entry)
             
-            # Download images
-            self.download_images(images)
+            # Each variant goes to its own shard set
+            for name, path in job.get('variant_paths', {}).items():
+                if os.path.exists(path):
+                    self.variant_shard_writers[name].write(key, path, label, entry)
+                    if not self.keep_files:
+                        os.remove(path)
+        
+        if self.array_writer and not self.array_writer.append(key, filepath, label):
+            print(f"Not added to array output (size differs from target): {filepath}")
+        
+        # Loose files are optional once the image lives in a shard or the tensor
+        if not self.keep_files and not self.store and os.path.exists(filepath):
+            os.remove(filepath)
+
+    def close_outputs(self):
+        """Finish open shards, persist the tensor header/labels and the class map"""
+        if self.shard_writer:
+            self.shard_writer.close()
+        for writer in self.variant_shard_writers.values():
+            writer.close()
+        if self.array_writer:
+            self.array_writer.flush()
+        if self.shard_writer or self.array_writer:
+            with open(self.classes_file, 'w', encoding='utf-8') as f:
+                json.dump(self.class_labels, f, indent=2, ensure_ascii=False)
+
+    def finish_image(self, job):
+        """
+        Post-process a downloaded image and record its metadata (CPU stage)
+        - Returns 'success', 'duplicate' or 'failed'
+        """
+        status = self._finish_image(job)
+        if self.journal:
+            self.journal.finish(job['url'], self._journal_state(status))
+        if status in ('success', 'duplicate'):
+            self._mark_seen(job['url'])
+        return status
+
+    def _finish_image(self, job):
+        """Post-process a downloaded image; see finish_image"""
+        filepath = job['filepath']
+        started = time.perf_counter()
+        
+        if job.get('duplicate'):
+            return self._finish_duplicate(job)
+        
+        # Stored objects keep their bytes (and address); processing writes a separate copy
+        output_path = job.get('output_path')
+        
+        # Process image if needed (statistics are taken from the same decode)
+        stats = None
+        job['variant_paths'] = {variant['name']: self.variant_path(variant, job) for variant in self.variants}
+        if self.target_size or self.output_format or self.stats is not None or self.variants:
+            variants = [(job['variant_paths'][v['name']], v['size'], v['policy']) for v in self.variants]
+            args = (filepath, self.target_size, self.fast_resize, self.output_format, self.output_quality,
+                    self.stats is not None, self.resize_policy, variants,
+                    output_path if output_path != filepath else None)
+            try:
+                if self.process_pool:
+                    error, stats = self._get_process_executor().submit(process_image_file, *args).result()
+                else:
+                    error, stats = process_image_file(*args)
+            except Exception as e:
+                error, stats = str(e), None
             
-        except Exception as e:
-            print(f"Error during scraping: {str(e)}")
-            traceback.print_exc()
+            if error:
+                print(f"Error processing image {filepath}: {error}")
+                self._remove_variants(job)
+                if self.store:
+                    self.store.discard(job['sha256'])
+                elif os.path.exists(filepath):
+                    os.remove(filepath)
+                return 'failed'
+        
+        if output_path and output_path != filepath:
+            # Images already at the target are not rewritten; the copy is a link to the object
+            if not os.path.exists(output_path):
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                self.store.link(filepath, output_path)
+            job['filepath'] = filepath = output_path
+        
+        # Drop or group perceptual near-duplicates of images already kept
+        if self.near_dup_index is not None and self._check_near_duplicate(job):
+            return 'duplicate'
+        
+        # Expose stored objects in their category directory
+        if job.get('link_path'):
+            self.store.link(filepath, job['link_path'])
+        
+        job['process_ms'] = (time.perf_counter() - started) * 1000
+        
+        if stats:
+            with self._lock:
+                self.stats.merge(stats)
+        
+        # Store metadata
+        entry = self._record_metadata(job)
+        
+        if self.shard_writer or self.array_writer:
+            self._write_training_outputs(job, entry)
+        
+        return 'success'
+
+    def _finish_duplicate(self, job):
+        """
+        Link a byte-identical copy of a stored image whose processed version was not
+        ready at download time, producing that version if it is still missing
+        """
+        filepath, output_path = job['filepath'], job['output_path']
+        if not os.path.exists(output_path):
+            error, _ = process_image_file(filepath, self.target_size, self.fast_resize, self.output_format,
+                                          self.output_quality, policy=self.resize_policy, output_path=output_path)
+            if error:
+                print(f"Error processing image {filepath}: {error}")
+                return 'failed'
+            if not os.path.exists(output_path):
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                self.store.link(filepath, output_path)
+        
+        self.store.link(output_path, job['link_path'])
+        job['filepath'] = output_path
+        self._record_metadata(job)
+        return 'duplicate'
+
+    def _check_near_duplicate(self, job):
+        """
+        Hash a processed image and look it up in the near-duplicate index
+        - Returns True if the image was dropped as a near-duplicate
+        """
+        filepath = job['filepath']
+        value = image_perceptual_hash(filepath, self.near_dup_method)
+        if value is None:
+            return False
+        job['phash'] = f"{value:016x}"
+        
+        with self._lock:
+            ids, _ = self.near_dup_index.query(value, self.near_dup_threshold)
+            match = self._near_dup_refs[ids[0]] if len(ids) else None
+            if match is None or self.near_dup_action == 'group':
+                self.near_dup_index.add(value)
+                self._near_dup_refs.append(match or os.path.join(job['category'], job['filename']))
+        
+        if match is None:
+            return False
+        
+        if self.near_dup_action == 'group':
+            job['near_duplicate_of'] = match
+            return False
+        
+        print(f"Dropping near-duplicate of {match}: {job['url']}")
+        self._remove_variants(job)
+        if self.store:
+            self.store.discard(job['sha256'])
+        elif os.path.exists(filepath):
+            os.remove(filepath)
+        return True
+
+    def _remove_variants(self, job):
+        """Delete variant files written for an image that is not kept"""
+        for path in job.get('variant_paths', {}).values():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _get_process_executor(self):
+        """Return the shared image processing pool, starting it on first use"""
+        with self._lock:
+            if self._process_executor is None:
+                self._process_executor = ProcessPoolExecutor(max_workers=self.process_workers)
+            return self._process_executor
+
+    def close_process_pool(self):
+        """Shut down the image processing pool if one was started"""
+        with self._lock:
+            executor, self._process_executor = self._process_executor, None
+        if executor:
+            executor.shutdown()
+
+    def download_image(self, image_data, category):
+        """
+        Download and process a single image
+        - Returns 'success', 'duplicate', 'failed' or 'skipped'
+        - Safe to call from several worker threads at once
+        """
+        status, job = self.fetch_image(image_data, category)
+        if status != 'downloaded':
+            return status
+        return self.finish_image(job)
 
     def download_images(self, categorized_images):
         """Download and process images by category"""
@@ -627,119 +4825,410 @@ class ImageScraper:
         total_images = sum(len(images) for images in categorized_images.values())
         print(f"\nDownloading {total_images} images...")
         
-        # Track success and failure counts
-        success_count = 0
-        failed_count = 0
-        skipped_count = 0
+        # Track success, failure and skip counts
+        counts = Counter()
         
-        for category, images in categorized_images.items():
-            print(f"\nProcessing category: {category}")
-            category_dir = os.path.join(self.output_dir, category)
-            os.makedirs(category_dir, exist_ok=True)
+        for category in categorized_images:
+            os.makedirs(os.path.join(self.output_dir, category), exist_ok=True)
+        
+        # Resolve every host up front, in the background
+        for images in categorized_images.values():
+            for image_data in images:
+                self.dns.prefetch(urllib.parse.urlparse(image_data.get('url') or '').hostname)
+        
+        progress = tqdm(total=total_images, desc="Downloading images")
+        
+        def record(status):
+            with self._lock:
+                counts[status] += 1
+            progress.update(1)
+        
+        # With a process pool, downloaded images go to a separate processing stage,
+        # so download threads never wait on CPU work
+        process, join_processing = self._start_processing(record) if self.process_pool else (None, None)
+        
+        def handle(status, job):
+            if job is None:
+                record(status)
+            elif process:
+                process(job)
+            else:
+                record(self.finish_image(job))
+        
+        def download(image_data, category):
+            handle(*self.fetch_image(image_data, category))
+        
+        try:
+            if self.retry_queue or self.transport == 'http2' or self.scheduler:
+                # Workers share a scheduled queue, so retries and polite pauses never hold a worker
+                work = RetryQueue()
+                for category, images in categorized_images.items():
+                    for image_data in images:
+                        work.put((image_data, category, 0))
+                work.close()
+                
+                if self.transport == 'http2':
+                    workers = [threading.Thread(target=self._async_download_worker, args=(work, handle), daemon=True)]
+                else:
+                    workers = [threading.Thread(target=self._download_worker, args=(work, handle), daemon=True)
+                               for _ in range(self.max_workers)]
+                for thread in workers:
+                    thread.start()
+                for thread in workers:
+                    thread.join()
+            elif self.max_workers > 1:
+                # Fan out over a bounded worker pool; per-host slots cap load on each server
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = [
+                        executor.submit(download, image_data, category)
+                        for category, images in categorized_images.items()
+                        for image_data in images
+                    ]
+                    for future in as_completed(futures):
+                        future.result()
+            else:
+                for category, images in categorized_images.items():
+                    for image_data in images:
+                        download(image_data, category)
+        finally:
+            if join_processing:
+                join_processing()
+            progress.close()
+            self.close_process_pool()
+        
+        self._print_summary(counts)
+        self.save_metadata()
+
+    def _download_worker(self, work, handle):
+        """
+        Fetch (image_data, category, attempt) items from a RetryQueue until it is drained
+        - handle(status, job) receives every final outcome
+        - With the retry queue, items for hosts at max_per_host are parked and items for
+          open-circuit hosts deferred instead of blocking the worker; transient failures
+          are re-queued with exponential backoff until retry_attempts is reached
+        - Items whose host has no polite request slot yet are deferred until it is due
+        """
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            image_data, category, attempt = item
+            try:
+                host, probe = None, False
+                if self.retry_queue:
+                    admitted = self._admit_download(work, item, handle, self.max_per_host)
+                    if admitted is None:
+                        continue
+                    host, probe = admitted
+                try:
+                    status, job = self.fetch_image(image_data, category, wait=False)
+                except HostPaused as e:
+                    self._defer_paused(work, item, handle, e)
+                    continue
+                finally:
+                    if host is not None:
+                        self._release_host(work, host, probe)
+                
+                status = self._retry_status(work, item, status)
+                if status:
+                    handle(status, job)
+            except Exception as e:
+                print(f"Error downloading {image_data.get('url')}: {str(e)}")
+                handle('failed', None)
+            finally:
+                work.done()
+
+    def _async_download_worker(self, work, handle):
+        """Thread target running the http2 transport's event loop over a RetryQueue"""
+        asyncio.run(self._download_async(work, handle))
+
+    async def _download_async(self, work, handle):
+        """
+        Fetch (image_data, category, attempt) items from a RetryQueue on one event loop
+        - Up to max_in_flight downloads run at once through httpx clients that
+          multiplex the requests to a host over HTTP/2 when the server supports it
+          (see HTTP2Clients)
+        - Hosts get at most max_streams_per_host concurrent requests; retries and
+          open circuits follow the same rules as _download_worker
+        - handle(status, job) runs on a helper thread so post-processing never
+          blocks the loop
+        """
+        clients = HTTP2Clients(lambda: httpx.AsyncClient(
+            http2=True,
+            headers=self.headers,
+            timeout=httpx.Timeout(30, pool=None),
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            follow_redirects=True,
+            verify=False  # Skip SSL verification
+        ))
+        slots = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        try:
+            while True:
+                await slots.acquire()
+                item = await asyncio.to_thread(work.get)
+                if item is None:
+                    break
+                task = asyncio.create_task(self._download_item_async(clients, work, item, handle))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: slots.release())
+            await asyncio.gather(*tasks)
+        finally:
+            await clients.aclose()
+
+    async def _download_item_async(self, clients, work, item, handle):
+        """Download one queued item on the async client; see _download_async"""
+        image_data, category, attempt = item
+        try:
+            admitted = self._admit_download(work, item, handle, self.max_streams_per_host)
+            if admitted is None:
+                return
+            host, probe = admitted
+            try:
+                status, job = await self.fetch_image_async(clients, image_data, category)
+            except HostPaused as e:
+                await asyncio.to_thread(self._defer_paused, work, item, handle, e)
+                return
+            finally:
+                self._release_host(work, host, probe)
             
-            for image_data in tqdm(images, desc=f"Downloading {category} images"):
+            status = self._retry_status(work, item, status)
+            if status:
+                await asyncio.to_thread(handle, status, job)
+        except Exception as e:
+            print(f"Error downloading {image_data.get('url')}: {str(e)}")
+            await asyncio.to_thread(handle, 'failed', None)
+        finally:
+            work.done()
+
+    def _admit_download(self, work, item, handle, limit):
+        """
+        Claim one of the item's host slots (at most limit per host) for a queued download
+        - Returns (host, probe) when the download may start, probe being True when it
+          is the host's circuit-breaker probe; release it with _release_host
+        - Otherwise returns None after parking the item (host busy), deferring it
+          (circuit open) or failing it (host down)
+        """
+        url = item[0].get('url') or ''
+        host = urllib.parse.urlparse(url).hostname or ''
+        with self._lock:
+            busy = self._host_active[host] >= limit
+            if not busy:
+                self._host_active[host] += 1
+        if busy:
+            # Wait for one of the host's downloads to finish (re-checked in case
+            # the last one finished before parking)
+            work.park(host, item)
+            with self._lock:
+                busy = self._host_active[host] >= limit
+            if not busy:
+                work.unpark(host)
+            return None
+        
+        state, wait = self.breaker.check(host) if self.breaker else ('closed', 0)
+        if state == 'closed' or state == 'probe':
+            return host, state == 'probe'
+        self._release_host(work, host)
+        if state == 'down':
+            print(f"Skipping {url}: host {host} is down")
+            handle('failed', None)
+        else:
+            with self._lock:
+                self.retry_counts['deferred'] += 1
+            work.defer(item, wait)
+        return None
+
+    def _release_host(self, work, host, probe=False):
+        """
+        Free a host slot taken by _admit_download and wake an item parked on it
+        - A probe that sent no request (file already there, skipped by robots or HEAD,
+          DNS failure) gives the probe back, so the host's other items are not deferred forever
+        """
+        if probe:
+            self.breaker.release_probe(host)
+        with self._lock:
+            self._host_active[host] -= 1
+        work.unpark(host)
+
+    def _defer_paused(self, work, item, handle, paused):
+        """
+        Re-queue an item until its host's polite request slot is due
+        - A 429/503 answer counts as an attempt, up to retry_attempts
+        """
+        image_data, category, attempt = item
+        if paused.throttled:
+            attempt += 1
+            if attempt >= self.retry_attempts:
+                print(f"Giving up on {image_data.get('url')} after {attempt} throttled attempts")
+                handle('failed', None)
+                return
+        with self._lock:
+            self.retry_counts['paced'] += 1
+        work.defer((image_data, category, attempt), paused.delay)
+
+    def _retry_status(self, work, item, status):
+        """
+        Re-queue a 'retry' outcome with exponential backoff (and jitter)
+        - Returns None when the item was re-queued, otherwise its final status
+        """
+        if status != 'retry':
+            return status
+        image_data, category, attempt = item
+        if attempt + 1 < self.retry_attempts:
+            delay = self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            work.defer((image_data, category, attempt + 1), delay)
+            with self._lock:
+                self.retry_counts['retried'] += 1
+            return None
+        print(f"Giving up on {image_data.get('url')} after {attempt + 1} attempts")
+        return 'failed'
+
+    def stream_images(self, records):
+        """
+        Download and process image records while they are still being discovered
+        - Discovery, download and post-processing run as separate stages
+        - Stages are joined by bounded queues, so a slow stage throttles the ones before it
+        """
+        download_queue = RetryQueue(maxsize=self.queue_size)
+        counts = Counter()
+        progress = tqdm(desc="Downloading images", unit="img")
+        
+        def record(status):
+            with self._lock:
+                counts[status] += 1
+            progress.update(1)
+        
+        def produce():
+            try:
+                for image_data in records:
+                    # Start the host lookup while the record waits in the queue
+                    self.dns.prefetch(urllib.parse.urlparse(image_data.get('url') or '').hostname)
+                    category = image_data.get('category') or 'uncategorized'
+                    os.makedirs(os.path.join(self.output_dir, category), exist_ok=True)
+                    download_queue.put((image_data, category, 0))
+            except Exception as e:
+                print(f"Error during discovery: {str(e)}")
+                traceback.print_exc()
+            finally:
+                download_queue.close()
+        
+        def handle(status, job):
+            if job is None:
+                record(status)
+            else:
+                process(job)
+        
+        process, join_processing = self._start_processing(record)
+        producer = threading.Thread(target=produce, daemon=True)
+        if self.transport == 'http2':
+            downloaders = [threading.Thread(target=self._async_download_worker, args=(download_queue, handle), daemon=True)]
+        else:
+            downloaders = [threading.Thread(target=self._download_worker, args=(download_queue, handle), daemon=True)
+                           for _ in range(self.max_workers)]
+        
+        for thread in [producer] + downloaders:
+            thread.start()
+        
+        producer.join()
+        for thread in downloaders:
+            thread.join()
+        join_processing()
+        progress.close()
+        self.close_process_pool()
+        
+        if not sum(counts.values()):
+            print("No images found. Exiting...")
+            return
+        
+        self._print_summary(counts)
+        self.save_metadata()
+
+    def _start_processing(self, record):
+        """
+        Start the post-processing stage: process_workers threads running finish_image
+        - Returns (process, join); process(job) queues a downloaded job and blocks while
+          queue_size jobs are waiting, so slow processing throttles the downloads
+        - join() waits for the queued jobs and stops the threads
+        - record(status) receives every outcome
+        """
+        process_queue = queue.Queue(maxsize=self.queue_size)
+        
+        def process_worker():
+            while True:
+                job = process_queue.get()
+                if job is None:
+                    break
                 try:
-                    url = image_data['url']
-                    
-                    # Skip if URL is invalid
-                    if not url or not url.startswith('http'):
-                        print(f"Skipping invalid URL: {url}")
-                        skipped_count += 1
-                        continue
-                    
-                    # Generate filename from URL
-                    filename = os.path.basename(url).split('?')[0]
-                    if not filename:
-                        filename = hashlib.md5(url.encode()).hexdigest()[:10] + '.jpg'
-                    
-                    # Ensure filename has an extension
-                    if not os.path.splitext(filename)[1]:
-                        filename += '.jpg'
-                    
-                    # Create full path
-                    filepath = os.path.join(category_dir, filename)
-                    
-                    # Skip if file already exists
-                    if os.path.exists(filepath):
-                        print(f"Skipping existing file: {filepath}")
-                        skipped_count += 1
-                        continue
-                    
-                    # Download image with timeout and retries
-                    try:
-                        # Try to resolve the hostname first
-                        parsed_url = urllib.parse.urlparse(url)
-                        try:
-                            socket.gethostbyname(parsed_url.hostname)
-                        except socket.gaierror:
-                            print(f"Could not resolve hostname for: {url}")
-                            failed_count += 1
-                            continue
-                        
-                        response = self.session.get(
-                            url,
-                            headers=self.headers,
-                            timeout=30,
-                            stream=True,
-                            verify=False  # Skip SSL verification
-                        )
-                        response.raise_for_status()
-                        
-                        # Check if it's actually an image
-                        content_type = response.headers.get('content-type', '')
-                        if not content_type.startswith('image/'):
-                            print(f"Skipping non-image content: {url} ({content_type})")
-                            skipped_count += 1
-                            continue
-                        
-                        # Save image
-                        with open(filepath, 'wb') as f:
-                            for chunk in response.iter_content(chunk_size=8192):
-                                if chunk:
-                                    f.write(chunk)
-                        
-                        # Process image if needed
-                        if self.target_size:
-                            try:
-                                img = Image.open(filepath)
-                                img = img.resize(self.target_size, Image.Resampling.LANCZOS)
-                                img.save(filepath)
-                            except Exception as e:
-                                print(f"Error processing image {filepath}: {str(e)}")
-                                if os.path.exists(filepath):
-                                    os.remove(filepath)
-                                failed_count += 1
-                                continue
-                        
-                        # Store metadata
-                        self.metadata.append({
-                            'url': url,
-                            'category': category,
-                            'filename': filename,
-                            'title': image_data.get('title', ''),
-                            'alt': image_data.get('alt', '')
-                        })
-                        
-                        success_count += 1
-                        
-                    except requests.exceptions.RequestException as e:
-                        print(f"Error downloading {url}: {str(e)}")
-                        failed_count += 1
-                        continue
-                    
+                    record(self.finish_image(job))
                 except Exception as e:
-                    print(f"Error processing {url}: {str(e)}")
-                    failed_count += 1
-                    continue
+                    print(f"Error processing {job['url']}: {str(e)}")
+                    record('failed')
+        
+        processors = [threading.Thread(target=process_worker, daemon=True)
+                      for _ in range(self.process_workers)]
+        for thread in processors:
+            thread.start()
+        
+        def join():
+            for _ in processors:
+                process_queue.put(None)
+            for thread in processors:
+                thread.join()
+        
+        return process_queue.put, join
+
+    def _print_summary(self, counts):
+        """Print success/failure/skip totals for a download run"""
+        success_count = counts['success']
+        failed_count = counts['failed']
+        skipped_count = counts['skipped']
+        duplicate_count = counts['duplicate']
         
         # Print summary
         print(f"\nDownload Summary:")
         print(f"Successful: {success_count}")
         print(f"Failed: {failed_count}")
         print(f"Skipped: {skipped_count}")
-        print(f"Total Processed: {success_count + failed_count + skipped_count}")
+        if duplicate_count:
+            print(f"Duplicates: {duplicate_count}")
+        print(f"Total Processed: {success_count + failed_count + skipped_count + duplicate_count}")
+        if self.http_cache:
+            print(f"HTTP cache: {self.http_cache.hits} revalidated, {self.http_cache.misses} fetched")
+        if self.dns.lookups:
+            print(f"DNS cache: {self.dns.lookups} lookups, {self.dns.hits} cached answers")
+        if self.breaker:
+            print(f"Retries: {self.retry_counts['retried']} re-queued, {self.retry_counts['deferred']} deferred, "
+                  f"{self.breaker.opened} circuits opened")
+            for host in self.breaker.open_hosts():
+                print(f"Circuit open: {host}")
+        for origin, rate in self.host_rates().items():
+            print(f"Host {origin}: {rate['rate']} req/s (max {rate['max_rate']}), "
+                  f"{rate['requests']} requests, {rate['throttled']} throttled")
+        if self.retry_counts['paced']:
+            print(f"Polite pauses: {self.retry_counts['paced']} downloads re-queued until their host's slot")
+
+    def save_metadata(self):
+        """Write collected metadata to metadata.json (or flush the Parquet manifest)"""
+        if self.journal:
+            self.journal.flush()
+        self.seen_urls.save()
+        
+        self.close_outputs()
+        
+        if self.stats is not None and self.stats.images:
+            with open(self.stats_file, 'w', encoding='utf-8') as f:
+                json.dump(self.stats.to_dict(), f, indent=2)
+            mean = ', '.join(f"{v:.3f}" for v in self.stats.mean / 255)
+            std = ', '.join(f"{v:.3f}" for v in self.stats.std / 255)
+            print(f"\nDataset statistics ({self.stats.images} images): mean [{mean}], std [{std}]")
+            print(f"Saved statistics to {self.stats_file}")
+        
+        if self.manifest:
+            self.manifest.flush()
+            print(f"\nManifest: {self.manifest.rows_written} rows in {self.manifest.root}")
+            return
         
-        # Save metadata
         if self.metadata:
             metadata_file = os.path.join(self.output_dir, 'metadata.json')
             with open(metadata_file, 'w', encoding='utf-8') as f:
@@ -752,16 +5241,9 @@ def main():
         # Create scraper instance
         scraper = ImageScraper()
         
-        # Scrape images and categories
+        # Scrape images and categories (metadata is saved as downloads finish)
         scraper.scrape()
         
-        # Save metadata
-        if scraper.metadata:
-            metadata_file = os.path.join(scraper.output_dir, 'metadata.json')
-            with open(metadata_file, 'w') as f:
-                json.dump(scraper.metadata, f, indent=2)
-            print(f"\nMetadata saved to {metadata_file}")
-        
         print("\nScraping completed successfully!")
         
     except Exception as e:
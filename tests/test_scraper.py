@@ -0,0 +1,541 @@
+import functools
+import hashlib
+import http.server
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tarfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+import pytest
+import requests
+from bs4 import BeautifulSoup
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scraper import (CDN_VARIANT_RULES, ArrayWriter, BloomFilter, BodyCheck, CrawlJournal, DNSCache, HammingIndex, HostScheduler,
+                     HTTPCache, ImageScraper, ImageStats, URLCanonicalizer, URLKeySet, choose_srcset_candidate, parse_srcset,
+                     process_image_file)
+
+
+def make_scraper(tmp_path, **kwargs):
+    return ImageScraper(output_dir=str(tmp_path / 'dataset'), **kwargs)
+
+
+def make_jpeg(path, size=(300, 200), seed=0):
+    """Write a noise JPEG (distinct bytes per seed); return its bytes"""
+    pixels = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, 'JPEG', quality=95)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def image_server(tmp_path):
+    """Serve tmp_path/site over HTTP on localhost; yields (site directory, base URL)"""
+    site = tmp_path / 'site'
+    site.mkdir()
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=str(site)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield site, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('seed', ['https://example.com', 'https://example.com/'])
+def test_prefix_scope_bare_host_seed(tmp_path, seed):
+    scraper = make_scraper(tmp_path, crawl=True, seed_urls=[seed], crawl_scope='prefix')
+    assert scraper.in_scope('https://example.com/gallery/page/2')
+    assert scraper.in_scope('https://example.com')
+    assert not scraper.in_scope('https://evil.org/x')
+    assert not scraper.in_scope('https://example.com.evil.org/x')
+    assert not scraper.in_scope('http://example.com/x')
+
+
+def test_prefix_scope_trailing_slash_seed(tmp_path):
+    scraper = make_scraper(tmp_path, crawl=True, seed_urls=['https://example.com/gallery/'], crawl_scope='prefix')
+    assert scraper.in_scope('https://example.com/gallery/')
+    assert scraper.in_scope('https://example.com/gallery/cats/2?page=3')
+    assert not scraper.in_scope('https://example.com/galleryx/1')
+    assert not scraper.in_scope('https://example.com/other/1')
+    assert not scraper.in_scope('https://evil.org/gallery/1')
+
+
+def test_prefix_scope_file_seed(tmp_path):
+    scraper = make_scraper(tmp_path, crawl=True, seed_urls=['https://example.com/gallery/index.html?p=1'],
+                           crawl_scope='prefix')
+    assert scraper.in_scope('https://example.com/gallery/page2.html')
+    assert not scraper.in_scope('https://example.com/index.html')
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('HTTP://Example.COM:80/a.jpg?utm_source=x&b=2&a=1#top', 'https://example.com/a.jpg?a=1&b=2'),
+    ('https://user:pw@example.com.:443/a.jpg', 'https://example.com/a.jpg'),
+    ('https://example.com:8443', 'https://example.com:8443/'),
+    ('http://[2001:DB8::1]/a.jpg', 'https://[2001:db8::1]/a.jpg'),
+    ('https://[2001:db8::1]:8443/a.jpg?fbclid=1', 'https://[2001:db8::1]:8443/a.jpg'),
+    ('https://cdn.example.com/photo-300x200.jpg', 'https://cdn.example.com/photo.jpg'),
+    ('https://cdn.example.com/photo@2x.jpg?w=1', 'https://cdn.example.com/photo.jpg?w=1'),
+])
+def test_canonical_url(url, expected):
+    canonical = URLCanonicalizer(variant_rules=CDN_VARIANT_RULES)(url)
+    assert canonical == expected
+    assert urllib.parse.urlsplit(canonical).hostname == urllib.parse.urlsplit(expected).hostname
+
+
+@pytest.mark.parametrize('make_index', [
+    lambda path: URLKeySet(str(path / 'seen_urls.npy'), merge_threshold=8),
+    lambda path: BloomFilter(1000, 0.001, str(path / 'seen_urls.bloom.npz')),
+])
+def test_seen_url_index_persists(tmp_path, make_index):
+    index = make_index(tmp_path)
+    urls = [f"https://example.com/{i}.jpg" for i in range(50)]
+    for url in urls:
+        index.add(url)
+    assert all(url in index for url in urls)
+    index.save()
+
+    restored = make_index(tmp_path)
+    assert len(restored) == 50
+    assert all(url in restored for url in urls)
+    assert sum(f"https://example.com/other{i}.jpg" in restored for i in range(1000)) < 10
+
+
+def test_parse_srcset():
+    assert parse_srcset('a.jpg 300w, https://cdn.example.com/img,q_80/b.jpg 2x,c.jpg') == [
+        ('a.jpg', 300, None), ('https://cdn.example.com/img,q_80/b.jpg', None, 2.0), ('c.jpg', None, 1.0)]
+    assert parse_srcset('') == []
+
+
+@pytest.mark.parametrize('srcset, target_size, base_width, expected', [
+    ('s.jpg 100w, m.jpg 320w, l.jpg 1024w', (200, 200), None, 'm.jpg'),
+    ('s.jpg 100w, m.jpg 320w, l.jpg 1024w', (500, 300), None, 'l.jpg'),
+    ('s.jpg 100w, m.jpg 320w, l.jpg 1024w', (2000, 2000), None, 'l.jpg'),
+    ('s.jpg 100w, m.jpg 320w, l.jpg 1024w', None, None, 'l.jpg'),
+    ('x1.jpg 1x, x2.jpg 2x, x3.jpg 3x', (500, 500), 300, 'x2.jpg'),
+])
+def test_choose_srcset_candidate(srcset, target_size, base_width, expected):
+    assert choose_srcset_candidate([srcset], target_size, base_width) == expected
+
+
+def test_image_source_picks_decodable_picture_source(tmp_path):
+    html = """<picture>
+        <source type="image/jxl" srcset="/a.jxl 400w">
+        <source type="image/webp" srcset="/a-400.webp 400w, /a-1600.webp 1600w">
+        <img src="/a-200.jpg" width="200" srcset="/a-800.jpg 800w">
+    </picture>"""
+    img = BeautifulSoup(html, 'html.parser').find('img')
+    assert make_scraper(tmp_path, target_size=(300, 300), responsive_images=True).image_source(img) == '/a-400.webp'
+    assert make_scraper(tmp_path, target_size=(600, 600), responsive_images=True).image_source(img) == '/a-800.jpg'
+    assert make_scraper(tmp_path, target_size=(600, 600)).image_source(img) == '/a-200.jpg'
+
+
+def test_breaker_probe_released_without_request(tmp_path):
+    scraper = make_scraper(tmp_path, retry_queue=True, breaker_threshold=1, breaker_cooldown=0.05, max_workers=1)
+    host = '127.0.0.1'
+    scraper.breaker.failure(host)
+    images = [{'url': f'http://{host}:9/img{i}.jpg'} for i in range(3)]
+    category_dir = tmp_path / 'dataset' / 'cats'
+    category_dir.mkdir(parents=True)
+    for i in range(3):
+        (category_dir / f'img{i}.jpg').write_bytes(b'x')
+    time.sleep(0.1)
+    
+    # Every item is a local-file hit, so the half-open probe never sends a request
+    worker = threading.Thread(target=scraper.download_images, args=({'cats': images},), daemon=True)
+    worker.start()
+    worker.join(timeout=20)
+    assert not worker.is_alive()
+    assert not scraper.breaker._hosts[host]['probing']
+
+
+def test_robots_failures_allow_once_without_retries():
+    hits = []
+
+    class FailingHandler(QuietHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            self.send_error(502)
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FailingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        scheduler = HostScheduler({}, robots_retry=60)
+        failing = f"http://127.0.0.1:{server.server_address[1]}"
+        assert not scheduler.allowed(failing + '/a.jpg')
+        assert not scheduler.allowed(failing + '/b.jpg')
+        assert hits == ['/robots.txt']
+
+        # Unreachable hosts are allowed, and the failure is cached until robots_retry passes
+        closed = 'http://127.0.0.1:9'
+        assert scheduler.allowed(closed + '/a.jpg')
+        expires = scheduler._hosts[closed]['robots_expires']
+        assert scheduler.allowed(closed + '/b.jpg')
+        assert scheduler._hosts[closed]['robots_expires'] == expires
+        scheduler._hosts[closed]['robots_expires'] = 0.0
+        assert scheduler.allowed(closed + '/c.jpg')
+        assert scheduler._hosts[closed]['robots_expires'] > expires
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('prefetched', [False, True])
+def test_dns_resolve_does_not_queue_behind_prefetches(prefetched):
+    cache = DNSCache(workers=1, wait=0.1)
+    release = threading.Event()
+    cache._executor.submit(release.wait, 10)
+    try:
+        if prefetched:
+            cache.prefetch('localhost')
+        started = time.monotonic()
+        assert cache.resolve('localhost')
+        assert time.monotonic() - started < 5
+        assert 'localhost' not in cache._pending
+    finally:
+        release.set()
+        cache.close()
+
+
+def test_image_stats_match_whole_image_moments():
+    pixels = np.random.default_rng(0).integers(0, 256, (700, 300, 3), dtype=np.uint8)
+    stats = ImageStats.from_pixels(pixels, (300, 700))
+    values = pixels.reshape(-1, 3).astype(np.float64)
+    assert stats.pixels == 700 * 300
+    assert np.allclose(stats.mean, values.mean(axis=0))
+    assert np.allclose(stats.std, values.std(axis=0))
+
+
+@pytest.mark.parametrize('fast', [False, True])
+def test_variants_leave_source_unchanged(tmp_path, fast):
+    source = tmp_path / 'img.jpg'
+    original = make_jpeg(source, (800, 600))
+    variant = tmp_path / 'variants' / 'img.jpg'
+    error, stats = process_image_file(str(source), None, fast, collect_stats=True,
+                                      variants=[(str(variant), (64, 64), 'stretch')])
+    assert error is None
+    assert source.read_bytes() == original
+    with Image.open(variant) as img:
+        assert img.size == (64, 64)
+    assert stats.pixels == 800 * 600
+
+
+def test_variants_leave_store_objects_unchanged(tmp_path, image_server):
+    site, base = image_server
+    for i in range(3):
+        make_jpeg(site / f"img{i}.jpg", (400, 300), seed=i)
+    scraper = make_scraper(tmp_path, content_store=True, variants=[(64, 64)])
+    scraper.download_images({'cats': [{'url': f"{base}/img{i}.jpg"} for i in range(3)]})
+
+    objects = [os.path.join(root, name) for root, _, names in os.walk(tmp_path / 'dataset' / '_store' / 'objects')
+               for name in names]
+    assert len(objects) == 3
+    for path in objects:
+        with open(path, 'rb') as f:
+            assert os.path.basename(path).startswith(hashlib.sha256(f.read()).hexdigest())
+    assert len(os.listdir(tmp_path / 'dataset' / 'variants' / '64x64' / 'cats')) == 3
+
+
+def test_content_store_keeps_identical_bytes_once(tmp_path, image_server):
+    site, base = image_server
+    same = make_jpeg(site / 'a.jpg')
+    (site / 'b.jpg').write_bytes(same)
+    make_jpeg(site / 'c.jpg', seed=1)
+    images = {'cats': [{'url': f"{base}/a.jpg"}, {'url': f"{base}/c.jpg"}], 'dogs': [{'url': f"{base}/b.jpg"}]}
+    make_scraper(tmp_path, content_store=True).download_images(images)
+
+    store = tmp_path / 'dataset' / '_store'
+    objects = [name for _, _, names in os.walk(store / 'objects') for name in names]
+    assert sorted(objects) == sorted(hashlib.sha256(data).hexdigest() + '.jpg'
+                                     for data in (same, (site / 'c.jpg').read_bytes()))
+    assert len(os.listdir(tmp_path / 'dataset' / 'cats')) == 2
+    dogs = os.listdir(tmp_path / 'dataset' / 'dogs')
+    assert [(tmp_path / 'dataset' / 'dogs' / name).read_bytes() for name in dogs] == [same]
+
+    # URLs in index.jsonl are not fetched again; their category links are restored from the store
+    shutil.rmtree(site)
+    shutil.rmtree(tmp_path / 'dataset' / 'dogs')
+    make_scraper(tmp_path, content_store=True).download_images(images)
+    assert len(os.listdir(tmp_path / 'dataset' / 'dogs')) == 1
+
+
+def test_hamming_index_matches_brute_force():
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 2 ** 64, 5000, dtype=np.uint64)
+    index = HammingIndex(merge_threshold=256)
+    for start in range(0, len(hashes), 700):
+        index.add_batch(hashes[start:start + 700])
+    assert len(index) == len(hashes)
+
+    for i, flips in enumerate([0, 1, 3, 6, 9]):
+        value = int(hashes[i * 100])
+        for bit in rng.choice(64, flips, replace=False):
+            value ^= 1 << int(bit)
+        for radius in (4, 8):
+            ids, distances = index.query(value, radius)
+            expected = [j for j, h in enumerate(hashes) if bin(int(h) ^ value).count('1') <= radius]
+            assert sorted(ids.tolist()) == expected
+            assert list(distances) == sorted(distances)
+
+
+def test_journal_resume_downloads_only_unfinished_images(tmp_path, image_server):
+    site, base = image_server
+    make_jpeg(site / 'a.jpg')
+    make_jpeg(site / 'b.jpg', seed=1)
+    (site / 'index.html').write_text(''.join(f'<img src="{name}.jpg" alt="kittens">' for name in 'abc'))
+
+    def scrape():
+        scraper = make_scraper(tmp_path, discovery='static', journal=True)
+        scraper.base_url = f"{base}/index.html"
+        scraper.scrape()
+        return scraper
+
+    scrape()
+    journal = CrawlJournal(str(tmp_path / 'dataset' / 'journal.sqlite3'))
+    assert journal.counts() == {'done': 2, 'failed': 1}
+    journal.close()
+
+    # The page is not parsed again and finished images are not fetched again
+    (site / 'index.html').unlink()
+    (site / 'a.jpg').unlink()
+    (site / 'b.jpg').unlink()
+    make_jpeg(site / 'c.jpg', seed=2)
+    scraper = scrape()
+    assert scraper.journal.counts() == {'done': 3}
+    assert len(scraper.metadata) == 3
+    assert len(os.listdir(tmp_path / 'dataset' / 'kittens')) == 3
+
+
+def test_journal_requeues_interrupted_downloads(tmp_path):
+    journal = CrawlJournal(str(tmp_path / 'journal.sqlite3'))
+    for name in ('a', 'b', 'c'):
+        journal.add_image({'url': f"https://example.com/{name}.jpg", 'category': 'cats'})
+    journal.start('https://example.com/a.jpg')
+    journal.finish('https://example.com/a.jpg', 'done')
+    journal.start('https://example.com/b.jpg')
+    for _ in range(3):
+        journal.start('https://example.com/c.jpg')
+        journal.finish('https://example.com/c.jpg', 'failed')
+    journal.close()
+
+    # b was in flight when the run stopped; c used up its attempts
+    journal = CrawlJournal(str(tmp_path / 'journal.sqlite3'))
+    assert [record['url'] for record in journal.pending_images(max_attempts=3)] == ['https://example.com/b.jpg']
+    assert len(journal.pending_images(max_attempts=4)) == 2
+    journal.close()
+
+
+def test_near_duplicates_dropped(tmp_path, image_server):
+    site, base = image_server
+    make_jpeg(site / 'a.jpg', (400, 300))
+    with Image.open(site / 'a.jpg') as img:
+        img.resize((200, 150)).save(site / 'a-small.jpg', 'JPEG', quality=70)
+    make_jpeg(site / 'b.jpg', (400, 300), seed=1)
+    scraper = make_scraper(tmp_path, near_dup_threshold=6)
+    scraper.download_images({'cats': [{'url': f"{base}/{name}"} for name in ('a.jpg', 'b.jpg', 'a-small.jpg')]})
+    assert sorted(entry['url'].rsplit('/', 1)[1] for entry in scraper.metadata) in (['a-small.jpg', 'b.jpg'],
+                                                                                     ['a.jpg', 'b.jpg'])
+    assert len(os.listdir(tmp_path / 'dataset' / 'cats')) == 2
+
+
+@pytest.mark.parametrize('options', [dict(max_workers=1), dict(max_workers=4), dict(max_workers=4, retry_queue=True)])
+def test_process_pool_stage_processes_every_download(tmp_path, image_server, options):
+    site, base = image_server
+    for i in range(6):
+        make_jpeg(site / f"img{i}.jpg", (400, 300), seed=i)
+    scraper = make_scraper(tmp_path, target_size=(64, 64), process_pool=True, process_workers=2, queue_size=1,
+                           **options)
+    scraper.download_images({'cats': [{'url': f"{base}/img{i}.jpg"} for i in range(6)]})
+
+    files = os.listdir(tmp_path / 'dataset' / 'cats')
+    assert len(files) == 6
+    for name in files:
+        with Image.open(tmp_path / 'dataset' / 'cats' / name) as img:
+            assert img.size == (64, 64)
+    assert len(scraper.metadata) == 6
+
+
+def test_http_cache_revalidates(tmp_path, image_server):
+    site, base = image_server
+    first = make_jpeg(site / 'a.jpg')
+    cache = HTTPCache(str(tmp_path / 'cache'))
+    session = requests.Session()
+
+    assert cache.get(session, f"{base}/a.jpg").content == first
+    assert cache.get(session, f"{base}/a.jpg").content == first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A changed file is fetched again and replaces the cached copy
+    second = make_jpeg(site / 'a.jpg', seed=1)
+    os.utime(site / 'a.jpg', (time.time() + 10, time.time() + 10))
+    assert cache.get(session, f"{base}/a.jpg").content == second
+    assert cache.get(session, f"{base}/a.jpg").content == second
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert cache.total_bytes == len(second)
+
+
+def test_http_cache_keeps_only_fully_read_streams(tmp_path, image_server):
+    site, base = image_server
+    body = make_jpeg(site / 'a.jpg', (600, 400))
+    cache = HTTPCache(str(tmp_path / 'cache'))
+    session = requests.Session()
+
+    # An aborted transfer (e.g. a size rule) leaves nothing behind
+    with cache.get(session, f"{base}/a.jpg", stream=True) as response:
+        next(response.iter_content(1024))
+    assert cache.total_bytes == 0
+    assert not [name for name in os.listdir(tmp_path / 'cache') if name.endswith('.part')]
+
+    with cache.get(session, f"{base}/a.jpg", stream=True) as response:
+        assert b''.join(response.iter_content(1024)) == body
+    with cache.get(session, f"{base}/a.jpg", stream=True) as response:
+        assert b''.join(response.iter_content(1024)) == body
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_http_cache_evicts_least_recently_used(tmp_path, image_server):
+    site, base = image_server
+    sizes = [len(make_jpeg(site / f"{i}.jpg", seed=i)) for i in range(3)]
+    cache = HTTPCache(str(tmp_path / 'cache'), max_bytes=sizes[0] + sizes[1] + sizes[2] // 2)
+    session = requests.Session()
+    for i in (0, 1):
+        cache.get(session, f"{base}/{i}.jpg")
+    time.sleep(0.01)
+    cache.get(session, f"{base}/0.jpg")
+    cache.get(session, f"{base}/2.jpg")
+
+    assert cache.total_bytes == sizes[0] + sizes[2]
+    hits = cache.hits
+    cache.get(session, f"{base}/0.jpg")
+    cache.get(session, f"{base}/1.jpg")
+    assert cache.hits == hits + 1
+
+
+def test_body_check_decides_from_the_header(tmp_path):
+    data = make_jpeg(tmp_path / 'big.jpg', (1200, 900))
+    seen = []
+
+    def check_image(image_format, size):
+        seen.append((image_format, size))
+        return 'too big'
+
+    check = BodyCheck(check_image=check_image)
+    chunks = [data[i:i + 1024] for i in range(0, len(data), 1024)]
+    reasons = [check.feed(chunk) for chunk in chunks]
+    assert seen == [('JPEG', (1200, 900))]
+    assert reasons.index('too big') < 4
+    assert BodyCheck(max_bytes=2048).feed(data) == 'larger than 2048 bytes'
+
+
+def test_download_rules_skip_images_while_streaming(tmp_path, image_server):
+    site, base = image_server
+    make_jpeg(site / 'large.jpg', (400, 300))
+    make_jpeg(site / 'small.jpg', (100, 80), seed=1)
+    Image.fromarray(np.zeros((300, 400, 3), dtype=np.uint8)).save(site / 'large.png')
+    (site / 'page.txt').write_text('not an image')
+    (site / 'cut.jpg').write_bytes(make_jpeg(tmp_path / 'cut.jpg', (400, 300), seed=2)[:5000])
+    scraper = make_scraper(tmp_path, min_image_size=(200, 200), allowed_formats=['jpeg'], verify_downloads=True)
+    names = ['large.jpg', 'small.jpg', 'large.png', 'page.txt', 'cut.jpg']
+    scraper.download_images({'cats': [{'url': f"{base}/{name}"} for name in names]})
+
+    files = os.listdir(tmp_path / 'dataset' / 'cats')
+    assert len(files) == 1
+    with Image.open(tmp_path / 'dataset' / 'cats' / files[0]) as img:
+        assert img.size == (400, 300)
+
+
+def test_array_writer_resumes_at_last_flush(tmp_path):
+    paths = []
+    for i in range(5):
+        paths.append(tmp_path / f"img{i}.png")
+        Image.fromarray(np.full((8, 16, 3), i, dtype=np.uint8)).save(paths[-1])
+    root = str(tmp_path / 'arrays')
+
+    # Interrupted after three appends: only the flushed rows count
+    writer = ArrayWriter(root, (16, 8), flush_every=2)
+    for i in range(3):
+        assert writer.append(f"key{i}", paths[i], i)
+    writer._file.close()
+    assert np.load(os.path.join(root, 'images.npy'), mmap_mode='r').shape == (2, 8, 16, 3)
+    assert np.load(os.path.join(root, 'labels.npy')).tolist() == [0, 1]
+
+    writer = ArrayWriter(root, (16, 8), flush_every=2)
+    assert 'key1' in writer and 'key2' not in writer
+    for i in range(2, 5):
+        assert writer.append(f"key{i}", paths[i], i)
+    writer.close()
+    images = np.load(os.path.join(root, 'images.npy'), mmap_mode='r')
+    assert images.shape == (5, 8, 16, 3)
+    assert images[:, 0, 0, 0].tolist() == [0, 1, 2, 3, 4]
+    assert np.load(os.path.join(root, 'labels.npy')).tolist() == [0, 1, 2, 3, 4]
+    assert not [name for name in os.listdir(root) if name.endswith('.tmp')]
+
+
+def test_shards_and_arrays_hold_every_sample_once(tmp_path, image_server):
+    site, base = image_server
+    for i in range(4):
+        make_jpeg(site / f"img{i}.jpg", (200, 150), seed=i)
+    images = {'cats': [{'url': f"{base}/img{i}.jpg"} for i in (0, 1)],
+              'dogs': [{'url': f"{base}/img{i}.jpg"} for i in (2, 3)]}
+    options = dict(target_size=(32, 32), shards=True, shard_size=2048, array_output=True, keep_files=False)
+    make_scraper(tmp_path, **options).download_images(images)
+    make_scraper(tmp_path, **options).download_images(images)
+
+    dataset = tmp_path / 'dataset'
+    classes = json.loads((dataset / 'classes.json').read_text())
+    shards = sorted(name for name in os.listdir(dataset / 'shards') if name.endswith('.tar'))
+    assert len(shards) >= 2
+    assert not [name for name in os.listdir(dataset / 'shards') if name.endswith('.part')]
+    samples = {}
+    for name in shards:
+        with tarfile.open(dataset / 'shards' / name) as tar:
+            for member in tar.getmembers():
+                key, ext = member.name.split('.', 1)
+                samples.setdefault(key, {})[ext] = tar.extractfile(member).read()
+    assert len(samples) == 4
+    shard_labels = {}
+    for files in samples.values():
+        assert sorted(files) == ['cls', 'jpg', 'json']
+        record = json.loads(files['json'])
+        assert int(files['cls']) == classes[record['category']]
+        shard_labels[record['url']] = int(files['cls'])
+
+    tensor = np.load(dataset / 'arrays' / 'images.npy', mmap_mode='r')
+    labels = np.load(dataset / 'arrays' / 'labels.npy')
+    assert tensor.shape == (4, 32, 32, 3)
+    assert sorted(labels.tolist()) == sorted(shard_labels.values())
+    assert not os.listdir(dataset / 'cats') and not os.listdir(dataset / 'dogs')
+
+
+@pytest.mark.filterwarnings('ignore:Unverified HTTPS request')
+def test_http2_downloads_survive_goaway(tmp_path):
+    pytest.importorskip('hypercorn')
+    pytest.importorskip('h2')
+    if shutil.which('openssl') is None:
+        pytest.skip('openssl is not installed')
+    from benchmarks.bench_http2 import free_port, make_cert, serve, wait_for_server
+
+    # A server that closes each connection after 100 requests, while 100 streams are in flight
+    certfile, keyfile = make_cert(str(tmp_path))
+    port = free_port()
+    server = multiprocessing.Process(target=serve, args=(port, certfile, keyfile, 0.05, 100), daemon=True)
+    server.start()
+    try:
+        wait_for_server(port)
+        scraper = make_scraper(tmp_path, transport='http2')
+        urls = [f"https://127.0.0.1:{port}/img{i}.jpg" for i in range(300)]
+        scraper.download_images({'cats': [{'url': url} for url in urls]})
+    finally:
+        server.terminate()
+        server.join()
+    assert len(os.listdir(tmp_path / 'dataset' / 'cats')) == 300